@@ -1 +1,8 @@
- 
+"""A simple music-representation language suitable for hymn tunes,
+part-songs, and other brief, vocal-style works"""
+
+__version__ = "0.1.0"
+
+# the tune parsers make_parser can build, kept here so that the command
+# line can offer them without importing any parser
+ENGINES = ("parsimonious", "fast")
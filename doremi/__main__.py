@@ -0,0 +1,7 @@
+"""Run the doremi command line as python -m doremi"""
+
+import sys
+
+from doremi.cli import main
+
+sys.exit(main(prog="python -m doremi"))
@@ -0,0 +1,19 @@
+"""Write files so that no reader, and no failure part way through, ever
+leaves a half-written one in place"""
+
+import contextlib
+import io
+import os
+
+@contextlib.contextmanager
+def atomic_write(path, mode="w", encoding=None):
+    """Open a temporary file beside PATH in MODE for the with block to
+write, then put it in place of PATH, or remove it if the block fails"""
+    tmp = "%s.%d.tmp" % (path, os.getpid())
+    try:
+        with io.open(tmp, mode, encoding=encoding) as f:
+            yield f
+        os.replace(tmp, path)
+    finally:
+        if os.path.exists(tmp):
+            os.remove(tmp)
@@ -0,0 +1,182 @@
+"""Render many Doremi tunes at once, fanning the work out over a pool of
+processes
+
+Jobs come either from a directory of .drm files or from a JSON
+manifest, a list of objects such as
+
+    [{"tune": "tunes/old-hundred.drm",
+      "lyrics": "hymns/praise-god.drmw",
+      "key": "bes major",
+      "shapes": "aikin",
+      "octaves": 0,
+      "template": "default",
+      "output": "old-hundred.ly"}]
+
+in which every field but "tune" is optional.  Input paths are relative
+to the manifest, and outputs relative to the output directory.
+
+"""
+
+from __future__ import print_function
+
+import functools
+import glob
+import json
+import multiprocessing
+import os
+import time
+import traceback
+
+from doremi import timing
+from doremi.render import RenderJob, render
+
+class BatchError(Exception):
+    """Raised when a batch cannot be assembled"""
+    pass
+
+def output_name(infile, fmt):
+    """Return the output file name for INFILE in the format FMT"""
+    base = os.path.splitext(os.path.basename(infile))[0]
+    return "%s.%s" % (base, fmt)
+
+def jobs_from_directory(directory,
+                        outdir,
+                        fmt="ly",
+                        lyricdir=None,
+                        **options):
+    """Return a job for each .drm file in DIRECTORY, using the .drmw file
+of the same name in LYRICDIR (or DIRECTORY) for its words if there is
+one"""
+    jobs = []
+    for infile in sorted(glob.glob(os.path.join(directory, "*.drm"))):
+        lyricfile = os.path.join(lyricdir or directory,
+                                 output_name(infile, "drmw"))
+        if not os.path.exists(lyricfile):
+            lyricfile = None
+        jobs.append(RenderJob(infile,
+                              os.path.join(outdir, output_name(infile, fmt)),
+                              lyricfile=lyricfile,
+                              **options))
+    return jobs
+
+def jobs_from_manifest(manifest, outdir, fmt="ly", **options):
+    """Return the jobs listed in the JSON file MANIFEST; OPTIONS supply
+defaults for fields an entry leaves out"""
+    with open(manifest, "r") as f:
+        try:
+            entries = json.load(f)
+        except ValueError as e:
+            raise BatchError("Manifest '%s' is not valid JSON: %s" %
+                             (manifest, e))
+
+    base = os.path.dirname(os.path.abspath(manifest))
+    def path(fn):
+        return fn and os.path.join(base, fn)
+
+    jobs = []
+    for i, entry in enumerate(entries):
+        if "tune" not in entry:
+            raise BatchError("Entry %d of manifest '%s' has no tune." %
+                             (i + 1, manifest))
+        settings = dict(options)
+        for field, option in [("key", "key"),
+                              ("shapes", "shapes"),
+                              ("octaves", "octaves"),
+                              ("template", "template"),
+                              ("engine", "engine"),
+                              ("template_path", "template_path")]:
+            if entry.get(field) is not None:
+                settings[option] = entry[field]
+        output = entry.get("output") or output_name(entry["tune"], fmt)
+        jobs.append(RenderJob(path(entry["tune"]),
+                              os.path.join(outdir, output),
+                              lyricfile=path(entry.get("lyrics")),
+                              **settings))
+    return jobs
+
+def check_outputs(jobs):
+    """Raise a BatchError if two jobs would write the same output file"""
+    seen = {}
+    for job in jobs:
+        fn = os.path.normpath(job.outfile)
+        if fn in seen:
+            raise BatchError("Both '%s' and '%s' would write '%s'." %
+                             (seen[fn].infile, job.infile, job.outfile))
+        seen[fn] = job
+
+class JobResult(object):
+    """The outcome of one job: its elapsed time and, if it failed, the
+error"""
+    def __init__(self, job, elapsed, error=None, details=None, cached=False):
+        self.job = job
+
+        # the timings collected while running the job, if enabled
+        self.timings = None
+        self.elapsed = elapsed
+        self.cached = cached
+        self.error = error
+        self.details = details
+
+    @property
+    def ok(self):
+        return self.error is None
+
+def run_job(job, cache=None):
+    """Render JOB, capturing rather than raising any error so that one
+bad tune cannot stop the batch"""
+    start = time.time()
+    try:
+        cached = render(job, cache)
+    except Exception as e:
+        result = JobResult(job, time.time() - start,
+                           "%s: %s" % (type(e).__name__, e),
+                           traceback.format_exc())
+    else:
+        result = JobResult(job, time.time() - start, cached=cached)
+
+    # pass the job's timings back, since a worker process's own are
+    # otherwise lost
+    result.timings = timing.collect()
+    return result
+
+def run_batch(jobs, processes=None, cache=None):
+    """Render every job, in a pool of PROCESSES processes (by default,
+one per CPU), and return their results in the order of JOBS; outputs
+are taken from and saved to the RenderCache CACHE if one is given"""
+    check_outputs(jobs)
+
+    for outdir in set(os.path.dirname(job.outfile) for job in jobs):
+        if outdir and not os.path.isdir(outdir):
+            os.makedirs(outdir)
+
+    if processes == 1 or len(jobs) < 2:
+        results = [run_job(job, cache) for job in jobs]
+    else:
+        pool = multiprocessing.Pool(
+            processes, initializer=timing.enable if timing.enabled() else None)
+        try:
+            results = pool.map(functools.partial(run_job, cache=cache),
+                               jobs,
+                               chunksize=1)
+        finally:
+            pool.close()
+            pool.join()
+
+    for result in results:
+        timing.merge(result.timings)
+    return results
+
+def summarize(results, elapsed, out):
+    """Write a report of RESULTS, which took ELAPSED seconds, to OUT"""
+    failed = [r for r in results if not r.ok]
+    for r in failed:
+        print("FAILED %s: %s" % (r.job.infile, r.error), file=out)
+    print("%d of %d tunes rendered in %.2fs (%d failed)" %
+          (len(results) - len(failed), len(results), elapsed, len(failed)),
+          file=out)
+
+def summarize_cache(results, out):
+    """Write the cache hits and misses among RESULTS to OUT"""
+    hits = len([r for r in results if r.cached])
+    print("cache: %d hits, %d misses" % (hits, len(results) - hits),
+          file=out)
@@ -0,0 +1,267 @@
+"""Collect many rendered tunes into one Lilypond \\book, so that a whole
+collection is typeset by one LilyPond run (or one run per chunk)
+instead of one run per tune
+
+Each tune's music variables are renamed with a prefix of its own, so
+that, for instance, every tune's exportedvoice_soprano_music can stand
+side by side at the top level, and its \\paper, \\header and \\score
+blocks go into a \\bookpart of their own.
+
+"""
+
+import os
+import re
+import time
+import traceback
+from io import StringIO
+
+from doremi.atomic import atomic_write
+from doremi.batch import JobResult
+from doremi.render import get_runner, render_lilypond
+from doremi.runner import DEFAULT_TIMEOUT, LilypondError
+
+MUSIC_VARIABLE = re.compile(r"\bexportedvoice_[A-Za-z0-9\-#]+_music\b")
+VERSION = re.compile(r"^\s*\\version\s+\"([^\"]*)\"[^\n]*\n?", re.M)
+ASSIGNMENT = re.compile(r"\s*[A-Za-z][A-Za-z_\-]*\s*=")
+
+# top-level commands that begin an item of their own
+ITEM_COMMAND = re.compile(r"\\(?:book|bookpart|header|include|layout|"
+                          r"midi|paper|score|version)(?![A-Za-z])")
+
+class BookError(Exception):
+    """Raised when a book cannot be assembled"""
+    pass
+
+def tune_prefix(i):
+    """Return the variable prefix for the Ith tune in a book; Lilypond
+names cannot hold digits, so the number is written in letters"""
+    letters = ""
+    i += 1
+    while i:
+        i, r = divmod(i - 1, 26)
+        letters = chr(ord("a") + r) + letters
+    return "tune%s" % letters
+
+def _skip_string(text, i):
+    # the index of the quote closing the string opening at I, minding
+    # escaped quotes
+    i += 1
+    while i < len(text) and text[i] != '"':
+        i += 2 if text[i] == "\\" else 1
+    return i
+
+def _scheme_end(text, i):
+    # the index just after the Scheme expression #( at I
+    depth = 0
+    i += 1
+    while i < len(text):
+        c = text[i]
+        if c == '"':
+            i = _skip_string(text, i)
+        elif c == ";":
+            end = text.find("\n", i)
+            i = len(text) if end < 0 else end
+        elif c == "(":
+            depth += 1
+        elif c == ")":
+            depth -= 1
+            if depth == 0:
+                return i + 1
+        i += 1
+    return len(text)
+
+def top_level_items(text):
+    """Split the Lilypond TEXT into its top-level items: blocks and
+braced assignments, each running until its outermost braces close, and
+Scheme expressions, commands and assignments without braces, each
+running until the next item begins"""
+    items = []
+    depth = 0
+    start = 0
+    # whether anything but comments has come since START, so that
+    # comments stay with the item after them
+    code = False
+    i = 0
+    while i < len(text):
+        c = text[i]
+        if c == '"':
+            i = _skip_string(text, i)
+            code = True
+        elif text.startswith("%{", i):
+            end = text.find("%}", i + 2)
+            i = len(text) if end < 0 else end + 1
+        elif c == "%":
+            end = text.find("\n", i)
+            i = len(text) if end < 0 else end
+        elif c == "{":
+            depth += 1
+            code = True
+        elif c == "}":
+            depth -= 1
+            if depth == 0:
+                items.append(text[start:i + 1].strip())
+                start = i + 1
+                code = False
+        elif depth == 0 and not c.isspace():
+            assigning = text[start:i].strip().endswith("=")
+            if text.startswith("#(", i):
+                # a Scheme expression of its own, unless it is an
+                # assignment's value
+                end = _scheme_end(text, i)
+                if code and not assigning:
+                    items.append(text[start:i].strip())
+                    start = i
+                items.append(text[start:end].strip())
+                start = end
+                code = False
+                i = end
+                continue
+            if (code and not assigning and text[i - 1].isspace() and
+                    (ITEM_COMMAND.match(text, i) or
+                     ASSIGNMENT.match(text, i))):
+                # something else begins, so what went before is whole
+                items.append(text[start:i].strip())
+                start = i
+            code = True
+        i += 1
+    rest = text[start:].strip()
+    if rest:
+        items.append(rest)
+    return items
+
+def is_top_level(item):
+    """Return whether the top-level ITEM of a tune must stay at the top
+level of a book (an assignment, a Scheme expression or an \\include),
+rather than go in its \\bookpart"""
+    return bool(ASSIGNMENT.match(item) or item.startswith("#") or
+                item.startswith("\\include"))
+
+class BookPart(object):
+    """One tune's share of a book: its music variables, which go at the
+top level, and the rest of its blocks, which go in a \\bookpart"""
+    def __init__(self, ly, prefix):
+        self.version = None
+        match = VERSION.search(ly)
+        if match:
+            self.version = match.group(1)
+            ly = VERSION.sub("", ly)
+
+        ly = MUSIC_VARIABLE.sub(lambda m: "%s_%s" % (prefix, m.group(0)), ly)
+
+        self.variables = []
+        self.blocks = []
+        for item in top_level_items(ly):
+            if is_top_level(item):
+                self.variables.append(item)
+            else:
+                self.blocks.append(item)
+
+def write_book(fp, parts):
+    """Write a \\book holding the BookParts PARTS to the file-like
+object FP"""
+    versions = [part.version for part in parts if part.version]
+    if versions:
+        fp.write('\\version "%s"\n\n' % versions[0])
+
+    written = set()
+    for part in parts:
+        for variable in part.variables:
+            if variable in written:
+                continue # e.g. the same paper size set by every tune
+            written.add(variable)
+            fp.write(variable)
+            fp.write("\n\n")
+
+    fp.write("\\book {\n")
+    for part in parts:
+        fp.write("\\bookpart {\n")
+        for block in part.blocks:
+            fp.write(block)
+            fp.write("\n")
+        fp.write("}\n")
+    fp.write("}\n")
+
+def book_text(parts):
+    """Return the text of a \\book holding PARTS"""
+    out = StringIO()
+    write_book(out, parts)
+    return out.getvalue()
+
+def split_chunks(items, chunks):
+    """Split ITEMS into at most CHUNKS runs of nearly equal length,
+keeping their order"""
+    chunks = max(1, min(chunks, len(items)))
+    size, extra = divmod(len(items), chunks)
+    result = []
+    start = 0
+    for i in range(chunks):
+        end = start + size + (1 if i < extra else 0)
+        result.append(items[start:end])
+        start = end
+    return result
+
+def chunk_names(outfile, chunks):
+    """Return the output file names for a book split into CHUNKS, e.g.
+hymnal-1.pdf, hymnal-2.pdf, ... for hymnal.pdf"""
+    if chunks == 1:
+        return [outfile]
+    base, ext = os.path.splitext(outfile)
+    return ["%s-%d%s" % (base, i + 1, ext) for i in range(chunks)]
+
+def render_parts(jobs):
+    """Render each job to a BookPart, returning the parts of those that
+rendered and a JobResult for every job"""
+    parts = []
+    results = []
+    for i, job in enumerate(jobs):
+        start = time.time()
+        try:
+            parts.append(BookPart(render_lilypond(job), tune_prefix(i)))
+        except Exception as e:
+            results.append(JobResult(job, time.time() - start,
+                                     "%s: %s" % (type(e).__name__, e),
+                                     traceback.format_exc()))
+        else:
+            results.append(JobResult(job, time.time() - start))
+    return parts, results
+
+def render_book(jobs, outfile, chunks=1, lilypond=None, timeout=None):
+    """Render the tunes described by JOBS into the book OUTFILE (a .ly
+or .pdf file), split into CHUNKS books typeset side by side; return a
+JobResult for every job and the names of the files written
+
+A tune that fails to render is left out of the book and reported in
+its result."""
+    if not jobs:
+        raise BookError("A book needs at least one tune.")
+    if os.path.splitext(outfile)[1] not in (".ly", ".pdf"):
+        raise BookError("A book must be a .ly or .pdf file, not '%s'." %
+                        outfile)
+
+    parts, results = render_parts(jobs)
+    if not parts:
+        return results, []
+
+    groups = split_chunks(parts, chunks)
+    names = chunk_names(outfile, len(groups))
+
+    outdir = os.path.dirname(outfile)
+    if outdir and not os.path.isdir(outdir):
+        os.makedirs(outdir)
+
+    if outfile.endswith(".ly"):
+        for name, group in zip(names, groups):
+            with atomic_write(name, "w", "utf-8") as f:
+                write_book(f, group)
+        return results, names
+
+    runner = get_runner(lilypond, float(timeout or DEFAULT_TIMEOUT))
+    for name in names:
+        if os.path.exists(name):
+            os.remove(name)
+    typeset = runner.run_many([(book_text(group), name[:-4])
+                               for name, group in zip(names, groups)])
+    failed = [r.error for r in typeset if not r.ok]
+    if failed:
+        raise LilypondError("\n".join(failed))
+    return results, names
@@ -0,0 +1,154 @@
+"""Rebuild only the outputs whose inputs have changed, once or whenever
+the library changes
+
+Each build records, for every output, the files it was made from (the
+tune, its lyrics and the template files) with their sizes and
+modification times, and the options and code it was rendered with.  An
+output is rebuilt when it is missing, when it has no record, when it
+failed last time, or when any of those has changed since.
+
+"""
+
+import json
+import os
+import time
+
+import doremi
+from doremi.atomic import atomic_write
+from doremi.batch import run_batch
+from doremi.sources import source_digest
+from doremi.templates import TemplateError, default_registry
+
+STATE_FILE = ".doremi-build.json"
+
+def job_inputs(job):
+    """Return the files the output of JOB is made from"""
+    inputs = [job.infile]
+    if job.lyricfile:
+        inputs.append(job.lyricfile)
+    inputs.extend(default_registry(job.template_path).files(job.template))
+    return inputs
+
+def job_options(job):
+    """Return the settings besides its input files that determine the
+output of JOB"""
+    return {"version": doremi.__version__,
+            # the code, which can change without the version
+            "source": source_digest(),
+            "key": job.key,
+            "shapes": job.shapes,
+            "octaves": job.octaves,
+            "template": job.template,
+            "template_path": job.template_path,
+            "engine": job.engine,
+            "lilypond": job.lilypond,
+            # a list, as it is read back from JSON
+            "measures": list(job.measures) if job.measures else None}
+
+def fingerprint(fn):
+    """Return the size and modification time of FN, or None if it is
+missing"""
+    try:
+        st = os.stat(fn)
+    except OSError:
+        return None
+    return [st.st_size, st.st_mtime_ns]
+
+class BuildState(object):
+    """The record of what every output was last built from, kept in the
+JSON file PATH"""
+    def __init__(self, path):
+        self.path = path
+        self.outputs = {}
+        try:
+            with open(path, "r") as f:
+                self.outputs = json.load(f)
+        except (IOError, OSError, ValueError):
+            pass # no usable record, so everything will be rebuilt
+
+    def record(self, job, failed=False):
+        """Remember the inputs and options JOB's output was built from,
+or that building it FAILED"""
+        try:
+            inputs = job_inputs(job)
+        except TemplateError:
+            inputs = [job.infile]
+        self.outputs[os.path.abspath(job.outfile)] = {
+            "inputs": dict((os.path.abspath(fn), fingerprint(fn))
+                           for fn in inputs),
+            "options": job_options(job),
+            "failed": failed}
+
+    def forget(self, job):
+        self.outputs.pop(os.path.abspath(job.outfile), None)
+
+    def stale(self, job, retry_failed=True):
+        """Return True if the output of JOB must be rebuilt; one that
+failed last time is only tried again if RETRY_FAILED is true or its
+inputs have changed"""
+        entry = self.outputs.get(os.path.abspath(job.outfile))
+        if entry is None or entry["options"] != job_options(job):
+            return True
+        if entry.get("failed"):
+            if retry_failed:
+                return True
+        elif not os.path.exists(job.outfile):
+            return True
+        try:
+            inputs = job_inputs(job)
+        except TemplateError:
+            return True # let rendering report the problem
+        if set(os.path.abspath(fn) for fn in inputs) != set(entry["inputs"]):
+            return True
+        return any(fingerprint(fn) != fp
+                   for fn, fp in entry["inputs"].items())
+
+    def prune(self, jobs):
+        """Drop the records of outputs no job in JOBS builds"""
+        keep = set(os.path.abspath(job.outfile) for job in jobs)
+        for outfile in list(self.outputs):
+            if outfile not in keep:
+                del self.outputs[outfile]
+
+    def save(self):
+        outdir = os.path.dirname(self.path)
+        if outdir and not os.path.isdir(outdir):
+            os.makedirs(outdir)
+        with atomic_write(self.path) as f:
+            json.dump(self.outputs, f, indent=1, sort_keys=True)
+
+def build(jobs, state, processes=None, cache=None, retry_failed=True):
+    """Render those of JOBS whose outputs are stale according to the
+BuildState STATE, record how each went, and return their JobResults
+and the number of outputs already up to date"""
+    stale = [job for job in jobs if state.stale(job, retry_failed)]
+
+    # an output being rebuilt has no valid record until it is done
+    for job in stale:
+        state.forget(job)
+
+    results = run_batch(stale, processes, cache) if stale else []
+    for result in results:
+        state.record(result.job, failed=not result.ok)
+    state.prune(jobs)
+    state.save()
+    return results, len(jobs) - len(stale)
+
+def watch(make_jobs, state, report, interval=0.5, processes=None,
+          cache=None):
+    """Every INTERVAL seconds, call MAKE_JOBS for the current list of
+jobs (so that new tunes are noticed) and build the stale ones, passing
+REPORT each non-empty round's results, up-to-date count and elapsed
+time; runs until interrupted
+
+A tune that fails is not tried again until its inputs change."""
+    try:
+        while True:
+            start = time.time()
+            results, fresh = build(make_jobs(), state, processes, cache,
+                                   retry_failed=False)
+            if results:
+                report(results, fresh, time.time() - start)
+            time.sleep(interval)
+    except KeyboardInterrupt:
+        pass
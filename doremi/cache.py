@@ -0,0 +1,172 @@
+"""A persistent, content-addressed cache of rendered output files
+
+An output is identified by a hash of everything that determines it:
+the tune and lyric texts, the template files, the rendering options,
+and the version and sources of this package, so that changing the
+parser or renderer never serves output it would no longer make.  When
+nothing has changed, the cached file is copied into place instead of
+parsing and typesetting again.
+
+"""
+
+import hashlib
+import os
+import shutil
+import time
+
+import doremi
+from doremi.atomic import atomic_write
+from doremi.grammar import default_cache_dir
+from doremi.sources import source_digest
+from doremi.templates import default_registry
+
+DEFAULT_MAX_BYTES = 256 * 1024 * 1024
+
+# how often, in seconds, a cache directory is walked to evict old files
+EVICT_INTERVAL = 60 * 60
+
+# the file whose modification time records the last eviction
+EVICT_STAMP = ".evicted"
+
+class CacheDirectory(object):
+    """A directory of cached files, limited to MAX_BYTES in total by
+evicting the least recently used"""
+    def __init__(self, directory, max_bytes=DEFAULT_MAX_BYTES):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.stats = {"hits": 0, "misses": 0, "stores": 0, "evictions": 0}
+
+    def entries(self):
+        """Return (last use, size, path) for every cached file"""
+        result = []
+        for dirpath, dirnames, filenames in os.walk(self.directory):
+            for name in filenames:
+                if name == EVICT_STAMP:
+                    continue
+                fn = os.path.join(dirpath, name)
+                try:
+                    st = os.stat(fn)
+                except OSError:
+                    continue
+                result.append((st.st_mtime, st.st_size, fn))
+        return result
+
+    def evict(self):
+        """Remove the least recently used files until the cache is no
+larger than its limit"""
+        entries = sorted(self.entries())
+        total = sum(size for mtime, size, fn in entries)
+        for mtime, size, fn in entries:
+            if total <= self.max_bytes:
+                break
+            try:
+                os.remove(fn)
+            except OSError:
+                continue
+            total -= size
+            self.stats["evictions"] += 1
+        return total
+
+    def evict_if_due(self, interval=EVICT_INTERVAL):
+        """Evict as evict() does if it was last done more than INTERVAL
+seconds ago, so that a run costs one stat rather than a walk of the
+whole cache; return True if it did"""
+        stamp = os.path.join(self.directory, EVICT_STAMP)
+        try:
+            if time.time() - os.stat(stamp).st_mtime < interval:
+                return False
+        except OSError:
+            if not os.path.isdir(self.directory):
+                return False # nothing cached, so nothing to evict
+        self.evict()
+        try:
+            with open(stamp, "w"):
+                pass
+        except (IOError, OSError):
+            pass
+        return True
+
+    def clear(self):
+        """Remove every cached file"""
+        shutil.rmtree(self.directory, ignore_errors=True)
+
+class RenderCache(CacheDirectory):
+    """The cache of rendered output files, by default in
+~/.cache/doremi/render"""
+    def __init__(self, directory=None, max_bytes=DEFAULT_MAX_BYTES):
+        CacheDirectory.__init__(self,
+                                directory or os.path.join(default_cache_dir(),
+                                                          "render"),
+                                max_bytes)
+
+    def key(self, job):
+        """Return the hash identifying the output of JOB, or None if one
+of its input files cannot be read, so that rendering reports it"""
+        h = hashlib.sha256()
+        def add(label, data):
+            if not isinstance(data, bytes):
+                data = str(data).encode("utf-8")
+            # prefix each part with its length, so that no two
+            # different sets of inputs run together the same way
+            h.update(("%s:%d:" % (label, len(data))).encode("utf-8"))
+            h.update(data)
+        def add_file(label, fn):
+            if fn:
+                with open(fn, "rb") as f:
+                    add(label, f.read())
+            else:
+                add(label, "")
+
+        add("version", doremi.__version__)
+        add("source", source_digest())
+        try:
+            add_file("tune", job.infile)
+            add_file("lyric", job.lyricfile)
+            for fn in default_registry(job.template_path).files(job.template):
+                add_file("template", fn)
+        except (IOError, OSError):
+            return None
+        add("key", (job.key or "").lower())
+        add("shapes", (job.shapes or "").lower())
+        add("octaves", job.octaves)
+        if job.measures is not None:
+            add("measures", "%d-%d" % job.measures)
+        add("format", os.path.splitext(job.outfile)[1])
+        if job.outfile.endswith(".pdf"):
+            # a stand-in LilyPond must not fill the cache with its PDFs
+            add("lilypond", job.lilypond or os.environ.get("LILYPOND") or
+                "lilypond")
+        return h.hexdigest()
+
+    def path(self, key, ext):
+        return os.path.join(self.directory, key[:2], key + ext)
+
+    def fetch(self, key, outfile):
+        """Copy the cached output for KEY to OUTFILE and return True, or
+return False if there is none"""
+        fn = self.path(key, os.path.splitext(outfile)[1])
+        try:
+            shutil.copyfile(fn, outfile)
+        except (IOError, OSError):
+            self.stats["misses"] += 1
+            return False
+
+        # mark the entry as recently used
+        try:
+            os.utime(fn, None)
+        except OSError:
+            pass
+        self.stats["hits"] += 1
+        return True
+
+    def store(self, key, outfile):
+        """Save a copy of the freshly rendered OUTFILE under KEY"""
+        fn = self.path(key, os.path.splitext(outfile)[1])
+        try:
+            if not os.path.isdir(os.path.dirname(fn)):
+                os.makedirs(os.path.dirname(fn))
+            with open(outfile, "rb") as src, atomic_write(fn, "wb") as f:
+                shutil.copyfileobj(src, f)
+        except (IOError, OSError):
+            return # the cache is an optimization; carry on without it
+        self.stats["stores"] += 1
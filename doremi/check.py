@@ -0,0 +1,364 @@
+"""Check tunes and lyrics for the problems that would stop them
+rendering, without rendering them
+
+For each tune, and the lyrics paired with it, check that
+
+  * the tune and the lyrics parse;
+  * every voice the lyrics name is a voice of the tune;
+  * the key (the tune's own, or the one it is to be rendered in) is
+    one Doremi can render;
+  * no slur is left open at the end of a voice;
+  * every |: is closed by :| or by a complete set of endings (!, 1!
+    and 2!), and nothing closes a repeat that is not open;
+  * the template has a place for every voice and every voice it needs;
+    and, as warnings, that
+  * every measure is filled by its notes, with none crossing a bar
+    line, and every voice is as long as the first; and
+  * the voices of a four-part choir move without parallel fifths or
+    octaves, stay in order and keep the upper voices within an octave.
+
+Each problem found is a Diagnostic, giving the file, line and column
+where it lies.  Tunes are read with a FastDoremiParser, which accepts
+exactly the language of the grammar, so that positions are known.
+
+"""
+
+from __future__ import print_function
+
+import glob
+import json
+import multiprocessing
+import os
+
+from parsimonious.exceptions import ParseError
+
+from doremi.doremi_parser import SLUR, Note, read_text
+from doremi.fast_parser import DoremiSyntaxError, FastDoremiParser
+from doremi.lilypond import keys
+from doremi.lyric_parser import LyricParser
+from doremi.measures import MeasureIndex
+from doremi.partwriting import problems as part_writing_problems
+from doremi.templates import TemplateError, default_registry
+
+ERROR = "error"
+WARNING = "warning"
+
+class Diagnostic(object):
+    """A problem of SEVERITY ("error" or "warning") found in FILE at LINE
+and COLUMN, counted from 1; both are None if it has no one place"""
+    __slots__ = ["file", "line", "column", "severity", "message"]
+
+    def __init__(self, file, line, column, severity, message):
+        self.file = file
+        self.line = line
+        self.column = column
+        self.severity = severity
+        self.message = message
+
+    def as_dict(self):
+        return dict((name, getattr(self, name)) for name in self.__slots__)
+
+    def __str__(self):
+        if self.line is None:
+            return "%s: %s: %s" % (self.file, self.severity, self.message)
+        return "%s:%d:%d: %s: %s" % (self.file, self.line, self.column,
+                                     self.severity, self.message)
+
+    def __repr__(self):
+        return "Diagnostic(%r)" % str(self)
+
+def location(text, pos):
+    """Return the line and column of the position POS in TEXT"""
+    line = text.count("\n", 0, pos) + 1
+    return line, pos - text.rfind("\n", 0, pos)
+
+class LocatingParser(FastDoremiParser):
+    """A FastDoremiParser that remembers where it found the key, the
+voices and every note and repeat marker"""
+    def reset(self):
+        FastDoremiParser.reset(self)
+        self.keyword_pos = 0
+        self.key_pos = None
+        self.voices_pos = None
+        self.voice_pos = 0
+
+        # for each voice, where it begins and where each of its items is
+        self.voice_positions = []
+        self.item_positions = []
+
+    def assignment(self, keyword):
+        self.keyword_pos = self.pos
+        FastDoremiParser.assignment(self, keyword)
+        if keyword == "voices":
+            self.voices_pos = self.keyword_pos
+
+    def set_key(self, text):
+        FastDoremiParser.set_key(self, text)
+        self.key_pos = self.keyword_pos
+
+    def read_voice(self):
+        self.voice_pos = self.pos
+        return FastDoremiParser.read_voice(self)
+
+    def emit(self, item):
+        # notes and repeats are both handed on before the parser moves
+        # past them
+        FastDoremiParser.emit(self, item)
+        self.item_positions.append(self.pos)
+
+    def end_voice(self):
+        FastDoremiParser.end_voice(self)
+        self.voice_positions.append((self.voice_pos, self.item_positions))
+        self.item_positions = []
+
+class LocatingLyricParser(LyricParser):
+    """A LyricParser that remembers where each voice is named"""
+    def reset(self):
+        LyricParser.reset(self)
+        self.voice_positions = {}
+
+    def visit_voice(self, node, vc):
+        LyricParser.visit_voice(self, node, vc)
+        self.voice_positions.setdefault(self.lyric.voices[-1].name,
+                                        node.start)
+
+class Checker(object):
+    """Collects the Diagnostics for one file, whose text is TEXT"""
+    def __init__(self, fn, text):
+        self.fn = fn
+        self.text = text
+        self.diagnostics = []
+
+    def report(self, pos, message, severity=ERROR):
+        if pos is None:
+            line = column = None
+        else:
+            line, column = location(self.text, pos)
+        self.diagnostics.append(Diagnostic(self.fn, line, column, severity,
+                                           message))
+
+    def report_at(self, line, column, message, severity=ERROR):
+        self.diagnostics.append(Diagnostic(self.fn, line, column, severity,
+                                           message))
+
+def check_repeats(checker, voice, positions):
+    """Report the repeat markers in VOICE that do not nest"""
+    opened = None # where the open repeat began
+    state = None # None, "open", "endings" or "first"
+    for item, pos in zip(voice, positions):
+        if isinstance(item, Note):
+            continue
+        text = item.text
+        if text == "|:":
+            if state is not None:
+                checker.report(pos, "|: before the repeat opened at line "
+                               "%d is closed." % location(checker.text,
+                                                          opened)[0])
+            opened = pos
+            state = "open"
+        elif text == ":|":
+            if state != "open":
+                checker.report(pos, ":| closes no open repeat.")
+            state = None
+        elif text == "!":
+            if state != "open":
+                checker.report(pos, "! begins endings for no open repeat.")
+            state = "endings"
+        elif text == "1!":
+            if state != "endings":
+                checker.report(pos, "1! ends no passage begun with !.")
+            state = "first"
+        elif text == "2!":
+            if state != "first":
+                checker.report(pos, "2! follows no first ending.")
+            state = None
+
+    if state == "open":
+        checker.report(opened, "|: is never closed by :| or endings.")
+    elif state is not None:
+        checker.report(opened, "The endings of the repeat opened here are "
+                       "never finished with 2!.")
+
+def check_slurs(checker, voice, positions):
+    """Report a slur left open at the end of VOICE"""
+    for item, pos in zip(reversed(voice), reversed(positions)):
+        if isinstance(item, Note):
+            if item.flags & SLUR:
+                checker.report(pos, "The slur begun here never ends; the "
+                               "voice ends first.")
+            return
+
+def check_measures(checker, tune, positions):
+    """Warn of the measures of TUNE that its notes do not fill and of
+voices of a different length from the first; POSITIONS are the
+parser's voice_positions"""
+    length = None
+    for voice, (pos, item_positions) in zip(tune, positions):
+        index = MeasureIndex(voice, tune.time, tune.partial)
+        for item, message in index.problems(tune.partial):
+            checker.report(item_positions[item], message, WARNING)
+        if length is None:
+            length = index.total
+            first = voice.name
+        elif index.total != length:
+            checker.report(pos, "The voice '%s' lasts %s whole notes, but "
+                           "'%s' lasts %s." % (voice.name, index.total,
+                                               first, length), WARNING)
+
+def check_part_writing(checker, tune, positions):
+    """Warn of parallel fifths and octaves, crossed voices and wide
+spacing in TUNE; POSITIONS are the parser's voice_positions"""
+    for voice, item, message in part_writing_problems(tune):
+        checker.report(positions[voice][1][item], message, WARNING)
+
+def check_key(checker, key, pos, given=False):
+    """Report KEY if it cannot be rendered; GIVEN means it came from the
+options rather than the tune"""
+    if key.lower() not in keys:
+        if given:
+            message = ("The key '%s', which the tune is to be rendered "
+                       "in, is not one Doremi can render.")
+        else:
+            message = "The key '%s' is not one Doremi can render."
+        checker.report(pos, message % key)
+
+def check_tune(fn, key=None):
+    """Return the Diagnostics for the tune file FN, the parsed Tune (or
+None if it does not parse) and the parser that read it"""
+    text = read_text(fn)
+    checker = Checker(fn, text)
+    parser = LocatingParser()
+    try:
+        tune = parser.parse(text)
+    except DoremiSyntaxError as e:
+        checker.report_at(e.line, e.column, str(e))
+        return checker.diagnostics, None, parser
+    except Exception as e:
+        checker.report(parser.pos, "%s: %s" % (type(e).__name__, e))
+        return checker.diagnostics, None, parser
+
+    if tune.key:
+        check_key(checker, tune.key, parser.key_pos)
+    else:
+        checker.report(None, "The tune has no key.")
+    if key:
+        check_key(checker, key, parser.key_pos, given=True)
+
+    for voice, (pos, positions) in zip(tune, parser.voice_positions):
+        check_repeats(checker, voice, positions)
+        check_slurs(checker, voice, positions)
+    check_measures(checker, tune, parser.voice_positions)
+    check_part_writing(checker, tune, parser.voice_positions)
+    return checker.diagnostics, tune, parser
+
+def check_lyric(fn, tune=None, tune_fn=None):
+    """Return the Diagnostics for the lyric file FN and the parsed Lyric
+(or None if it does not parse), checking its voices against TUNE, read
+from TUNE_FN, if one is given"""
+    text = read_text(fn)
+    checker = Checker(fn, text)
+    parser = LocatingLyricParser()
+    try:
+        lyric = parser.parse(text)
+    except ParseError as e:
+        checker.report_at(e.line(), e.column(), str(e))
+        return checker.diagnostics, None
+    except Exception as e:
+        checker.report(None, "%s: %s" % (type(e).__name__, e))
+        return checker.diagnostics, None
+
+    if tune is not None:
+        names = set(voice.name for voice in tune)
+        for voice in lyric.voices:
+            if voice.name not in names:
+                checker.report(parser.voice_positions.get(voice.name),
+                               "The voice '%s' is not in %s." %
+                               (voice.name, os.path.basename(tune_fn)))
+    return checker.diagnostics, lyric
+
+def check_template(fn, tune, lyric, parser, template, template_path):
+    """Return the Diagnostics for rendering TUNE, read from FN by PARSER,
+and LYRIC with TEMPLATE"""
+    checker = Checker(fn, parser.text)
+    try:
+        problems = default_registry(template_path).check(template, tune,
+                                                         lyric)
+    except TemplateError as e:
+        problems = [str(e)]
+    for problem in problems:
+        checker.report(parser.voices_pos, problem)
+    return checker.diagnostics
+
+def check(tune_fn=None,
+          lyric_fn=None,
+          key=None,
+          template=None,
+          template_path=None):
+    """Return the Diagnostics for the tune file TUNE_FN and the lyric
+file LYRIC_FN, each of which may be None, as rendered in KEY with
+TEMPLATE (if given)"""
+    diagnostics = []
+    tune = lyric = None
+    if tune_fn:
+        found, tune, parser = check_tune(tune_fn, key)
+        diagnostics.extend(found)
+    if lyric_fn:
+        found, lyric = check_lyric(lyric_fn, tune, tune_fn)
+        diagnostics.extend(found)
+    if tune is not None and template:
+        diagnostics.extend(check_template(tune_fn, tune, lyric, parser,
+                                          template, template_path))
+    return diagnostics
+
+def check_job(job):
+    """Return the Diagnostics for the tune and lyrics of the RenderJob
+JOB, capturing any unexpected error as one"""
+    try:
+        return check(job.infile, job.lyricfile, job.key, job.template,
+                     job.template_path)
+    except Exception as e:
+        return [Diagnostic(job.infile or job.lyricfile, None, None, ERROR,
+                           "%s: %s" % (type(e).__name__, e))]
+
+def lyric_jobs(jobs, lyricdir):
+    """Return a job checking each .drmw file in LYRICDIR that none of
+JOBS uses, so that every lyric is at least parsed"""
+    from doremi.render import RenderJob
+
+    used = set(os.path.abspath(job.lyricfile) for job in jobs
+               if job.lyricfile)
+    return [RenderJob(None, None, lyricfile=fn)
+            for fn in sorted(glob.glob(os.path.join(lyricdir, "*.drmw")))
+            if os.path.abspath(fn) not in used]
+
+def check_jobs(jobs, processes=None):
+    """Check every job in JOBS, in a pool of PROCESSES processes (by
+default, one per CPU), and return all the Diagnostics in order of file,
+line and column"""
+    if processes == 1 or len(jobs) < 2:
+        results = [check_job(job) for job in jobs]
+    else:
+        pool = multiprocessing.Pool(processes)
+        try:
+            results = pool.map(check_job, jobs, chunksize=1)
+        finally:
+            pool.close()
+            pool.join()
+
+    diagnostics = {}
+    for found in results:
+        for d in found:
+            # a lyric file shared by several tunes would otherwise be
+            # reported once for each
+            diagnostics[str(d)] = d
+    return sorted(diagnostics.values(),
+                  key=lambda d: (d.file, d.line or 0, d.column or 0))
+
+def write_diagnostics(diagnostics, out, fmt="text"):
+    """Write DIAGNOSTICS to OUT, one to a line, either as text
+(FILE:LINE:COLUMN: SEVERITY: MESSAGE) or as JSON objects"""
+    for d in diagnostics:
+        if fmt == "json":
+            print(json.dumps(d.as_dict(), sort_keys=True), file=out)
+        else:
+            print(str(d), file=out)
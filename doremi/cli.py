@@ -0,0 +1,504 @@
+"""The doremi command line: render Doremi tunes to Lilypond, PDF or
+MIDI one at a time, in batches or books, or from a server
+
+Only argparse is imported before the arguments are read, and the rest
+of doremi only on the paths that need it, so that --help, mistyped
+arguments and editor integrations calling the command on every save
+start quickly.
+
+"""
+
+from __future__ import print_function
+
+import argparse
+import os
+import sys
+import time
+
+from doremi import ENGINES
+
+def argument_parser(prog=None):
+    """Return the parser for the command's arguments"""
+    p = argparse.ArgumentParser(prog=prog)
+    p.add_argument("infile",
+                   nargs="?",
+                   help="the Doremi file to process")
+    p.add_argument("outfile",
+                   nargs="?",
+                   help="the Lilypond output file")
+    p.add_argument("--key", "-k",
+                   help='the key for the output file (e.g. "A major", "c minor", "gis minor")')
+
+    p.add_argument("--shapes", "-s",
+                   help='use shape notes (i.e. "round" (default), "aikin", "sacredharp", "southernharmony", "funk", "walker")')
+
+    p.add_argument("--octaves", "-o", help="transpose up OCTAVES octaves")
+
+    p.add_argument("--measures",
+                   metavar="M-N",
+                   help="render only measures M to N (or only measure M), counting a pickup as measure 0, e.g. to proof a passage")
+
+    p.add_argument("--lyricfile",
+                   "-l",
+                   help="the file containing the lyrics")
+
+    p.add_argument("--template",
+                   "-t",
+                   help='the output template name, e.g. "default", "sacred-harp"')
+
+    p.add_argument("--template-path",
+                   "-T",
+                   action="append",
+                   help="a directory to search for templates before the built-in ones (may be repeated)")
+
+    p.add_argument("--engine",
+                   "-e",
+                   choices=ENGINES,
+                   default="parsimonious",
+                   help='the tune parser to use (default "parsimonious")')
+
+    p.add_argument("--matrix",
+                   "-m",
+                   action="store_true",
+                   help="render every combination of comma-separated --key, --shapes, --octaves and --template values from one parse; the outfile may use {key}, {shapes}, {octaves} and {template}")
+
+    p.add_argument("--batch",
+                   "-b",
+                   help="render every tune in BATCH, a directory of .drm files or a JSON manifest")
+
+    p.add_argument("--outdir",
+                   "-d",
+                   default=".",
+                   help="the directory for batch output files (default: the current directory)")
+
+    p.add_argument("--lyricdir",
+                   help="the directory holding .drmw files named like the tunes in a batch directory")
+
+    p.add_argument("--format",
+                   "-f",
+                   choices=("ly", "pdf", "mid"),
+                   default="ly",
+                   help='the batch output format (default "ly")')
+
+    p.add_argument("--jobs",
+                   "-j",
+                   type=int,
+                   help="the number of batch processes, or of server threads (default: one per CPU)")
+
+    p.add_argument("--build",
+                   action="store_true",
+                   help="render only the batch outputs whose inputs or options have changed")
+
+    p.add_argument("--watch",
+                   action="store_true",
+                   help="keep watching the batch, rebuilding outputs as their inputs change")
+
+    p.add_argument("--interval",
+                   type=float,
+                   default=0.5,
+                   help="seconds between checks for changes when watching (default 0.5)")
+
+    p.add_argument("--book",
+                   help="gather the batch into one Lilypond book, BOOK (a .ly or .pdf file)")
+
+    p.add_argument("--chunks",
+                   type=int,
+                   default=1,
+                   help="split the book into CHUNKS books, typeset side by side (default 1)")
+
+    p.add_argument("--lilypond",
+                   help="the LilyPond executable for PDF output (default $LILYPOND or lilypond)")
+
+    p.add_argument("--timeout",
+                   type=float,
+                   help="the most seconds LilyPond may take over one tune (default 300)")
+
+    p.add_argument("--no-cache",
+                   action="store_true",
+                   help="always parse and render afresh, neither using nor filling the caches")
+
+    p.add_argument("--cache-dir",
+                   help="the render cache directory (default ~/.cache/doremi/render)")
+
+    p.add_argument("--cache-size",
+                   type=int,
+                   default=256,
+                   help="the most megabytes the render cache may hold (default 256)")
+
+    p.add_argument("--parse-cache-dir",
+                   help="the cache of parsed tunes and lyrics (default ~/.cache/doremi/parsed)")
+
+    p.add_argument("--check",
+                   action="store_true",
+                   help="only check the infile and its lyrics, or every tune and lyric file in the batch, reporting each problem found")
+
+    p.add_argument("--diagnostics",
+                   choices=("text", "json"),
+                   default="text",
+                   help='report problems found by --check as "FILE:LINE:COLUMN: SEVERITY: MESSAGE" lines or as JSON objects, one to a line (default "text")')
+
+    p.add_argument("--find-meter",
+                   metavar="METER",
+                   help='list the tunes in the --batch directory (default: the current directory) that fit METER, e.g. "8.7.8.7", "C.M." or a .drmw file, using an index kept in the directory')
+
+    p.add_argument("--similar",
+                   metavar="TUNE",
+                   help="list the tunes in the --batch directory (default: the current directory) whose melodies are most like TUNE's, in any key")
+
+    p.add_argument("--duplicates",
+                   action="store_true",
+                   help="list the pairs of tunes in the --batch directory (default: the current directory) with the same or nearly the same melody")
+
+    p.add_argument("--ranges",
+                   action="store_true",
+                   help="report the range and tessitura of every voice of INFILE, or of every tune in the --batch directory, in the key it is to be rendered in, and the key that best suits its singers")
+
+    p.add_argument("--serve",
+                   metavar="SOCKET",
+                   help='serve render requests as lines of JSON on the Unix socket SOCKET ("-" for standard input and output), with --jobs threads')
+
+    p.add_argument("--profile",
+                   metavar="FILE",
+                   help='write a JSON report of the time spent in each stage to FILE ("-" for standard error)')
+
+    p.add_argument("--cprofile",
+                   metavar="FILE",
+                   help="run under cProfile, saving its statistics to FILE for pstats")
+
+    p.add_argument("--cache-stats",
+                   action="store_true",
+                   help="report render cache hits and misses")
+    return p
+
+def batch_jobs(args, options):
+    """Return the jobs for the batch directory or manifest ARGS.batch"""
+    from doremi.batch import jobs_from_directory, jobs_from_manifest
+
+    if os.path.isdir(args.batch):
+        return jobs_from_directory(args.batch,
+                                   args.outdir,
+                                   fmt=args.format,
+                                   lyricdir=args.lyricdir,
+                                   **options)
+    return jobs_from_manifest(args.batch,
+                              args.outdir,
+                              fmt=args.format,
+                              **options)
+
+def check(args, options):
+    """Check the tunes and lyrics ARGS name, report any problems and
+return the exit status"""
+    from doremi.check import (ERROR, check_jobs, lyric_jobs,
+                              write_diagnostics)
+    from doremi.render import RenderJob
+
+    start = time.time()
+    if args.batch:
+        jobs = batch_jobs(args, options)
+        if os.path.isdir(args.batch):
+            jobs.extend(lyric_jobs(jobs, args.lyricdir or args.batch))
+    elif args.infile.endswith(".drmw"):
+        jobs = [RenderJob(None, None, lyricfile=args.infile)]
+    else:
+        jobs = [RenderJob(args.infile,
+                          args.outfile,
+                          lyricfile=args.lyricfile,
+                          **options)]
+
+    diagnostics = check_jobs(jobs, args.jobs)
+    write_diagnostics(diagnostics, sys.stdout, args.diagnostics)
+    files = set()
+    for job in jobs:
+        files.update(fn for fn in (job.infile, job.lyricfile) if fn)
+    errors = sum(1 for d in diagnostics if d.severity == ERROR)
+    print("%d files checked in %.2fs: %d errors, %d warnings" %
+          (len(files), time.time() - start, errors,
+           len(diagnostics) - errors),
+          file=sys.stderr)
+    return 1 if errors else 0
+
+def find_meter(args):
+    """Print the tunes in the library (the --batch directory, or the
+current directory) that fit the meter ARGS.find_meter and return the
+exit status"""
+    from doremi.index import library_index, normalize_meter
+
+    start = time.time()
+    meter = args.find_meter
+    if meter.endswith(".drmw"):
+        from doremi.lyric_parser import LyricParser
+        meter = LyricParser().parse_file(meter).meter
+    if normalize_meter(meter) is None:
+        print("'%s' is not a fixed meter." % meter, file=sys.stderr)
+        return 1
+
+    index = library_index(args.batch or ".")
+    found = index.find_meter(meter)
+    for fn, entry in found:
+        print("\t".join([os.path.relpath(fn), entry["title"],
+                         entry["meter"], entry["key"], entry["time"]]))
+    print("%d of %d tunes in %s (%s) found in %.1fms, %d parsed" %
+          (len(found), len(index.entries), meter, normalize_meter(meter),
+           (time.time() - start) * 1000, index.stats["parsed"]),
+          file=sys.stderr)
+    return 0 if found else 1
+
+def find_similar(args):
+    """Print the tunes in the library (the --batch directory, or the
+current directory) most like ARGS.similar, or with --duplicates every
+pair nearly alike, and return the exit status"""
+    from doremi.doremi_parser import make_parser
+    from doremi.similarity import library_melodies
+
+    start = time.time()
+    melodies = library_melodies(args.batch or ".")
+    if args.similar:
+        tune = make_parser(args.engine).parse_file(args.similar)
+        found = melodies.similar_tune(tune,
+                                      exclude=os.path.abspath(args.similar))
+        for fn, score, same_start in found:
+            print("%.2f\t%s%s" % (score, os.path.relpath(fn),
+                                  "\tsame incipit" if same_start else ""))
+    else:
+        found = melodies.duplicates()
+        for first, second, score in found:
+            print("%.2f\t%s\t%s" % (score, os.path.relpath(first),
+                                     os.path.relpath(second)))
+    print("%d tunes compared in %.1fms" %
+          (len(melodies), (time.time() - start) * 1000), file=sys.stderr)
+    return 0 if found else 1
+
+def report_ranges(args):
+    """Print the range of every voice of the tune ARGS.infile, or of every
+tune in the --batch directory, with the key that best suits its
+singers; return the exit status, 1 if any note is out of range"""
+    from doremi.doremi_parser import make_parser
+    from doremi.ranges import analyze, note_name, scan_directory
+
+    octaves = int(args.octaves or 0)
+    if args.batch:
+        found = scan_directory(args.batch, octaves, make_parser(args.engine))
+    else:
+        tune = make_parser(args.engine).parse_file(args.infile)
+        found = [(args.infile, tune, analyze(tune, octave_offset=octaves))]
+
+    status = 0
+    for fn, tune, analysis in found:
+        if tune is None:
+            print("%s: %s: %s" % (fn, type(analysis).__name__, analysis))
+            status = 1
+            continue
+        key = (args.key or tune.key or "").lower()
+        if key not in analysis.keys:
+            print("%s: the key '%s' cannot be rendered" % (fn, key))
+            status = 1
+            continue
+        print("%s: %s; best key %s" % (fn, key, analysis.best_key()))
+        for name, low, high, tessitura, outside in analysis.voice_ranges(key):
+            line = "  %-10s %4s-%-4s tessitura %s" % (name, note_name(low),
+                                                     note_name(high),
+                                                     note_name(tessitura))
+            if outside:
+                line += ", %d out of range" % outside
+            print(line)
+            if outside:
+                status = 1
+    return status
+
+def run(args):
+    """Render as ARGS direct and return the exit status"""
+    options = {"key": args.key,
+               "shapes": args.shapes,
+               "octaves": args.octaves,
+               "template": args.template,
+               "template_path": args.template_path,
+               "engine": args.engine,
+               "lilypond": args.lilypond,
+               "timeout": args.timeout,
+               "measures": args.measures}
+
+    if not args.no_cache:
+        from doremi.parse_cache import ParseCache
+        options["parse_cache"] = ParseCache(args.parse_cache_dir).directory
+
+    if args.serve:
+        from doremi.server import RenderServer
+        server = RenderServer(args.jobs,
+                              template_path=args.template_path,
+                              lilypond=args.lilypond,
+                              timeout=args.timeout)
+        server.warm()
+        if args.serve == "-":
+            server.serve_stdio()
+        else:
+            print("serving on %s" % args.serve, file=sys.stderr)
+            server.serve_socket(args.serve)
+        server.close()
+        return 0
+
+    if args.check:
+        return check(args, options)
+
+    if args.find_meter:
+        return find_meter(args)
+
+    if args.similar or args.duplicates:
+        return find_similar(args)
+
+    if args.ranges:
+        return report_ranges(args)
+
+    if args.no_cache:
+        cache = None
+    else:
+        from doremi.cache import RenderCache
+        cache = RenderCache(args.cache_dir, args.cache_size * 1024 * 1024)
+
+        # parsed models are small, so the parse cache gets no option of
+        # its own for its size
+        ParseCache(options["parse_cache"]).evict_if_due()
+
+    if args.batch:
+        from doremi.batch import run_batch, summarize, summarize_cache
+
+        def make_jobs():
+            return batch_jobs(args, options)
+        jobs = make_jobs()
+
+        if args.build or args.watch:
+            from doremi.build import STATE_FILE, BuildState, build, watch
+
+            state = BuildState(os.path.join(args.outdir, STATE_FILE))
+            def report(results, fresh, elapsed):
+                summarize(results, elapsed, sys.stderr)
+                print("%d up to date" % fresh, file=sys.stderr)
+
+            start = time.time()
+            results, fresh = build(jobs, state, args.jobs, cache)
+            report(results, fresh, time.time() - start)
+            if args.watch:
+                watch(make_jobs, state, report, args.interval, args.jobs, cache)
+            return 0 if all(r.ok for r in results) else 1
+
+        start = time.time()
+        if args.book:
+            from doremi.book import BookError, render_book
+            from doremi.runner import LilypondError
+            try:
+                results, names = render_book(jobs, args.book, args.chunks,
+                                             args.lilypond, args.timeout)
+            except (BookError, LilypondError) as e:
+                print("FAILED %s: %s" % (args.book, e), file=sys.stderr)
+                return 1
+            summarize(results, time.time() - start, sys.stderr)
+            return 0 if names and all(r.ok for r in results) else 1
+
+        results = run_batch(jobs, args.jobs, cache)
+        summarize(results, time.time() - start, sys.stderr)
+        if cache is not None:
+            cache.evict_if_due()
+            if args.cache_stats:
+                summarize_cache(results, sys.stderr)
+        return 0 if all(r.ok for r in results) else 1
+
+    if args.matrix:
+        from doremi.doremi_parser import variant_matrix
+        from doremi.render import RenderJob, render_variants
+
+        def values(option):
+            return option.split(",") if option else None
+        variants = variant_matrix(values(args.key),
+                                  values(args.shapes),
+                                  values(args.octaves),
+                                  values(args.template))
+        job = RenderJob(args.infile,
+                        args.outfile,
+                        lyricfile=args.lyricfile,
+                        engine=args.engine,
+                        template_path=args.template_path,
+                        lilypond=args.lilypond,
+                        timeout=args.timeout,
+                        parse_cache=options.get("parse_cache"),
+                        measures=args.measures)
+        start = time.time()
+        results = render_variants(job, variants)
+        failed = [r for r in results if r[2]]
+        for variant, outfile, error in failed:
+            print("FAILED %s: %s" % (outfile, error), file=sys.stderr)
+        print("%d of %d variants rendered in %.2fs (%d failed)" %
+              (len(results) - len(failed), len(results),
+               time.time() - start, len(failed)),
+              file=sys.stderr)
+        return 0 if not failed else 1
+
+    # convert the tune to lilypond and write to the output file
+    from doremi.render import RenderJob, render
+    from doremi.runner import LilypondError
+    try:
+        render(RenderJob(args.infile,
+                         args.outfile,
+                         lyricfile=args.lyricfile,
+                         **options),
+               cache)
+    except LilypondError as e:
+        print("FAILED %s: %s" % (args.outfile, e), file=sys.stderr)
+        return 1
+
+    if cache is not None:
+        cache.evict_if_due()
+        if args.cache_stats:
+            print("cache: %(hits)d hits, %(misses)d misses" % cache.stats,
+                  file=sys.stderr)
+    return 0
+
+def main(argv=None, prog=None):
+    """Run the command with the arguments ARGV (by default, those the
+process was given) and return the exit status"""
+    p = argument_parser(prog)
+    args = p.parse_intermixed_args(argv)
+    if not (args.serve or args.batch or args.find_meter or args.similar or
+            args.duplicates or (args.infile and args.outfile) or
+            ((args.check or args.ranges) and args.infile)):
+        p.error("an infile and an outfile are required unless --batch is given")
+    # errors in what the arguments ask for, which are reported as usage
+    # errors rather than with a traceback
+    from doremi.batch import BatchError
+    from doremi.lilypond import UnknownKeyError
+    from doremi.templates import TemplateError
+    usage_errors = (BatchError, TemplateError, UnknownKeyError)
+    if args.measures:
+        from doremi.measures import MeasureError, parse_measures
+        try:
+            args.measures = parse_measures(args.measures)
+        except MeasureError as e:
+            p.error(str(e))
+        usage_errors += (MeasureError,)
+
+    if args.profile:
+        from doremi import timing
+        timing.enable()
+
+    start = time.time()
+    try:
+        if args.cprofile:
+            import cProfile
+            profiler = cProfile.Profile()
+            status = profiler.runcall(run, args)
+            profiler.dump_stats(args.cprofile)
+        else:
+            status = run(args)
+    except usage_errors as e:
+        p.error(str(e))
+
+    if args.profile:
+        import json
+        report = timing.report()
+        report["elapsed"] = time.time() - start
+        if args.profile == "-":
+            json.dump(report, sys.stderr, indent=1, sort_keys=True)
+            print(file=sys.stderr)
+        else:
+            with open(args.profile, "w") as f:
+                json.dump(report, f, indent=1, sort_keys=True)
+    return status
+
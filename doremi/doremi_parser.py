@@ -7,12 +7,18 @@ part-songs, and other brief, vocal-style works.
 # the template
 
 import codecs
-import copy
+import itertools
+from io import StringIO
+from sys import intern
 
-from parsimonious import Grammar, NodeVisitor
+from parsimonious import NodeVisitor
 
+from doremi import timing
+from doremi.grammar import doremi_grammar
 from doremi.lilypond import *
 from doremi.lyric_parser import Lyric, LyricParser
+from doremi.parse_cache import cached_parse
+from doremi.templates import TemplateError, default_registry, voices_missing
 
 class RepeatMarker(object):
     def __init__(self, text):
@@ -33,87 +39,137 @@ class RepeatMarker(object):
         elif self.text == "||":
             return r'\bar "||"'
 
+# the common note modifiers are stored as bit flags rather than strings
+SLUR = 1
+TIE = 2
+FERMATA = 4
+END_SLUR = 8
+
+MODIFIER_FLAGS = [("slur", SLUR),
+                  ("tie", TIE),
+                  ("fermata", FERMATA),
+                  ("end slur", END_SLUR)]
+
+FLAGS_BY_NAME = dict(MODIFIER_FLAGS)
+
+# durations short enough to be beamed rather than slurred
+BEAMED = frozenset(["8", "8.", "16"])
+
+def _suffix(flags, beamed):
+    # ties only ever connect two notes, so need not be explicitly
+    # terminated
+    tie = "~" if flags & TIE else ""
+
+    # start or end slurs (or beams) as indicated by modifiers
+    slur = ""
+    if flags & SLUR:
+        slur = "[" if beamed else "("
+    elif flags & END_SLUR:
+        slur = "]" if beamed else ")"
+
+    # add a fermata
+    fermata = r"\fermata" if flags & FERMATA else ""
+
+    return tie + slur + fermata
+
+# the Lilypond text following the duration, for every combination of
+# flags, unbeamed and beamed
+SUFFIXES = [(_suffix(flags, False), _suffix(flags, True))
+            for flags in range(16)]
+
+# the uncommon modifiers (octave marks, time changes and repeats) are
+# kept as tuples, identical ones shared between notes
+_extras = {(): ()}
+
+def shared_extra(modifiers):
+    """Return a shared tuple equal to MODIFIERS"""
+    modifiers = tuple(modifiers)
+    try:
+        return _extras[modifiers]
+    except KeyError:
+        _extras[modifiers] = modifiers
+        return modifiers
+
 class Note(object):
     """Represents a note (or rest) in a musical work, including scale
 degree, duration, octave, and other information"""
+    __slots__ = ("pitch", "duration", "octave", "flags", "extra")
+
     def __init__(self,          # initialize with empty properties
                  pitch=None,    # because they are built on-the-fly
                  duration=None,
                  octave=None,
-                 modifiers=list()):
+                 modifiers=()):
         self.pitch = pitch
         self.duration = duration
         self.octave = octave
         self.modifiers = modifiers
-    def to_lilypond(self, key, octave_offset = 0):
+
+    def _get_modifiers(self):
+        return self.extra + tuple(name for name, flag in MODIFIER_FLAGS
+                                  if self.flags & flag)
+    def _set_modifiers(self, modifiers):
+        flags = 0
+        extra = []
+        for mod in modifiers:
+            flag = FLAGS_BY_NAME.get(mod)
+            if flag:
+                flags |= flag
+            else:
+                extra.append(mod)
+        self.flags = flags
+        self.extra = shared_extra(extra)
+    modifiers = property(_get_modifiers, _set_modifiers, doc="""The
+note's modifiers as a tuple of strings: any octave marks, time changes
+and repeats first, then "slur", "tie", "fermata" and "end slur", each
+once.  It is computed from the flags, so to change the modifiers assign
+a new sequence to it rather than altering the tuple.""")
+
+    def to_lilypond(self, key, octave_offset = 0, context=None):
         """
-        Convert to an equivalent Lilypond representation
+        Convert to an equivalent Lilypond representation, using the
+        KeyContext CONTEXT for KEY if one is given
         """
 
         # short-circuit if this is a rest
         if self.pitch == "r":
             return "%s%s" % (self.pitch, self.duration)
-        
-        pitch = syllable_to_note(self.pitch, key)
-        octave = self.octave + octave_offset + 1
-
-        # convert internal octave representation to Lilypond, which
-        # uses c->b
-        offset = key_octave_offset[key.lower()]
-
-        local_pitch_level = copy.copy(pitch_level)
-
-        # adjust the local copy of the pitch-level order to go from
-        # la->sol if key is minor
-        if "minor" in key.lower():
-            for k in local_pitch_level.keys():
-                local_pitch_level[k] = local_pitch_level[k] + 2
-                if local_pitch_level[k] > 6:
-                    local_pitch_level[k] -= 7
-        
-        if local_pitch_level[self.pitch] - offset < 0:
-            octave -= 1
-        elif local_pitch_level[self.pitch] - offset > 6:
-            octave += 1
-
-        if octave < 0:
-            octave = "," * abs(octave)
-        else:
-            octave = "'" * octave
 
-        # start or end slurs (or beams) as indicated by modifiers
-        slur = ""
-        if "slur" in self.modifiers:
-            if self.duration in ["8", "8.", "16"]:
-                slur = "["
-            else:
-                slur = "("
-        elif "end slur" in self.modifiers:
-            if self.duration in ["8", "8.", "16"]:
-                slur = "]"
-            else:
-                slur = ")"
-
-        # ties only ever connect two notes, so need not be explicitly
-        # terminated
-        tie = ""
-        if "tie" in self.modifiers:
-            tie = "~"
+        if context is None:
+            context = key_context(key)
 
-        # add a fermata
-        if "fermata" in self.modifiers:
-            fermata = r"\fermata"
-        else:
-            fermata = ""
+        pitch, adjust = context.pitches[self.pitch]
+        octave = context.octave_marks(self.octave + octave_offset + 1 + adjust)
 
         # assemble and return the Lilypond string
-        return "%s%s%s%s%s%s" % (pitch,
-                                 octave,
-                                 self.duration,
-                                 tie,
-                                 slur,
-                                 fermata)
+        return (pitch + octave + self.duration +
+                SUFFIXES[self.flags][self.duration in BEAMED])
             
+# association of doremi shape args and Lilypond shape commands
+SHAPES = {"round": ("", ""),
+          "aikin": (r"\aikenHeads", "Minor"),
+          "sacredharp": (r"\sacredHarpHeads", "Minor"),
+          "southernharmony": (r"\southernHarmonyHeads", "Minor"),
+          "funk": (r"\funkHeads", "Minor"),
+          "walker": (r"\walkerHeads", "Minor")}
+
+def shape_command(shapes, key):
+    """Return the Lilypond command for the shape-note style SHAPES in
+KEY"""
+    if shapes == None:
+        return ""
+
+    lparts = SHAPES[shapes.lower()]
+    lshapes = lparts[0]
+
+    # there's a different command for minor
+    if "minor" in key:
+        lshapes += lparts[1]
+    return lshapes
+
+# notes are rendered and written in batches of this many
+NOTES_PER_WRITE = 256
+
 class Voice(list):
     """Represents a named part in a vocal-style composition"""
     def __init__(self,
@@ -123,54 +179,89 @@ class Voice(list):
         self.name = name
         self.octave = octave # the starting octave for the part
     def last_note(self):
-        index = -1
-        try:
-            while type(self[index]) != Note:
-                index -= 1
-            return self[index]
-        except IndexError:
-            raise IndexError("No previous notes")
+        for item in reversed(self):
+            if type(item) is Note:
+                return item
+        raise IndexError("No previous notes")
     def to_lilypond(self,
                     time,
                     key,
                     octave_offset=0,
                     shapes=None,
-                    template="default"):
-        """A representation of the voice as a Lilypond string"""
-
-        # association of doremi shape args and Lilypond shape commands
-        shape_dic = {"round": ("", ""),
-                     "aikin": (r"\aikenHeads", "Minor"),
-                     "sacredharp": (r"\sacredHarpHeads", "Minor"),
-                     "southernharmony": (r"\southernHarmonyHeads", "Minor"),
-                     "funk": (r"\funkHeads", "Minor"),
-                     "walker": (r"\walkerHeads", "Minor")}
-
-        # build the lilypond shape command
-        if shapes == None:
-            lshapes = ""
-        else:
-            lparts = shape_dic[shapes.lower()]
-            lshapes = lparts[0]
-
-            # there's a different command for minor
-            if "minor" in key:
-                lshapes += lparts[1]
-
-        tmpl = codecs.open("templates/%s-voice.tmpl" % template,
-                           "r",
-                           "utf-8").read()
-        
-        return tmpl % {"name": self.name,
-                       "key": key.replace(" ", " \\"), # a minor -> a \minor
-                       "time": time,
-                       "shapes": lshapes,
-                       "notes": " ".join(
-                           [note.to_lilypond(
-                               key,
-                               octave_offset=octave_offset)
-                            for note in self])}
-
+                    template="default",
+                    registry=None):
+        """A representation of the voice as a Lilypond string, using the
+template found by REGISTRY (by default, the shared registry)"""
+        out = StringIO()
+        self.write_lilypond(out, time, key, octave_offset, shapes, template,
+                            registry)
+        return out.getvalue()
+
+    def write_lilypond(self,
+                       fp,
+                       time,
+                       key,
+                       octave_offset=0,
+                       shapes=None,
+                       template="default",
+                       registry=None):
+        """Write the voice as Lilypond to the file-like object FP, a
+few notes at a time"""
+        lshapes = shape_command(shapes, key)
+
+        registry = registry or default_registry()
+        tmpl = registry.voice_template(template)
+
+        # every note in the voice is rendered in the same key
+        context = key_context(key)
+
+        def write_notes(fp):
+            for start in range(0, len(self), NOTES_PER_WRITE):
+                if start:
+                    fp.write(" ")
+                fp.write(" ".join(
+                    [note.to_lilypond(key,
+                                      octave_offset=octave_offset,
+                                      context=context)
+                     for note in self[start:start + NOTES_PER_WRITE]]))
+
+        tmpl.write(fp, {"name": self.name,
+                        "key": key.replace(" ", " \\"), # a minor -> a \minor
+                        "time": time,
+                        "shapes": lshapes,
+                        "notes": write_notes})
+
+class Variant(object):
+    """One way of rendering a tune: in KEY (or the tune's own key, if
+None), with the shape-note style SHAPES, transposed OCTAVES octaves and
+filled into TEMPLATE"""
+    def __init__(self, key=None, shapes=None, octaves=0, template="default"):
+        self.key = key
+        self.shapes = shapes_name(shapes)
+        self.octaves = int(octaves or 0)
+        self.template = template or "default"
+
+    def fields(self, tune_key=""):
+        """Return the variant's settings as short strings, for naming
+its output; TUNE_KEY stands in for a key of None"""
+        return {"key": (self.key or tune_key).lower().replace(" ", "-"),
+                "shapes": (self.shapes or "round").lower(),
+                "octaves": "%+d" % self.octaves if self.octaves else "0",
+                "template": self.template}
+
+    def __repr__(self):
+        return "Variant(%r, %r, %r, %r)" % (self.key, self.shapes,
+                                            self.octaves, self.template)
+
+def variant_matrix(keys=None, shapes=None, octaves=None, templates=None):
+    """Return a Variant for every combination of KEYS, SHAPES, OCTAVES
+and TEMPLATES; any left out take their usual defaults"""
+    return [Variant(key, shape, octave, template)
+            for key, shape, octave, template
+            in itertools.product(keys or [None],
+                                 shapes or [None],
+                                 octaves or [0],
+                                 templates or ["default"])]
 
 class Tune(list):
     """Represents a vocal-style tune, e.g. a hymn-tune or partsong"""
@@ -193,11 +284,45 @@ class Tune(list):
                     octave_offset=0,
                     shapes=None,
                     lyric=None,
-                    template="default"):
-        """Return a Lilypond version of the tune"""
+                    template="default",
+                    registry=None):
+        """Return a Lilypond version of the tune, using the template
+found by REGISTRY (by default, the shared registry)"""
+        out = StringIO()
+        self.write_lilypond(out, key, octave_offset, shapes, lyric,
+                            template, registry)
+        return out.getvalue()
+
+    def write_lilypond(self,
+                       fp,
+                       key,
+                       octave_offset=0,
+                       shapes=None,
+                       lyric=None,
+                       template="default",
+                       registry=None):
+        """Write a Lilypond version of the tune to the file-like object
+FP (a file, a pipe, or anything else with a write method), rendering
+only one voice at a time"""
 
         key = key_to_lilypond(key)
 
+        if lyric is None:
+            lyric = Lyric()
+
+        registry = registry or default_registry()
+        ly = registry.tune_template(template)
+
+        # make sure the template, key and shapes are all usable before
+        # anything is written
+        missing = voices_missing(ly, [voice.name for voice in self])
+        if missing:
+            raise TemplateError(
+                "Template '%s' needs voices the tune lacks: %s." %
+                (template, ", ".join(missing)))
+        key_context(key)
+        shape_command(shapes, key)
+
         # represent the partial beginning measure a la Lilypond if
         # necessary
         if self.partial:
@@ -205,16 +330,19 @@ class Tune(list):
         else:
             partial = ""
 
-        # TODO: make this allow other templates
-        ly = codecs.open("templates/%s.tmpl" % template, "r", "utf-8").read()
-
-        tmpl_data = {"voices": "\n".join(
-            [voice.to_lilypond(self.time,
-                               key,
-                               octave_offset=octave_offset,
-                               shapes=shapes,
-                               template=template)
-             for voice in self]),
+        def write_voices(fp):
+            for i, voice in enumerate(self):
+                if i:
+                    fp.write("\n")
+                voice.write_lilypond(fp,
+                                     self.time,
+                                     key,
+                                     octave_offset=octave_offset,
+                                     shapes=shapes,
+                                     template=template,
+                                     registry=registry)
+
+        tmpl_data = {"voices": write_voices,
                      "author": lyric.author,
                      "lyrictitle": lyric.title,
                      "meter": lyric.meter,
@@ -227,11 +355,27 @@ class Tune(list):
             tmpl_data["%s_lyrics" % voice.name] = ""
             
         for lvoice in lyric.voices:
-            tmpl_data["%s_lyrics" % lvoice.name] = lvoice.to_lilypond()
-                    
-        return ly % tmpl_data
+            tmpl_data["%s_lyrics" % lvoice.name] = lvoice.write_lilypond
+
+        with timing.stage("render"):
+            ly.write(fp, tmpl_data)
+        if timing.enabled():
+            timing.count("tunes rendered")
+            timing.count("voices rendered", len(self))
                             
 
+def count_parsed(tune):
+    """Count TUNE and its notes as parsed, if timing is enabled"""
+    if timing.enabled():
+        timing.count("tunes parsed")
+        timing.count("notes parsed", sum(1 for voice in tune for note in voice
+                                         if isinstance(note, Note)))
+
+def read_text(fn):
+    """Return the contents of the UTF-8 file FN"""
+    with codecs.open(fn, "r", "utf-8") as f:
+        return f.read()
+
 def get_node_val(node, val_type):
     """Return the value as a string of a child node of the specified type,
 or raise ValueError if none exists"""
@@ -248,48 +392,38 @@ raise a ValueError"""
     except:
         raise ValueError("No string value.")
         
-class DoremiParser(NodeVisitor):
-    def __init__(self, tune_fn):
-        NodeVisitor.__init__(self)
-        # start with an empty tune, voice, note, and list of modifiers
+class TuneBuilder(object):
+    """Assembles a Tune from the pieces of a Doremi file, which a parser
+hands over in the order that it recognizes them"""
+    def reset(self):
+        """Start again with an empty tune, voice, note, and list of
+modifiers"""
         self.tune = Tune()
         self.voice = Voice()
         self.note = Note()
         self.note_modifiers = []
 
+        # the last note added to the current voice, kept so that each
+        # new note need not search the voice for it
+        self.last = None
+
         # at the outset, we are not in a voice's content
         self.in_content = False
 
-        # set up the actual parser
-        grammar = Grammar(open("doremi-grammar", "r").read())
-
-        # read and parse the tune
-        tune_text = codecs.open(tune_fn, "r", "utf-8").read()
-        self.syntax = grammar.parse(tune_text)
-        
-    def convert(self):
-        """Convert the parse tree to the internal music representation"""
-        self.visit(self.syntax)
-        return self.tune
-
     # title, composer, key, and partial value can only occur at the
     # tune level, so they always are added to the tune
-    def visit_title(self, node, vc):
-        self.tune.title = get_string_val(node)
-    def visit_scripture(self, node, vc):
-        self.tune.scripture = get_string_val(node)
-    def visit_composer(self, node, vc):
-        self.tune.composer = get_string_val(node)
-    def visit_key(self, node, vc):
-        text = " ".join([child.text for child in node.children
-                         if child.expr_name == "name"])
+    def set_title(self, text):
+        self.tune.title = text
+    def set_scripture(self, text):
+        self.tune.scripture = text
+    def set_composer(self, text):
+        self.tune.composer = text
+    def set_key(self, text):
         self.tune.key = text
-    def visit_partial(self, node, vc):
-        self.tune.partial = int(get_node_val(node, "number"))
-
-    def visit_time(self, node, vc):
-        time = get_node_val(node, "fraction")
+    def set_partial(self, text):
+        self.tune.partial = int(text)
 
+    def add_time(self, time):
         # if it occurs inside a voice's note array
         if self.in_content:
            self.note_modifiers.append(time)
@@ -297,76 +431,186 @@ class DoremiParser(NodeVisitor):
             self.tune.time = time
 
     # octave and voice-name only occur at the voice level
-    def visit_octave(self, node, vc):
-        self.voice.octave = int(get_node_val(node, "number"))
-    def visit_voice_name(self, node, vc):
-        self.voice.name = node.children[-1].text
+    def set_octave(self, text):
+        self.voice.octave = int(text)
+    def set_voice_name(self, text):
+        self.voice.name = text
 
     # modifiers only occur in a collection of notes, and are stored at
     # the note level
-    def visit_note_modifier(self, node, vc):
-        self.note_modifiers.append(node.text)
-        
-    def visit_voice(self, node, vc):
-        # a voice is only visited when fully parsed, so the voice is
-        # already fully constructed; add it to the tune and start a
-        # new one
+    def add_modifier(self, text):
+        self.note_modifiers.append(text)
+
+    def end_voice(self):
+        # the voice is fully constructed; add it to the tune and start
+        # a new one
         self.tune.append(self.voice)
         self.voice = Voice()
-        
-    def visit_note(self, node, vc):
-        # a note is only visited after its modifiers have been
-        # visited, so we finalize it and add it to the voice here
+        self.last = None
+
+    def emit(self, item):
+        # hand on a finished note or repeat marker; a tune is built by
+        # adding it to the current voice
+        self.voice.append(item)
+
+    def add_note(self, pitch):
+        # a note is only added after its modifiers have been seen, so
+        # we finalize it and add it to the voice here
+        note = self.note
+        modifiers = self.note_modifiers
+
+        last = self.last
 
         # if there's no duration explicit, it's the same as the
         # previous note in the same voice
-        if not self.note.duration:
-            self.note.duration = self.voice.last_note().duration
-            
-        self.note.modifiers = self.note_modifiers
-        self.note.pitch = node.text
+        if not note.duration:
+            if last is None:
+                raise IndexError("No previous notes")
+            note.duration = last.duration
+
+        # share one string per syllable between all the notes
+        note.pitch = intern(pitch)
 
         # if there's a previous note, start from its octave; if not,
         # start from the voice's octave
-        try:
-            self.note.octave = self.voice.last_note().octave
-        except IndexError:
-            self.note.octave = self.voice.octave
+        if last is not None:
+            note.octave = last.octave
+        else:
+            note.octave = self.voice.octave
 
         # alter the octave according to octave modifiers
-        for mod in self.note.modifiers:
+        for mod in modifiers:
             if mod == "-":
-                self.note.octave -= 1
+                note.octave -= 1
             elif mod == "+":
-                self.note.octave += 1
+                note.octave += 1
 
         # if a slur started on the previous note and is not continued
         # by this one, explicitly end it
-        try:
-            if "slur" in self.voice.last_note().modifiers:
-                if not "slur" in self.note.modifiers: 
-                    self.note.modifiers.append("end slur")
-        except IndexError:
-            pass
+        if last is not None and last.flags & SLUR:
+            if not "slur" in modifiers:
+                modifiers.append("end slur")
+
+        note.modifiers = modifiers
 
         # add the note to the voice and start a new one with no
         # modifiers
-        self.voice.append(self.note)
+        self.emit(note)
+        self.last = note
         self.note = Note()
         self.note_modifiers = []
 
-    def visit_repeat(self, node, vc):
-        self.voice.append(RepeatMarker(node.text))
+    def add_repeat(self, text):
+        self.emit(RepeatMarker(text))
         
-    def visit_number(self, node, vc):
+    def add_number(self, text):
         # all numbers except note durations are handled at a higher level
         if self.in_content:
-            self.note.duration = node.text
-            
-    def generic_visit(self, node, vc):
+            self.note.duration = intern(text)
+
+    def add_bracket(self, text):
         # set whether we're in the note-content of a voice based on
         # open- and close-brackets
-        if node.text == "[":
+        if text == "[":
             self.in_content = True
-        elif node.text == "]":
+        elif text == "]":
             self.in_content = False
+
+class DoremiParser(NodeVisitor, TuneBuilder):
+    """Parses Doremi tune files into Tune objects; a single parser may
+be used for any number of tunes in turn"""
+    def __init__(self, tune_fn=None, cache_dir=None, parse_cache=None):
+        NodeVisitor.__init__(self)
+
+        # the grammar is compiled once and shared by every parser, but
+        # not until it is first needed, which it never is if every tune
+        # comes from the parse cache
+        self.cache_dir = cache_dir
+        self._grammar = None
+        self.syntax = None
+        self.parse_cache = parse_cache
+        self.reset()
+
+        # for compatibility, read and parse the tune if one is given
+        if tune_fn:
+            self.syntax = self.grammar.parse(read_text(tune_fn))
+
+    @property
+    def grammar(self):
+        if self._grammar is None:
+            self._grammar = doremi_grammar(self.cache_dir)
+        return self._grammar
+
+    @grammar.setter
+    def grammar(self, grammar):
+        self._grammar = grammar
+
+    def convert(self):
+        """Convert the parse tree to the internal music representation"""
+        self.reset()
+        with timing.stage("visit"):
+            self.visit(self.syntax)
+        count_parsed(self.tune)
+        return self.tune
+
+    def parse(self, text):
+        """Parse the Doremi source TEXT and return it as a Tune, loading
+it from the ParseCache PARSE_CACHE instead if that holds it"""
+        return cached_parse(self.parse_cache, "tune", text, self.parse_text)
+
+    def parse_text(self, text):
+        """Parse TEXT without consulting the parse cache"""
+        with timing.stage("parse"):
+            self.syntax = self.grammar.parse(text)
+        return self.convert()
+
+    def parse_stream(self, stream):
+        """Parse a Doremi tune from a file-like object"""
+        return self.parse(stream.read())
+
+    def parse_file(self, tune_fn):
+        """Parse the Doremi file named TUNE_FN"""
+        return self.parse(read_text(tune_fn))
+
+    # the visitor sees each node only after its children, and passes
+    # it on to the builder
+    def visit_title(self, node, vc):
+        self.set_title(get_string_val(node))
+    def visit_scripture(self, node, vc):
+        self.set_scripture(get_string_val(node))
+    def visit_composer(self, node, vc):
+        self.set_composer(get_string_val(node))
+    def visit_key(self, node, vc):
+        self.set_key(" ".join([child.text for child in node.children
+                               if child.expr_name == "name"]))
+    def visit_partial(self, node, vc):
+        self.set_partial(get_node_val(node, "number"))
+    def visit_time(self, node, vc):
+        self.add_time(get_node_val(node, "fraction"))
+    def visit_octave(self, node, vc):
+        self.set_octave(get_node_val(node, "number"))
+    def visit_voice_name(self, node, vc):
+        self.set_voice_name(node.children[-1].text)
+    def visit_note_modifier(self, node, vc):
+        self.add_modifier(node.text)
+    def visit_voice(self, node, vc):
+        self.end_voice()
+    def visit_note(self, node, vc):
+        self.add_note(node.text)
+    def visit_repeat(self, node, vc):
+        self.add_repeat(node.text)
+    def visit_number(self, node, vc):
+        self.add_number(node.text)
+    def generic_visit(self, node, vc):
+        self.add_bracket(node.text)
+
+def make_parser(engine="parsimonious", cache_dir=None, parse_cache=None):
+    """Return a reusable tune parser using the named ENGINE: either
+"parsimonious" (the grammar-driven parser) or "fast" (the hand-written
+single-pass parser), consulting the ParseCache PARSE_CACHE if given"""
+    if engine == "parsimonious":
+        return DoremiParser(cache_dir=cache_dir, parse_cache=parse_cache)
+    elif engine == "fast":
+        from doremi.fast_parser import FastDoremiParser
+        return FastDoremiParser(parse_cache=parse_cache)
+    raise ValueError("Unknown parser engine '%s'." % engine)
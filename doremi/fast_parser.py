@@ -0,0 +1,292 @@
+"""A hand-written, single-pass parser for Doremi tune files
+
+This recognizes exactly the language described by doremi-grammar, but
+scans the source once from left to right without building a syntax
+tree, handing each piece to the same TuneBuilder that the
+grammar-driven DoremiParser uses.  It is modelled on the tokenizer and
+parser in nim/lex.nim and nim/parse.nim.
+
+"""
+
+import re
+
+from doremi import timing
+from doremi.doremi_parser import TuneBuilder, count_parsed, read_text
+from doremi.parse_cache import cached_parse
+
+WS = re.compile(r"\s*")
+NAME = re.compile(r"[A-Za-z][A-Za-z0-9\-#]*")
+NUMBER = re.compile(r"-?[0-9]+\.?")
+TEXT = re.compile(r'[^"]*')
+
+# the two-letter syllables; "sol" and "r" are handled separately, but
+# no syllable is a prefix of another that the grammar tries later, so
+# the result is the same as trying them in grammar order
+SYLLABLES = frozenset(["do", "di", "ra", "re", "ri", "me", "mi", "fa",
+                       "fi", "se", "si", "le", "la", "li", "te", "ti"])
+
+# note modifiers and repeats, in the order the grammar tries them
+MODIFIERS = ("fermata", "slur", "tie", "-", "+")
+REPEATS = ("|:", ":|", "||", "|.", "!", "1!", "2!")
+
+class DoremiSyntaxError(ValueError):
+    """Raised when a Doremi source does not match the grammar; TEXT is
+the source, or the part of it that begins at OFFSET, which is at line
+START_LINE and column START_COLUMN"""
+    def __init__(self, expected, text, pos, offset=0, start_line=1,
+                 start_column=1):
+        self.expected = expected
+        self.pos = offset + pos
+        newlines = text.count("\n", 0, pos)
+        self.line = start_line + newlines
+        if newlines:
+            self.column = pos - text.rfind("\n", 0, pos)
+        else:
+            self.column = start_column + pos
+        ValueError.__init__(self,
+                            "Expected %s at line %d, column %d." %
+                            (expected, self.line, self.column))
+
+class FastDoremiParser(TuneBuilder):
+    """Parses Doremi tune files into Tune objects in a single pass; a
+single parser may be used for any number of tunes in turn"""
+    def __init__(self, tune_fn=None, parse_cache=None):
+        self.text = ""
+        self.pos = 0
+        self.parse_cache = parse_cache
+        self.reset()
+
+        # events waiting to be handed on by the readers; only a
+        # streaming parser produces any
+        self.events = []
+
+        # for compatibility with DoremiParser, keep the text of a
+        # tune given at construction until convert() is called
+        if tune_fn:
+            self.text = read_text(tune_fn)
+
+    def convert(self):
+        """Parse the current text to the internal music representation"""
+        self.reset()
+        self.pos = 0
+        with timing.stage("parse"):
+            for event in self.read_tune():
+                pass
+        count_parsed(self.tune)
+        return self.tune
+
+    def parse(self, text):
+        """Parse the Doremi source TEXT and return it as a Tune, loading
+it from the ParseCache PARSE_CACHE instead if that holds it"""
+        return cached_parse(self.parse_cache, "tune", text, self.parse_text)
+
+    def parse_text(self, text):
+        """Parse TEXT without consulting the parse cache"""
+        self.text = text
+        return self.convert()
+
+    def parse_stream(self, stream):
+        """Parse a Doremi tune from a file-like object"""
+        return self.parse(stream.read())
+
+    def parse_file(self, tune_fn):
+        """Parse the Doremi file named TUNE_FN"""
+        return self.parse(read_text(tune_fn))
+
+    # scanning primitives
+    def error(self, expected):
+        raise DoremiSyntaxError(expected, self.text, self.pos)
+
+    def ws(self):
+        self.pos = WS.match(self.text, self.pos).end()
+
+    def literal(self, lit):
+        if not self.text.startswith(lit, self.pos):
+            self.error('"%s"' % lit)
+        self.pos += len(lit)
+
+    def regex(self, pattern, expected):
+        m = pattern.match(self.text, self.pos)
+        if m is None:
+            self.error(expected)
+        self.pos = m.end()
+        return m.group()
+
+    def assignment(self, keyword):
+        """Consume KEYWORD, a colon, and the whitespace around them"""
+        self.literal(keyword)
+        self.ws()
+        self.literal(":")
+        self.ws()
+
+    def string(self):
+        self.literal('"')
+        text = self.regex(TEXT, "text")
+        self.literal('"')
+        return text
+
+    def fraction(self):
+        top = self.regex(NUMBER, "number")
+        self.add_number(top)
+        self.literal("/")
+        bottom = self.regex(NUMBER, "number")
+        self.add_number(bottom)
+        return "%s/%s" % (top, bottom)
+
+    def flush(self):
+        """Return the waiting events and forget them"""
+        events = list(self.events)
+        del self.events[:]
+        return events
+
+    # the grammar rules, in the same order as doremi-grammar; each is
+    # a generator, yielding any events as soon as they are complete
+    def read_tune(self):
+        count = 0
+        while True:
+            if self.events:
+                yield from self.flush()
+            self.ws()
+            text = self.text
+            pos = self.pos
+            if text.startswith("title", pos):
+                self.assignment("title")
+                self.set_title(self.string())
+            elif text.startswith("scripture", pos):
+                self.assignment("scripture")
+                self.set_scripture(self.string())
+            elif text.startswith("composer", pos):
+                self.assignment("composer")
+                self.set_composer(self.string())
+            elif text.startswith("key", pos):
+                self.assignment("key")
+                first = self.regex(NAME, "key name")
+                self.ws()
+                second = self.regex(NAME, "key mode")
+                self.set_key("%s %s" % (first, second))
+            elif text.startswith("time", pos):
+                self.assignment("time")
+                self.add_time(self.fraction())
+            elif text.startswith("partial", pos):
+                self.assignment("partial")
+                number = self.regex(NUMBER, "number")
+                self.add_number(number)
+                self.set_partial(number)
+            elif text.startswith("voices", pos):
+                self.assignment("voices")
+                yield from self.read_voices()
+            elif count == 0 or pos < len(text):
+                self.error("a tune attribute")
+            else:
+                return
+            count += 1
+
+    def read_voices(self):
+        self.literal("[")
+        self.add_bracket("[")
+        self.ws()
+        yield from self.read_voice()
+        self.ws()
+        while self.text.startswith("{", self.pos):
+            yield from self.read_voice()
+            self.ws()
+        self.literal("]")
+        self.add_bracket("]")
+
+    def read_voice(self):
+        self.literal("{")
+        count = 0
+        while True:
+            self.ws()
+            text = self.text
+            pos = self.pos
+            if text.startswith("name", pos):
+                self.assignment("name")
+                self.set_voice_name(self.regex(NAME, "voice name"))
+            elif text.startswith("octave", pos):
+                self.assignment("octave")
+                number = self.regex(NUMBER, "number")
+                self.add_number(number)
+                self.set_octave(number)
+            elif text.startswith("content", pos):
+                self.assignment("content")
+                yield from self.read_content()
+            elif count == 0:
+                self.error("a voice attribute")
+            else:
+                break
+            count += 1
+        self.literal("}")
+        self.end_voice()
+        if self.events:
+            yield from self.flush()
+
+    def read_content(self):
+        self.literal("[")
+        self.add_bracket("[")
+        self.ws()
+        events = self.events
+        count = 0
+        while True:
+            if events:
+                yield from self.flush()
+            text = self.text
+            pos = self.pos
+            two = text[pos:pos + 2]
+
+            # time is tried first; "time" not followed by a fraction
+            # is the note "ti" followed by "me"
+            if two == "ti" and text.startswith("time", pos):
+                try:
+                    self.assignment("time")
+                    top = self.regex(NUMBER, "number")
+                    self.literal("/")
+                    bottom = self.regex(NUMBER, "number")
+                except DoremiSyntaxError:
+                    self.pos = pos
+                else:
+                    self.add_number(top)
+                    self.add_number(bottom)
+                    self.add_time("%s/%s" % (top, bottom))
+                    self.ws()
+                    count += 1
+                    continue
+
+            matched = None
+            for mod in MODIFIERS:
+                if text.startswith(mod, pos):
+                    matched = mod
+                    break
+            else:
+                for rep in REPEATS:
+                    if text.startswith(rep, pos):
+                        matched = rep
+                        self.add_repeat(rep)
+                        break
+
+            if matched is not None:
+                self.add_modifier(matched)
+                self.pos = pos + len(matched)
+            elif two in SYLLABLES:
+                self.add_note(two)
+                self.pos = pos + 2
+            elif text.startswith("sol", pos):
+                self.add_note("sol")
+                self.pos = pos + 3
+            elif two[:1] == "r":
+                self.add_note("r")
+                self.pos = pos + 1
+            else:
+                m = NUMBER.match(text, pos)
+                if m is None:
+                    if count == 0:
+                        self.error("a note, modifier or duration")
+                    break
+                self.add_number(m.group())
+                self.pos = m.end()
+
+            self.ws()
+            count += 1
+
+        self.literal("]")
+        self.add_bracket("]")
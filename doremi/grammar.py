@@ -0,0 +1,92 @@
+"""Locate, compile and cache the parsimonious grammars used by the
+Doremi and lyric parsers"""
+
+import hashlib
+import os
+import pickle
+
+from doremi import timing
+from doremi.atomic import atomic_write
+
+# the grammar files ship beside the package, so find them from here
+# rather than from the current working directory
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+DOREMI_GRAMMAR = "doremi-grammar"
+LYRIC_GRAMMAR = "lyric-grammar"
+
+# grammars already compiled in this process, keyed by file name
+_grammars = {}
+
+def grammar_path(name):
+    """Return the full path of the grammar file NAME"""
+    return os.path.join(ROOT, name)
+
+def default_cache_dir():
+    """Return the per-user directory in which compiled grammars (and
+other derived files) may be stored"""
+    base = os.environ.get("XDG_CACHE_HOME",
+                          os.path.join(os.path.expanduser("~"), ".cache"))
+    return os.path.join(base, "doremi")
+
+def _cache_file(cache_dir, name, text):
+    import parsimonious
+
+    # the cached grammar is only good for the exact grammar text and
+    # parsimonious version it was built from
+    digest = hashlib.sha1((parsimonious.__name__ +
+                           getattr(parsimonious, "__version__", "") +
+                           text).encode("utf-8")).hexdigest()
+    return os.path.join(cache_dir, "%s-%s.pickle" % (name, digest[:16]))
+
+def compile_grammar(name, cache_dir=None):
+    """Compile the grammar in the file NAME, using or refreshing a
+pickled copy in CACHE_DIR if one is given"""
+    # parsimonious takes longer to import than anything else in doremi,
+    # so only what compiles or loads a grammar imports it
+    from parsimonious import Grammar
+
+    with open(grammar_path(name), "r") as f:
+        text = f.read()
+
+    if cache_dir is None:
+        return Grammar(text)
+
+    fn = _cache_file(cache_dir, name, text)
+    try:
+        with open(fn, "rb") as f:
+            return pickle.load(f)
+    except (IOError, OSError, EOFError, pickle.UnpicklingError):
+        pass
+
+    grammar = Grammar(text)
+
+    # a concurrent reader never sees a half-written file
+    try:
+        if not os.path.isdir(cache_dir):
+            os.makedirs(cache_dir)
+        with atomic_write(fn, "wb") as f:
+            pickle.dump(grammar, f, pickle.HIGHEST_PROTOCOL)
+    except (IOError, OSError):
+        pass # the cache is an optimization; carry on without it
+
+    return grammar
+
+def load_grammar(name, cache_dir=None):
+    """Return the compiled grammar in the file NAME, compiling it only
+the first time it is requested in this process"""
+    try:
+        return _grammars[name]
+    except KeyError:
+        with timing.stage("grammar"):
+            grammar = compile_grammar(name, cache_dir)
+        _grammars[name] = grammar
+        return grammar
+
+def doremi_grammar(cache_dir=None):
+    """Return the shared grammar for Doremi tune files"""
+    return load_grammar(DOREMI_GRAMMAR, cache_dir)
+
+def lyric_grammar(cache_dir=None):
+    """Return the shared grammar for Doremi lyric files"""
+    return load_grammar(LYRIC_GRAMMAR, cache_dir)
@@ -0,0 +1,378 @@
+"""An index of a library of tunes, kept on disk, for finding the tunes
+that fit a text's meter without parsing every tune
+
+For each tune the index records its title, composer, key, time,
+partial and voice names, and the meter of its melody: the number of
+syllables in each phrase, e.g. "8.8.8.8".  The melody is the voice
+named soprano, or failing that lead, melody or treble, or failing
+those the first.  A syllable is a note that is not a rest and does not
+continue a slur or tie from the note before.  Phrases end at fermatas,
+rests, double bars and repeat signs.  Where these leave a phrase longer
+than any line of a hymn, the melody is matched against the common
+meters of HYMN_METERS instead: the lines of a hymn tune begin at the
+same point in the measure as its first, so a meter fits if each of its
+lines would begin there, and of those that fit, the one whose lines
+end on the longest notes is taken.  Failing that, the melody is divided
+into lines of two measures.  This is a heuristic, and right for most
+hymn tunes rather than all.
+
+Meters are compared as sequences of numbers, so "L.M." matches
+"8.8.8.8", and "8.7.8.7 D." matches "8.7.8.7.8.7.8.7".  Entries are
+refreshed only for files whose size or modification time has changed,
+and only reparsed if their contents have.
+
+The index also keeps the melody itself, as scale degrees and lengths,
+so that doremi.similarity can compare tunes without parsing them.
+
+"""
+
+import hashlib
+import json
+import os
+import re
+
+from doremi.atomic import atomic_write
+from doremi.doremi_parser import FERMATA, SLUR, TIE, Note, make_parser
+from doremi.lilypond import pitch_level
+from doremi.midi import duration_ticks, expand_repeats
+
+INDEX_FILE = ".doremi-index.json"
+
+# entries written by an older version are brought up to date
+INDEX_VERSION = 3
+
+# the voices that carry the tune, in order of preference
+MELODY_VOICES = ("soprano", "lead", "melody", "treble")
+
+# the named meters of English hymnody
+METER_NAMES = {"S.M.": [6, 6, 8, 6],
+               "C.M.": [8, 6, 8, 6],
+               "L.M.": [8, 8, 8, 8]}
+
+# the common meters of hymn tunes, in which an unmarked melody is sought;
+# each is also tried doubled
+HYMN_METERS = [[6, 6, 8, 6], [8, 6, 8, 6], [8, 8, 8, 8], [7, 7, 7, 7],
+               [8, 7, 8, 7], [7, 6, 7, 6], [6, 6, 6, 6], [6, 5, 6, 5],
+               [5, 5, 5, 5], [8, 8, 8], [11, 11, 11],
+               [10, 10, 10, 10], [11, 11, 11, 11], [11, 10, 11, 10],
+               [10, 10, 11, 11], [8, 7, 8, 7, 8, 7], [8, 6, 8, 6, 8, 6],
+               [8, 8, 6, 8, 8, 6], [8, 8, 8, 8, 8, 8], [7, 7, 7, 7, 7, 7],
+               [6, 6, 6, 6, 8, 8], [6, 6, 4, 6, 6, 6, 4]]
+
+# repeat signs and bars that end a phrase
+PHRASE_MARKERS = frozenset(["|:", ":|", "||", "|."])
+
+# the length of a line when nothing marks the phrases, in measures,
+# and the most syllables a line of a hymn is taken to have
+LINE_MEASURES = 2
+LONGEST_LINE = 12
+
+METER_PART = re.compile(r"[0-9]+")
+
+def normalize_meter(text):
+    """Return the meter TEXT as a string of syllable counts joined by
+dots, e.g. "8.6.8.6" for "C.M." or "8.7.8.7.8.7.8.7" for "8.7.8.7 D.",
+or None if it names no fixed meter (such as "P.M.")"""
+    text = text.strip().upper()
+    doubled = False
+    if text.endswith("D") or text.endswith("D."):
+        doubled = True
+        text = text[:text.rindex("D")].rstrip(" .")
+        if text in ("S.M", "C.M", "L.M"):
+            text += "."
+    if text in METER_NAMES:
+        counts = list(METER_NAMES[text])
+    else:
+        counts = [int(n) for n in METER_PART.findall(text)]
+        if not counts or METER_PART.sub("", text).strip(" .,") != "":
+            return None
+    if doubled:
+        counts = counts * 2
+    return ".".join(str(n) for n in counts)
+
+def melody(tune):
+    """Return the voice of TUNE that carries the tune, or None"""
+    voices = dict((voice.name, voice) for voice in tune)
+    for name in MELODY_VOICES:
+        if name in voices:
+            return voices[name]
+    return tune[0] if len(tune) else None
+
+def melody_line(voice, minor=False):
+    """Return the scale degrees and lengths in ticks of the notes of VOICE
+as sung, with repeats played out, rests left out and tied notes joined;
+degrees are counted in steps from the do of octave 0, or in a MINOR key
+from its la"""
+    degrees = []
+    durations = []
+    tied = False
+    for note in expand_repeats(voice):
+        length = duration_ticks(note.duration)
+        if note.pitch == "r":
+            tied = False
+            continue
+        level = pitch_level[note.pitch]
+        if minor:
+            level = (level + 2) % 7
+        degree = note.octave * 7 + level
+        if tied and degrees and degrees[-1] == degree:
+            durations[-1] += length
+        else:
+            degrees.append(degree)
+            durations.append(length)
+        tied = bool(note.flags & TIE)
+    return degrees, durations
+
+def measure_ticks(time):
+    """Return the length in ticks of a measure of the time signature
+TIME, e.g. "3/4", by default 4/4"""
+    top, bottom = (time or "4/4").split("/")
+    return int(top) * duration_ticks(bottom)
+
+def phrases(voice, line_ticks=None):
+    """Return the number of syllables in each phrase of VOICE, also
+ending a phrase at every LINE_TICKS if given"""
+    counts = []
+    syllables = 0
+    joined = False # whether the next note continues a syllable
+    now = 0
+    boundary = line_ticks
+    for item in voice:
+        if not isinstance(item, Note):
+            if item.text in PHRASE_MARKERS and syllables:
+                counts.append(syllables)
+                syllables = 0
+            continue
+
+        if item.pitch == "r":
+            if syllables:
+                counts.append(syllables)
+                syllables = 0
+            joined = False
+        else:
+            if not joined:
+                syllables += 1
+            joined = bool(item.flags & (SLUR | TIE))
+        now += duration_ticks(item.duration)
+
+        ended = item.flags & FERMATA
+        if boundary is not None and now >= boundary:
+            while boundary <= now:
+                boundary += line_ticks
+            ended = True
+        if ended and syllables and not joined:
+            counts.append(syllables)
+            syllables = 0
+    if syllables:
+        counts.append(syllables)
+    return counts
+
+def syllables(voice):
+    """Return when each syllable of VOICE begins, in ticks, and how long
+it lasts until the next begins (or the voice ends)"""
+    onsets = []
+    joined = False
+    now = 0
+    for item in voice:
+        if not isinstance(item, Note):
+            continue
+        if item.pitch == "r":
+            joined = False
+        else:
+            if not joined:
+                onsets.append(now)
+            joined = bool(item.flags & (SLUR | TIE))
+        now += duration_ticks(item.duration)
+    return onsets, [end - start
+                    for start, end in zip(onsets, onsets[1:] + [now])]
+
+def metric_lines(voice, time=None, partial=None):
+    """Return the syllable counts of the meter of HYMN_METERS that best
+fits VOICE, in TIME with a pickup of one PARTIAL note, or None if none
+does"""
+    onsets, lengths = syllables(voice)
+    if not onsets:
+        return None
+    measure = measure_ticks(time)
+    pickup = duration_ticks(str(partial)) if partial else 0
+    phase = (onsets[0] - pickup) % measure
+    starts = set(i for i, onset in enumerate(onsets)
+                 if (onset - pickup) % measure == phase)
+
+    best = None
+    for meter in HYMN_METERS:
+        for counts in (meter, meter * 2):
+            if sum(counts) != len(onsets):
+                continue
+            ends = [sum(counts[:i]) for i in range(1, len(counts))]
+            if not all(end in starts for end in ends):
+                continue
+            # how long the last syllable of each line is held
+            held = sum(lengths[end - 1] for end in ends) / float(len(ends))
+            if best is None or held > best[0]:
+                best = (held, counts)
+    if best is None:
+        return None
+    return list(best[1])
+
+def tune_meter(tune):
+    """Return the meter of TUNE's melody, e.g. "8.8.8.8", or None if it
+has none"""
+    voice = melody(tune)
+    if voice is None:
+        return None
+    counts = phrases(voice)
+    if len(counts) < 2 or max(counts) > LONGEST_LINE:
+        counts = (metric_lines(voice, tune.time or None, tune.partial) or
+                  phrases(voice,
+                          LINE_MEASURES * measure_ticks(tune.time or None)))
+    if not counts:
+        return None
+    return ".".join(str(n) for n in counts)
+
+def tune_entry(tune):
+    """Return the index entry for TUNE, without its file details"""
+    voice = melody(tune)
+    if voice is None:
+        degrees, durations = [], []
+    else:
+        degrees, durations = melody_line(voice,
+                                         "minor" in (tune.key or "").lower())
+    return {"version": INDEX_VERSION,
+            "title": tune.title,
+            "composer": tune.composer,
+            "key": tune.key,
+            "time": tune.time,
+            "partial": tune.partial,
+            "voices": [voice.name for voice in tune],
+            "meter": tune_meter(tune),
+            "degrees": degrees,
+            "durations": durations}
+
+def file_digest(fn):
+    with open(fn, "rb") as f:
+        return hashlib.sha256(f.read()).hexdigest()
+
+class TuneIndex(object):
+    """The index of the tunes in a library, kept in the JSON file PATH"""
+    def __init__(self, path):
+        self.path = path
+        self.entries = {}
+        self.stats = {"parsed": 0, "unchanged": 0, "removed": 0,
+                      "errors": 0}
+        try:
+            with open(path, "r") as f:
+                self.entries = json.load(f)
+        except (IOError, OSError, ValueError):
+            pass # no usable index, so everything will be parsed
+
+        self._by_meter = None
+
+    def update(self, files, parser=None):
+        """Bring the index up to date with the tune files FILES, dropping
+any other entries, and return the number of entries changed"""
+        parser = parser or make_parser("fast")
+        seen = set()
+        changed = 0
+        for fn in files:
+            fn = os.path.abspath(fn)
+            seen.add(fn)
+            try:
+                st = os.stat(fn)
+            except OSError:
+                continue
+            entry = self.entries.get(fn)
+            if entry is not None and entry.get("version") != INDEX_VERSION:
+                entry = None
+            stamp = [st.st_size, st.st_mtime_ns]
+            if entry is not None and entry["stamp"] == stamp:
+                self.stats["unchanged"] += 1
+                continue
+
+            digest = file_digest(fn)
+            if entry is not None and entry["sha256"] == digest:
+                # touched but not changed
+                entry["stamp"] = stamp
+                self.stats["unchanged"] += 1
+                changed += 1
+                continue
+
+            try:
+                entry = tune_entry(parser.parse_file(fn))
+            except Exception as e:
+                entry = {"version": INDEX_VERSION,
+                         "error": "%s: %s" % (type(e).__name__, e)}
+                self.stats["errors"] += 1
+            entry["stamp"] = stamp
+            entry["sha256"] = digest
+            self.entries[fn] = entry
+            changed += 1
+            self.stats["parsed"] += 1
+
+        for fn in list(self.entries):
+            if fn not in seen:
+                del self.entries[fn]
+                self.stats["removed"] += 1
+                changed += 1
+        self._by_meter = None
+        return changed
+
+    def update_directory(self, directory, parser=None):
+        """Bring the index up to date with the .drm files in DIRECTORY"""
+        files = [os.path.join(directory, name)
+                 for name in sorted(os.listdir(directory))
+                 if name.endswith(".drm")]
+        return self.update(files, parser)
+
+    def save(self):
+        outdir = os.path.dirname(self.path)
+        if outdir and not os.path.isdir(outdir):
+            os.makedirs(outdir)
+        with atomic_write(self.path) as f:
+            json.dump(self.entries, f, indent=1, sort_keys=True)
+
+    def find_meter(self, meter):
+        """Return the (file, entry) pairs of the tunes in METER, e.g.
+"8.7.8.7" or "C.M.", sorted by file"""
+        if self._by_meter is None:
+            self._by_meter = {}
+            for fn, entry in sorted(self.entries.items()):
+                if entry.get("meter"):
+                    self._by_meter.setdefault(entry["meter"], []).append(
+                        (fn, entry))
+        meter = normalize_meter(meter)
+        if meter is None:
+            return []
+        return list(self._by_meter.get(meter, []))
+
+    def find(self, meter=None, **fields):
+        """Return the (file, entry) pairs of the tunes in METER (if
+given) whose FIELDS (title, composer, key, time or voices) contain the
+given text, ignoring case, sorted by file"""
+        if meter is not None:
+            candidates = self.find_meter(meter)
+        else:
+            candidates = sorted(item for item in self.entries.items()
+                                if "error" not in item[1])
+        found = []
+        for fn, entry in candidates:
+            for name, text in fields.items():
+                value = entry.get(name)
+                if isinstance(value, list):
+                    value = " ".join(value)
+                if text.lower() not in str(value or "").lower():
+                    break
+            else:
+                found.append((fn, entry))
+        return found
+
+def library_index(directory, save=True):
+    """Return the index of the tunes in DIRECTORY, kept in its
+INDEX_FILE and brought up to date first"""
+    index = TuneIndex(os.path.join(directory, INDEX_FILE))
+    if index.update_directory(directory) and save:
+        try:
+            index.save()
+        except (IOError, OSError):
+            pass # a read-only library is indexed afresh every time
+    return index
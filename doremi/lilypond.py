@@ -18,310 +18,169 @@ pitch_level = {"do": 0,
                "te": 6,
                "ti": 6}
 
-key_octave_offset = {'fis major': -3,
-                     'gis minor': 3,
-                     'c minor': 0,
-                     'a minor': 2,
-                     'eis minor': -2,
-                     'fis minor': -3,
-                     'bes major': 1,
-                     'cis minor': 0,
-                     'a major': 2,
-                     'g major': 3,
-                     'c major': 0,
-                     'e minor': -2,
-                     'des major': -1,
-                     'cis major': 0,
-                     'f minor': -3,
-                     'aes major': 2,
-                     'bes minor': 1,
-                     'dis minor': -1,
-                     'ges minor': 3,
-                     'ces major': 0,
-                     'ges major': 3,
-                     'ais minor': 2,
-                     'd major': -1,
-                     'f major': -3,
-                     'd minor': -1,
-                     'es major': -2,
-                     'e major': -2,
-                     'b minor': 1,
-                     'b major': 1}
+# the letter names of the notes, from c, and how many semitones each
+# lies above c
+LETTERS = "cdefgab"
+NATURAL_SEMITONES = [0, 2, 4, 5, 7, 9, 11]
 
-keys = {"c major": {"do": "c",
-                    "di": "cis",
-                    "ra": "des",
-                    "re": "d", 
-                    "ri": "dis",
-                    "me": "es",
-                    "mi": "e",
-                    "fa": "f",
-                    "fi": "fis",
-                    "se": "ges",
-                    "sol": "g",
-                    "si": "gis",
-                    "le": "aes",
-                    "la": "a",
-                    "li": "ais",
-                    "te": "bes",
-                    "ti": "b"},
-        "cis major": {"do": "cis",
-                      "di": "cisis",
-                      "ra": "d",
-                      "re": "dis", 
-                      "ri": "disis",
-                      "me": "e",
-                      "mi": "eis",
-                      "fa": "fis",
-                      "fi": "fisis",
-                      "se": "g",
-                      "sol": "gis",
-                      "si": "gisis",
-                      "le": "a",
-                      "la": "ais",
-                      "li": "aisis",
-                      "te": "b",
-                      "ti": "bis"},
-        "des major": {"do": "des",
-                      "di": "d",
-                      "ra": "eses",
-                      "re": "es", 
-                      "ri": "e",
-                      "me": "fes",
-                      "mi": "f",
-                      "fa": "ges",
-                      "fi": "g",
-                      "se": "aeses",
-                      "sol": "aes",
-                      "si": "a",
-                      "le": "beses",
-                      "la": "bes",
-                      "li": "b",
-                      "te": "ces",
-                      "ti": "c"},
-        "d major": {"do": "d",
-                    "di": "dis",
-                    "ra": "es",
-                    "re": "e", 
-                    "ri": "eis",
-                    "me": "f",
-                    "mi": "fis",
-                    "fa": "g",
-                    "fi": "gis",
-                    "se": "aes",
-                    "sol": "a",
-                    "si": "ais",
-                    "le": "bes",
-                    "la": "b",
-                    "li": "bis",
-                    "te": "c",
-                    "ti": "cis"},
-        "es major": {"do": "es",
-                     "di": "e",
-                     "ra": "fes",
-                     "re": "f", 
-                     "ri": "fis",
-                     "me": "ges",
-                     "mi": "g",
-                     "fa": "aes",
-                     "fi": "a",
-                     "se": "beses",
-                     "sol": "bes",
-                     "si": "b",
-                     "le": "ces",
-                     "la": "c",
-                     "li": "cis",
-                     "te": "des",
-                     "ti": "d"},
-        "e major": {"do": "e",
-                    "di": "eis",
-                    "ra": "f",
-                    "re": "fis", 
-                    "ri": "fisis",
-                    "me": "g",
-                    "mi": "gis",
-                    "fa": "a",
-                    "fi": "ais",
-                    "se": "bes",
-                    "sol": "b",
-                    "si": "bis",
-                    "le": "c",
-                    "la": "cis",
-                    "li": "cisis",
-                    "te": "d",
-                    "ti": "dis"},
-        "f major": {"do": "f",
-                    "di": "fis",
-                    "ra": "ges",
-                    "re": "g", 
-                    "ri": "gis",
-                    "me": "aes",
-                    "mi": "a",
-                    "fa": "bes",
-                    "fi": "b",
-                    "se": "ces",
-                    "sol": "c",
-                    "si": "cis",
-                    "le": "des",
-                    "la": "d",
-                    "li": "dis",
-                    "te": "es",
-                    "ti": "e"},
-        "fis major": {"do": "fis",
-                      "di": "fisis",
-                      "ra": "g",
-                      "re": "gis", 
-                      "ri": "gisis",
-                      "me": "a",
-                      "mi": "ais",
-                      "fa": "b",
-                      "fi": "bis",
-                      "se": "c",
-                      "sol": "cis",
-                      "si": "cisis",
-                      "le": "d",
-                      "la": "dis",
-                      "li": "disis",
-                      "te": "e",
-                      "ti": "eis"},
-        "ges major": {"do": "ges",
-                      "di": "g",
-                      "ra": "aeses",
-                      "re": "aes", 
-                      "ri": "a",
-                      "me": "beses",
-                      "mi": "bes",
-                      "fa": "ces",
-                      "fi": "c",
-                      "se": "deses",
-                      "sol": "des",
-                      "si": "d",
-                      "le": "eses",
-                      "la": "es",
-                      "li": "e",
-                      "te": "fes",
-                      "ti": "f"},        
-        "g major": {"do": "g",
-                    "di": "gis",
-                    "ra": "aes",
-                    "re": "a", 
-                    "ri": "ais",
-                    "me": "bes",
-                    "mi": "b",
-                    "fa": "c",
-                    "fi": "cis",
-                    "se": "des",
-                    "sol": "d",
-                    "si": "dis",
-                    "le": "es",
-                    "la": "e",
-                    "li": "eis",
-                    "te": "f",
-                    "ti": "fis"},
-        "aes major": {"do": "aes",
-                      "di": "a",
-                      "ra": "beses",
-                      "re": "bes", 
-                      "ri": "b",
-                      "me": "ces",
-                      "mi": "c",
-                      "fa": "des",
-                      "fi": "d",
-                      "se": "eses",
-                      "sol": "es",
-                      "si": "e",
-                      "le": "fes",
-                      "la": "f",
-                      "li": "fis",
-                      "te": "ges",
-                      "ti": "g"},        
-        "a major": {"do": "a",
-                    "di": "ais",
-                    "ra": "bes",
-                    "re": "b", 
-                    "ri": "bis",
-                    "me": "c",
-                    "mi": "cis",
-                    "fa": "d",
-                    "fi": "dis",
-                    "se": "es",
-                    "sol": "e",
-                    "si": "eis",
-                    "le": "f",
-                    "la": "fis",
-                    "li": "fisis",
-                    "te": "g",
-                    "ti": "gis"},
-        "bes major": {"do": "bes",
-                      "di": "b",
-                      "ra": "ces",
-                      "re": "c", 
-                      "ri": "cis",
-                      "me": "des",
-                      "mi": "d",
-                      "fa": "es",
-                      "fi": "e",
-                      "se": "fes",
-                      "sol": "f",
-                      "si": "fis",
-                      "le": "ges",
-                      "la": "g",
-                      "li": "gis",
-                      "te": "aes",
-                      "ti": "a"},
-        "b major": {"do": "b",
-                    "di": "bis",
-                    "ra": "c",
-                    "re": "cis", 
-                    "ri": "cisis",
-                    "me": "d",
-                    "mi": "dis",
-                    "fa": "e",
-                    "fi": "eis",
-                    "se": "f",
-                    "sol": "fis",
-                    "si": "fisis",
-                    "le": "g",
-                    "la": "gis",
-                    "li": "gisis",
-                    "te": "a",
-                    "ti": "ais"},
-        "ces major": {"do": "ces",
-                      "di": "c",
-                      "ra": "deses",
-                      "re": "des", 
-                      "ri": "d",
-                      "me": "eses",
-                      "mi": "es",
-                      "fa": "fes",
-                      "fi": "f",
-                      "se": "geses",
-                      "sol": "ges",
-                      "si": "g",
-                      "le": "aeses",
-                      "la": "aes",
-                      "li": "a",
-                      "te": "beses",
-                      "ti": "bes"}}
+# how many semitones each syllable lies above do
+syllable_semitones = {"do": 0,
+                      "di": 1,
+                      "ra": 1,
+                      "re": 2,
+                      "ri": 3,
+                      "me": 3,
+                      "mi": 4,
+                      "fa": 5,
+                      "fi": 6,
+                      "se": 6,
+                      "sol": 7,
+                      "si": 8,
+                      "le": 8,
+                      "la": 9,
+                      "li": 10,
+                      "te": 10,
+                      "ti": 11}
 
-keys["g minor"] = keys['bes major']
-keys["cis minor"] = keys['e major']
-keys["b minor"] = keys['d major']
-keys["c minor"] = keys['es major']
-keys["e minor"] = keys['g major']
-keys["f minor"] = keys['aes major']
-keys["ais minor"] = keys['cis major']
-keys["bes minor"] = keys['des major']
-keys["a minor"] = keys['c major']
-keys["gis minor"] = keys['b major']
-keys["d minor"] = keys['f major']
-keys["fis minor"] = keys['a major']
-keys["ais minor"] = keys['ces major']
-keys["es minor"] = keys['ges major']
-keys["dis minor"] = keys['fis major']
+# the major keys Doremi renders, by the Lilypond name of their tonic;
+# each has a relative minor on its la
+MAJOR_TONICS = ["c", "cis", "des", "d", "es", "e", "f", "fis", "ges", "g",
+                "aes", "a", "bes", "b", "ces"]
+
+# how many octaves the internal octave numbers are shifted in a key,
+# by the letter of its tonic, so that octave 0 of the key starts near
+# the octave below middle c
+TONIC_OCTAVE_OFFSET = {"c": 0,
+                       "d": -1,
+                       "e": -2,
+                       "f": -3,
+                       "g": 3,
+                       "a": 2,
+                       "b": 1}
+
+class UnknownKeyError(ValueError):
+    """Raised for a key Doremi cannot render"""
+    pass
+
+def note_alteration(name):
+    """Return the number of semitones by which the Lilypond note NAME,
+e.g. "fis" or "es", is raised (or, if negative, lowered)"""
+    rest = name[1:]
+    if name[0] in "ae" and rest.startswith("s"):
+        rest = "e" + rest # as, es
+    return rest.count("is") - rest.count("es")
+
+def spell_note(letter, alteration):
+    """Return the Lilypond name of the note LETTER raised ALTERATION
+semitones (or, if negative, lowered)"""
+    if alteration > 0:
+        return letter + "is" * alteration
+    if alteration < 0:
+        if letter == "e":
+            return "es" * -alteration
+        return letter + "es" * -alteration
+    return letter
+
+def scale_names(tonic):
+    """Return the Lilypond name of every syllable in the major key whose
+tonic is named TONIC"""
+    first = LETTERS.index(tonic[0])
+    do = NATURAL_SEMITONES[first] + note_alteration(tonic)
+    names = {}
+    for syllable, level in pitch_level.items():
+        letter = (first + level) % 7
+        alteration = ((do + syllable_semitones[syllable] -
+                       NATURAL_SEMITONES[letter]) % 12)
+        if alteration > 6:
+            alteration -= 12
+        names[syllable] = spell_note(LETTERS[letter], alteration)
+    return names
+
+def build_keys():
+    """Return the pitch names of every syllable, and the octave offset,
+of every key Doremi renders, each keyed by the key's name"""
+    names = {}
+    offsets = {}
+    for tonic in MAJOR_TONICS:
+        scale = scale_names(tonic)
+        for key, key_tonic in [("%s major" % tonic, tonic),
+                               ("%s minor" % scale["la"], scale["la"])]:
+            names[key] = scale
+            offsets[key] = TONIC_OCTAVE_OFFSET[key_tonic[0]]
+    return names, offsets
+
+keys, key_octave_offset = build_keys()
+
+class KeyContext(object):
+    """The rendering of every syllable in one key, worked out once so
+that converting a note is a matter of table lookups"""
+    def __init__(self, key):
+        self.key = key.lower()
+        self.minor = "minor" in self.key
+
+        if self.key not in keys:
+            raise UnknownKeyError("Doremi cannot render the key '%s'." % key)
+
+        # convert internal octave representation to Lilypond, which
+        # uses c->b
+        offset = key_octave_offset[self.key]
+        names = keys[self.key]
+
+        # map each syllable to its Lilypond pitch name and the octave
+        # adjustment needed where the key's scale crosses from b to c
+        self.pitches = {}
+        for syllable, level in pitch_level.items():
+            # the pitch-level order goes from la->sol if key is minor
+            if self.minor:
+                level = (level + 2) % 7
+
+            if level - offset < 0:
+                adjust = -1
+            elif level - offset > 6:
+                adjust = 1
+            else:
+                adjust = 0
+
+            self.pitches[syllable] = (names[syllable], adjust)
+
+    def octave_marks(self, octave):
+        """Return the Lilypond octave marks for OCTAVE, where 0 is the
+octave below middle c"""
+        try:
+            return OCTAVE_MARKS[octave]
+        except KeyError:
+            if octave < 0:
+                return "," * abs(octave)
+            return "'" * octave
+
+OCTAVE_MARKS = dict([(octave, "," * -octave if octave < 0 else "'" * octave)
+                     for octave in range(-8, 9)])
+
+# contexts already built, keyed by lower-case key name
+_contexts = {}
+
+def key_context(key):
+    """Return the shared KeyContext for KEY"""
+    try:
+        return _contexts[key.lower()]
+    except KeyError:
+        context = KeyContext(key)
+        _contexts[context.key] = context
+        return context
+
+def key_contexts():
+    """Return a KeyContext for every key Doremi renders"""
+    return dict((key, key_context(key)) for key in sorted(keys))
+
+def shapes_name(shapes):
+    """Return the shape-note style SHAPES, correcting a common
+misspelling"""
+    if shapes and shapes.lower() == "aiken":
+        return "aikin"
+    return shapes
 
 def syllable_to_note(syllable, key):
-    return keys[key.lower()][syllable]
+    return key_context(key).pitches[syllable][0]
 
 def key_to_lilypond(key):
     elems = key.split(" ")
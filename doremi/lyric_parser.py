@@ -2,7 +2,11 @@
 the Doremi music-representation language"""
 
 import codecs
-from parsimonious import Grammar, NodeVisitor
+from parsimonious import NodeVisitor
+
+from doremi import timing
+from doremi.grammar import lyric_grammar
+from doremi.parse_cache import cached_parse
 
 class Verse(object):
     """Represents the words to a stanza of a lyric"""
@@ -31,6 +35,8 @@ words that are sung to it"""
         }""" % (self.name,
                 self.verses[i].to_lilypond())
                           for i in range(len(self.verses))])
+    def write_lilypond(self, fp):
+        fp.write(self.to_lilypond())
 
 class Lyric(object):
     """Represents words to be sung, with special provision for strophic
@@ -62,22 +68,44 @@ raise a ValueError"""
         raise ValueError("No string value.")
         
 class LyricParser(NodeVisitor):
-    """Parses .drmw lyric files for association with Doremi tunes"""
-    def __init__(self, text):
+    """Parses .drmw lyric files for association with Doremi tunes; a
+single parser may be used for any number of lyrics in turn"""
+    def __init__(self, text=None, cache_dir=None, parse_cache=None):
         NodeVisitor.__init__(self)
 
-        # start with a new empty lyric
+        # the grammar is compiled once and shared by every parser, when
+        # it is first needed
+        self.cache_dir = cache_dir
+        self._grammar = None
+        self.syntax = None
+        self.parse_cache = parse_cache
+        self.reset()
+
+        # for compatibility, build the syntax tree if given a text
+        if text is not None:
+            self.syntax = self.grammar.parse(text)
+
+    @property
+    def grammar(self):
+        if self._grammar is None:
+            self._grammar = lyric_grammar(self.cache_dir)
+        return self._grammar
+
+    @grammar.setter
+    def grammar(self, grammar):
+        self._grammar = grammar
+
+    def reset(self):
+        """Start again with a new empty lyric"""
         self.lyric = Lyric()
         # add an empty voice to it
         self.lyric.voices.append(LyricVoice())
 
-        # build an abstract syntax tree
-        self.grammar = Grammar(open("lyric-grammar", "r").read())
-        self.syntax = self.grammar.parse(text)
-        
     def convert(self):
         """Convert the syntax tree to our internal representation"""
-        self.visit(self.syntax)
+        self.reset()
+        with timing.stage("lyric visit"):
+            self.visit(self.syntax)
 
         # remove any extra empty voices
         self.lyric.voices = [voice for voice in self.lyric.voices
@@ -89,6 +117,27 @@ class LyricParser(NodeVisitor):
             
         return self.lyric
 
+    def parse(self, text):
+        """Parse the lyric source TEXT and return it as a Lyric, loading
+it from the ParseCache PARSE_CACHE instead if that holds it"""
+        return cached_parse(self.parse_cache, "lyric", text, self.parse_text)
+
+    def parse_text(self, text):
+        """Parse TEXT without consulting the parse cache"""
+        with timing.stage("lyric parse"):
+            self.syntax = self.grammar.parse(text)
+        timing.count("lyrics parsed")
+        return self.convert()
+
+    def parse_stream(self, stream):
+        """Parse a lyric from a file-like object"""
+        return self.parse(stream.read())
+
+    def parse_file(self, fn):
+        """Parse the lyric file named FN"""
+        with codecs.open(fn, "r", "utf-8") as f:
+            return self.parse(f.read())
+
     def visit_title(self, node, vc):
         self.lyric.title = get_string_val(node)
 
@@ -0,0 +1,392 @@
+"""Find the measures of a voice from the lengths of its notes, check
+that they add up, and cut passages of whole measures out of a tune
+
+Doremi has no bar lines: a voice's measures follow from its notes'
+durations, the tune's time signature and partial (pickup) measure, and
+any time change given among the notes.  A MeasureIndex adds up the
+durations exactly, in whole numbers of the largest unit that divides
+them all, and records where each measure begins, so that the notes of
+any measure are found by bisection.
+
+A time change takes effect at the note it is given with; given part way
+through a measure, it ends that measure early, and given at the start
+of a pickup, it leaves the pickup its partial length and sets the length
+of the measures after it.
+
+Measures are numbered from 1, as in printed music; a pickup measure is
+measure 0.
+
+A passage that begins or ends part way through a repeat is given the
+repeat markers it needs to stand alone: one beginning in the repeated
+passage starts its own repeat, and one ending in it or in its second
+ending closes it.  Markers of an ending cut off from the rest of its
+repeat are dropped, and so is the repeat itself if the passage ends
+before its second ending begins.
+
+"""
+
+import bisect
+import copy
+import re
+from fractions import Fraction
+from math import gcd
+
+from doremi.doremi_parser import (END_SLUR, SLUR, TIE, Note, RepeatMarker,
+                                  Tune, Voice)
+
+TIME_CHANGE = re.compile(r"^[0-9]+/[0-9]+$")
+
+# repeat markers that close what comes before them, which a bar line
+# leaves in the measure they end, rather than the one they begin
+CLOSING_MARKERS = frozenset([":|", "!", "1!", "2!", "||", "|."])
+
+# the part of a repeat each repeat marker begins: the repeated passage,
+# the first or second ending, or (None) none
+REPEAT_PARTS = {"|:": "body", ":|": None, "!": "first", "1!": "second",
+                "2!": None}
+
+class MeasureError(Exception):
+    """Raised for measures a voice does not have"""
+    pass
+
+# lengths already worked out, keyed by duration
+_lengths = {}
+
+def duration_fraction(duration):
+    """Return the length of the Doremi DURATION, e.g. "4.", as a fraction
+of a whole note"""
+    try:
+        return _lengths[duration]
+    except KeyError:
+        pass
+    base = duration.rstrip(".")
+    length = part = Fraction(1, int(base))
+    for i in range(len(duration) - len(base)):
+        part /= 2
+        length += part
+    _lengths[duration] = length
+    return length
+
+def time_fraction(time):
+    """Return the length of a measure of the time signature TIME, e.g.
+"3/4", as a fraction of a whole note; by default 4/4"""
+    top, bottom = (time or "4/4").split("/")
+    return Fraction(int(top), int(bottom))
+
+def time_change(note):
+    """Return the time signature given with NOTE, or None"""
+    for mod in note.extra:
+        if TIME_CHANGE.match(mod):
+            return mod
+    return None
+
+class MeasureIndex(object):
+    """The measures of VOICE, in TIME with a pickup of one PARTIAL note
+(e.g. 4 for a quarter note) if given"""
+    def __init__(self, voice, time=None, partial=None):
+        self.voice = voice
+        time = time or "4/4"
+
+        # every length is counted in units small enough that all the
+        # voice's durations and measures are whole numbers of them
+        notes = [item for item in voice if isinstance(item, Note)]
+        lengths = set(duration_fraction(d)
+                      for d in set(note.duration for note in notes))
+        changes = set(time_change(note) for note in notes if note.extra)
+        lengths.update(time_fraction(t) for t in changes | set([time])
+                       if t)
+        if partial:
+            lengths.add(Fraction(1, partial))
+        self.unit = 1
+        for length in lengths:
+            self.unit *= length.denominator // gcd(self.unit,
+                                                  length.denominator)
+        def units(length):
+            return length.numerator * (self.unit // length.denominator)
+        durations = dict((d, units(duration_fraction(d)))
+                         for d in set(note.duration for note in notes))
+
+        # when each item begins, and when each measure begins, what
+        # time signature it is in and how long that makes it
+        self.onsets = []
+        self.starts = [0]
+        self.times = [time]
+        self.lengths = []
+
+        # (item, message) for every note that crosses a bar line
+        self.crossings = []
+
+        # the index of every repeat marker, and the part of a repeat it
+        # begins
+        self.markers = []
+        self.parts = []
+
+        length = units(time_fraction(time))
+        self.first = 0 if partial else 1
+        self.lengths.append(units(Fraction(1, partial)) if partial
+                            else length)
+        bar = self.lengths[0] # when the next measure begins
+        now = 0
+        for i, item in enumerate(voice):
+            self.onsets.append(now)
+            if not isinstance(item, Note):
+                if item.text in REPEAT_PARTS:
+                    self.markers.append(i)
+                    self.parts.append(REPEAT_PARTS[item.text])
+                continue
+
+            changed = item.extra and time_change(item)
+            if changed:
+                length = units(time_fraction(changed))
+                if now > self.starts[-1] and now < bar:
+                    bar = now # the change ends the measure early
+                elif now == self.starts[-1]:
+                    self.times[-1] = changed
+                    if self.first or len(self.starts) > 1:
+                        # a pickup keeps its partial length
+                        self.lengths[-1] = length
+                        bar = now + length
+            while now >= bar:
+                self.starts.append(bar)
+                self.times.append(changed or self.times[-1])
+                self.lengths.append(length)
+                bar += length
+
+            now += durations[item.duration]
+            if now > bar:
+                self.crossings.append((i, "The note crosses the bar line "
+                                       "into measure %d." % self.number(
+                                           len(self.starts))))
+        self._total = now
+
+    def __len__(self):
+        return len(self.starts)
+
+    def fraction(self, units):
+        """Return UNITS as a fraction of a whole note"""
+        return Fraction(units, self.unit)
+
+    @property
+    def total(self):
+        """The length of the voice, as a fraction of a whole note"""
+        return self.fraction(self._total)
+
+    def number(self, i):
+        """Return the number of the measure at index I"""
+        return i + self.first
+
+    def measure_of(self, item):
+        """Return the number of the measure in which the item at index
+ITEM of the voice lies"""
+        return self.number(bisect.bisect_right(self.starts,
+                                               self.onsets[item]) - 1)
+
+    def _span(self, number):
+        # when the measure NUMBER begins and ends, in units
+        i = number - self.first
+        if not 0 <= i < len(self.starts):
+            raise MeasureError("The voice '%s' has no measure %d." %
+                               (self.voice.name, number))
+        if i + 1 < len(self.starts):
+            return self.starts[i], self.starts[i + 1]
+        return self.starts[i], self._total
+
+    def span(self, number):
+        """Return when the measure NUMBER begins and ends, as fractions
+of a whole note"""
+        begin, end = self._span(number)
+        return self.fraction(begin), self.fraction(end)
+
+    def _boundary(self, when):
+        # the first item at or after WHEN, but after any markers that
+        # close the measure ending then
+        i = bisect.bisect_left(self.onsets, when)
+        while (i < len(self.voice) and self.onsets[i] == when and
+               not isinstance(self.voice[i], Note) and
+               self.voice[i].text in CLOSING_MARKERS):
+            i += 1
+        return i
+
+    def items(self, first, last=None):
+        """Return the slice of the voice holding the measures FIRST to
+LAST (by default, just FIRST)"""
+        start = self._span(first)[0]
+        end = self._span(first if last is None else last)[1]
+        if end == self._total:
+            return slice(self._boundary(start), len(self.voice))
+        return slice(self._boundary(start), self._boundary(end))
+
+    def repeat_part(self, item):
+        """Return the part of a repeat ("body", "first" or "second" ending)
+that the item at index ITEM of the voice lies in, or None"""
+        i = bisect.bisect_left(self.markers, item)
+        return self.parts[i - 1] if i else None
+
+    def problems(self, partial=None):
+        """Return (item, message) for every note that crosses a bar line
+and every measure whose notes do not fill it, where ITEM is the index in
+the voice of the note where the trouble lies; PARTIAL is the tune's, so
+that a last measure making up for the pickup is allowed"""
+        found = list(self.crossings)
+        last = len(self.starts) - 1
+        for i in range(len(self.starts)):
+            begin, end = self._span(self.number(i))
+            held = end - begin
+            if held >= self.lengths[i]:
+                continue # full, or reported as a crossing
+            if i == last and partial and (held == self.lengths[i] -
+                                          self.lengths[0]):
+                continue # the last measure makes up for the pickup
+            if self.number(i) == 0:
+                message = ("The pickup measure holds %s of a whole note, "
+                           "but the partial needs %s." %
+                           (self.fraction(held),
+                            self.fraction(self.lengths[i])))
+            else:
+                message = ("Measure %d holds %s of a whole note, but %s "
+                           "time needs %s." % (self.number(i),
+                                               self.fraction(held),
+                                               self.times[i],
+                                               self.fraction(self.lengths[i])))
+            found.append((self.items(self.number(i)).start, message))
+        return found
+
+def tune_measures(tune):
+    """Return a MeasureIndex for every voice of TUNE"""
+    return [MeasureIndex(voice, tune.time, tune.partial) for voice in tune]
+
+def _balance_repeats(items, part):
+    # complete or drop the repeat markers at the edges of ITEMS, a
+    # passage cut from a voice beginning in the PART of a repeat, so that
+    # every repeat in it is whole
+    found = []
+    opened = [] # where the markers of the repeat still open lie in found
+    orphaned = part in ("first", "second") # its repeat began before
+    if part == "body":
+        opened.append(len(found))
+        found.append(RepeatMarker("|:"))
+    for item in items:
+        if isinstance(item, Note) or item.text not in REPEAT_PARTS:
+            found.append(item)
+            continue
+        part = REPEAT_PARTS[item.text]
+        if orphaned:
+            orphaned = part is not None
+            continue
+        if part is None:
+            opened = []
+        else:
+            opened.append(len(found))
+        found.append(item)
+    if orphaned:
+        return found
+    if part == "second" and opened[-1] < len(found) - 1:
+        found.append(RepeatMarker("2!"))
+    elif part == "body":
+        found.append(RepeatMarker(":|"))
+    elif part is not None:
+        # a first ending without its second cannot be written
+        found = [item for i, item in enumerate(found) if i not in opened]
+    return found
+
+def _trim_slurs(items):
+    # copy the notes at the edges of a passage cut from a voice so that
+    # no slur or tie runs out of it
+    items = list(items)
+    notes = [i for i, item in enumerate(items) if isinstance(item, Note)]
+    if not notes:
+        return items
+    for i in notes:
+        if items[i].flags & SLUR:
+            break
+        if items[i].flags & END_SLUR:
+            items[i] = copy.copy(items[i])
+            items[i].flags &= ~END_SLUR
+            break
+    last = notes[-1]
+    if items[last].flags & (SLUR | TIE):
+        items[last] = copy.copy(items[last])
+        items[last].flags &= ~(SLUR | TIE)
+    return items
+
+def excerpt(tune, first, last=None, indexes=None):
+    """Return a Tune of the measures FIRST to LAST (by default, just
+FIRST) of TUNE, in the time signature in effect at FIRST, with the
+pickup only if it includes measure 0; INDEXES are the tune's
+tune_measures, if already built"""
+    if indexes is None:
+        indexes = tune_measures(tune)
+    last = first if last is None else last
+    if last < first:
+        raise MeasureError("Measure %d comes after measure %d." %
+                           (first, last))
+
+    passage = Tune(tune.title, tune.scripture, tune.composer, tune.key,
+                   tune.time, tune.partial if first == 0 else None)
+    for voice, index in zip(tune, indexes):
+        part = Voice(voice.name, voice.octave)
+        items = index.items(first, last)
+        part.extend(_trim_slurs(_balance_repeats(
+            voice[items], index.repeat_part(items.start))))
+        passage.append(part)
+    if indexes:
+        passage.time = indexes[0].times[first - indexes[0].first]
+    return passage
+
+def syllables_before(voice, stop):
+    """Return the number of lyric syllables sung to the items of VOICE
+before the index STOP: one for each note that is not a rest and does
+not continue a slur or tie"""
+    count = 0
+    joined = False
+    for item in voice[:stop]:
+        if not isinstance(item, Note):
+            continue
+        if item.pitch == "r":
+            joined = False
+            continue
+        if not joined:
+            count += 1
+        joined = bool(item.flags & (SLUR | TIE))
+    return count
+
+def lyric_excerpt(lyric, tune, first, last=None, indexes=None):
+    """Return a copy of LYRIC with only the words sung to the measures
+FIRST to LAST of TUNE in each verse; INDEXES are the tune's
+tune_measures, if already built"""
+    if indexes is None:
+        indexes = tune_measures(tune)
+    indexes = dict((voice.name, (voice, index))
+                   for voice, index in zip(tune, indexes))
+    passage = copy.deepcopy(lyric)
+    for lvoice in passage.voices:
+        if lvoice.name not in indexes:
+            continue
+        voice, index = indexes[lvoice.name]
+        items = index.items(first, last)
+        skip = syllables_before(voice, items.start)
+        keep = syllables_before(voice, items.stop) - skip
+        for verse in lvoice.verses:
+            words = []
+            sung = 0
+            for word in verse.words:
+                if word.isdigit():
+                    if sung == 0:
+                        words.append(word) # the verse number
+                    continue
+                if skip <= sung < skip + keep:
+                    words.append(word)
+                sung += 1
+            verse.words = words
+    return passage
+
+def parse_measures(text):
+    """Return the first and last measure of the range TEXT, e.g. "5-8"
+or "5" """
+    try:
+        first, dash, last = text.partition("-")
+        first = int(first)
+        return first, int(last) if dash else first
+    except ValueError:
+        raise MeasureError("'%s' is not a measure or range of measures, "
+                           "such as 5-8." % text)
@@ -0,0 +1,242 @@
+"""Write tunes straight to Standard MIDI Files, without LilyPond
+
+Each voice becomes a track of its own, its syllables turned into
+absolute pitches through the same key tables used for Lilypond output.
+Repeats are played out in full (a body marked with |: and :|, or with
+first and second endings marked !, 1! and 2!), tied notes sound as one
+and a fermata in any voice holds every voice sounding where it ends.  A
+|: never closed is played once.
+
+"""
+
+import bisect
+import struct
+from io import BytesIO
+
+from doremi.doremi_parser import FERMATA, TIE, Note
+from doremi.lilypond import key_context
+
+TICKS_PER_QUARTER = 480
+DEFAULT_TEMPO = 100 # quarter notes per minute
+DEFAULT_VELOCITY = 80
+DEFAULT_PROGRAM = 52 # choir aahs
+
+# how much longer a note under a fermata is held, as a fraction of its
+# length
+FERMATA_HOLD = 0.5
+
+# the semitones above c of each Lilypond note name's letter
+LETTER_SEMITONES = {"c": 0, "d": 2, "e": 4, "f": 5, "g": 7, "a": 9, "b": 11}
+
+# MIDI note number of the Lilypond c with no octave marks
+LILYPOND_C = 48
+
+class MidiError(Exception):
+    """Raised when a tune cannot be written as MIDI"""
+    pass
+
+def pitch_semitones(name):
+    """Return the semitones above c of the Lilypond note name NAME, e.g.
+6 for fis and -1 for ces"""
+    semitones = LETTER_SEMITONES[name[0]]
+    rest = name[1:]
+    while rest:
+        if rest.startswith("is"):
+            semitones += 1
+            rest = rest[2:]
+        elif rest.startswith("es"):
+            semitones -= 1
+            rest = rest[2:]
+        elif rest.startswith("s"): # as, es
+            semitones -= 1
+            rest = rest[1:]
+        else:
+            raise MidiError("Unknown note name '%s'." % name)
+    return semitones
+
+def duration_ticks(duration):
+    """Return the length in ticks of the Doremi DURATION, e.g. "4." """
+    base = duration.rstrip(".")
+    dots = len(duration) - len(base)
+    ticks = TICKS_PER_QUARTER * 4 // int(base)
+    total = ticks
+    for i in range(dots):
+        ticks //= 2
+        total += ticks
+    return total
+
+def expand_repeats(items):
+    """Return the notes of a voice's ITEMS in the order they are sung,
+with every repeat played out"""
+    played = []
+    start = 0 # where the repeated passage begins
+    body = None # the passage before the first ending
+    for item in items:
+        if isinstance(item, Note):
+            played.append(item)
+            continue
+        text = item.text
+        if text == "|:":
+            start = len(played)
+        elif text == ":|":
+            played.extend(played[start:])
+            start = len(played)
+        elif text == "!":
+            body = played[start:]
+        elif text == "1!":
+            # the first ending is over, so go back for the second time
+            played.extend(body or [])
+        elif text == "2!":
+            body = None
+            start = len(played)
+    return played
+
+class NoteEvent(object):
+    """A sounded note or rest: its MIDI note number (None for a rest),
+and when it starts and stops, in ticks"""
+    __slots__ = ["number", "start", "end"]
+
+    def __init__(self, number, start, end):
+        self.number = number
+        self.start = start
+        self.end = end
+
+def voice_events(voice, context, octave_offset=0, fermatas=None):
+    """Return the NoteEvents of VOICE rendered with the KeyContext
+CONTEXT, ties joined and repeats expanded; the end of each note under a
+fermata is added to the dictionary FERMATAS, with how long to hold it"""
+    events = []
+    now = 0
+    tied = False
+    for note in expand_repeats(voice):
+        length = duration_ticks(note.duration)
+        if note.flags & FERMATA and fermatas is not None:
+            end = now + length
+            fermatas[end] = max(fermatas.get(end, 0),
+                                int(length * FERMATA_HOLD))
+
+        if note.pitch == "r":
+            number = None
+        else:
+            name, adjust = context.pitches[note.pitch]
+            octave = note.octave + octave_offset + 1 + adjust
+            number = LILYPOND_C + 12 * octave + pitch_semitones(name)
+            if not 0 <= number <= 127:
+                raise MidiError("Note %s is out of the MIDI range." % number)
+
+        # a note tied from one of the same pitch only lengthens it
+        if tied and events and events[-1].number == number:
+            events[-1].end = now + length
+        else:
+            events.append(NoteEvent(number, now, now + length))
+        tied = bool(note.flags & TIE) and number is not None
+        now += length
+    return events
+
+def variable_length(value):
+    """Return VALUE as a MIDI variable-length quantity"""
+    data = [value & 0x7f]
+    value >>= 7
+    while value:
+        data.append(0x80 | (value & 0x7f))
+        value >>= 7
+    return bytes(reversed(data))
+
+def track_chunk(events):
+    """Return a track chunk of the (tick, message bytes) EVENTS, which
+must be in order"""
+    data = bytearray()
+    now = 0
+    for tick, message in events:
+        data += variable_length(tick - now)
+        data += message
+        now = tick
+    data += b"\x00\xff\x2f\x00" # end of track
+    return b"MTrk" + struct.pack(">I", len(data)) + bytes(data)
+
+def meta(kind, data):
+    return bytes([0xff, kind]) + variable_length(len(data)) + data
+
+def conductor_track(tune, tempo):
+    """Return the track holding the title, tempo and time signature"""
+    events = [(0, meta(0x03, tune.title.encode("utf-8"))),
+              (0, meta(0x51, struct.pack(">I", 60000000 // tempo)[1:]))]
+    if tune.time:
+        top, bottom = tune.time.split("/")
+        power = int(bottom).bit_length() - 1
+        events.append((0, meta(0x58, bytes([int(top), power, 24, 8]))))
+    return track_chunk(events)
+
+def hold_fermatas(fermatas):
+    """Return a function mapping a time in ticks to the time it falls
+once every fermata in FERMATAS (as filled in by voice_events) is held;
+a note ending where a fermata does is held with it"""
+    ends = sorted(fermatas)
+    added = []
+    total = 0
+    for end in ends:
+        total += fermatas[end]
+        added.append(total)
+    def held(tick):
+        i = bisect.bisect_right(ends, tick)
+        return tick + (added[i - 1] if i else 0)
+    return held
+
+def voice_track(notes, name, channel, held, velocity, program):
+    """Return the track playing the NoteEvents NOTES, for the voice NAME,
+on CHANNEL, with times adjusted by HELD"""
+    events = [(0, meta(0x03, name.encode("utf-8"))),
+              (0, bytes([0xc0 | channel, program]))]
+    for note in notes:
+        if note.number is None:
+            continue
+        events.append((held(note.start),
+                       bytes([0x90 | channel, note.number, velocity])))
+        events.append((held(note.end),
+                       bytes([0x80 | channel, note.number, 0])))
+
+    # at any one tick, end notes before starting any, so that a note
+    # struck again at once is not cut short
+    events.sort(key=lambda e: (e[0], e[1][0] & 0xf0 != 0x80))
+    return track_chunk(events)
+
+def channels():
+    # every channel but 10, which General MIDI keeps for percussion
+    while True:
+        for channel in range(16):
+            if channel != 9:
+                yield channel
+
+def write_midi(fp,
+               tune,
+               key=None,
+               octave_offset=0,
+               tempo=DEFAULT_TEMPO,
+               velocity=DEFAULT_VELOCITY,
+               program=DEFAULT_PROGRAM):
+    """Write TUNE as a Standard MIDI File to the binary file-like object
+FP, in KEY (by default, the tune's own)"""
+    context = key_context((key or tune.key).lower())
+
+    # a fermata in one voice holds them all, so find every one first
+    fermatas = {}
+    voices = [(voice.name, voice_events(voice, context, octave_offset,
+                                        fermatas))
+              for voice in tune]
+    held = hold_fermatas(fermatas)
+
+    tracks = [conductor_track(tune, tempo)]
+    for (name, notes), channel in zip(voices, channels()):
+        tracks.append(voice_track(notes, name, channel, held, velocity,
+                                  program))
+
+    fp.write(b"MThd" + struct.pack(">IHHH", 6, 1, len(tracks),
+                                   TICKS_PER_QUARTER))
+    for track in tracks:
+        fp.write(track)
+
+def tune_to_midi(tune, key=None, octave_offset=0, tempo=DEFAULT_TEMPO):
+    """Return TUNE as the bytes of a Standard MIDI File"""
+    out = BytesIO()
+    write_midi(out, tune, key, octave_offset, tempo)
+    return out.getvalue()
@@ -0,0 +1,125 @@
+"""A cache of parsed tunes and lyrics, so that a source file already
+seen is loaded with one read instead of being parsed again
+
+Each entry is a small binary file: a header giving the format version,
+the version of doremi that wrote it, a SHA-256 digest of the source it
+was parsed from and a CRC of its contents, then the pickled model.  An
+entry that does not match in every respect, or cannot be unpickled, is
+ignored and replaced.
+
+Entries are keyed by the digest of the source together with that of
+the package's own sources, so that a model is never loaded by code
+whose classes or grammar differ from the code that pickled it.
+
+"""
+
+import hashlib
+import os
+import pickle
+import struct
+import zlib
+
+import doremi
+from doremi import timing
+from doremi.atomic import atomic_write
+from doremi.cache import DEFAULT_MAX_BYTES, CacheDirectory
+from doremi.grammar import default_cache_dir
+from doremi.sources import source_digest
+
+MAGIC = b"DRMC"
+FORMAT_VERSION = 1
+
+# magic, format version, source digest, payload CRC, and the length of
+# the doremi version string that follows
+HEADER = struct.Struct(">4sH32sIH")
+
+class ParseCache(CacheDirectory):
+    """Parsed Tune and Lyric objects, keyed by the text they were parsed
+from, by default in ~/.cache/doremi/parsed"""
+    def __init__(self, directory=None, max_bytes=DEFAULT_MAX_BYTES):
+        CacheDirectory.__init__(self,
+                                directory or os.path.join(default_cache_dir(),
+                                                          "parsed"),
+                                max_bytes)
+
+    def digest(self, kind, text):
+        """Return the SHA-256 digest of the source TEXT of a KIND
+("tune" or "lyric"), as parsed by the package's current sources"""
+        return hashlib.sha256(("%s:%s:" % (source_digest(), kind) +
+                               text).encode("utf-8")).digest()
+
+    def path(self, digest):
+        name = digest.hex()
+        return os.path.join(self.directory, name[:2], name + ".drmc")
+
+    def load(self, kind, text):
+        """Return the model parsed from TEXT, or None if it is not cached"""
+        digest = self.digest(kind, text)
+        fn = self.path(digest)
+        try:
+            with open(fn, "rb") as f:
+                data = f.read()
+            model = self.decode(data, digest)
+        except (IOError, OSError):
+            model = None
+
+        if model is None:
+            self.stats["misses"] += 1
+            timing.count("parse cache misses")
+            return None
+        self.stats["hits"] += 1
+        timing.count("parse cache hits")
+        return model
+
+    def decode(self, data, digest):
+        """Return the model in the entry DATA, or None if it is not a
+sound entry for the source with DIGEST"""
+        if len(data) < HEADER.size:
+            return None
+        magic, version, source, crc, length = HEADER.unpack_from(data)
+        start = HEADER.size + length
+        if (magic != MAGIC or version != FORMAT_VERSION or
+            source != digest or
+            data[HEADER.size:start].decode("ascii", "replace") !=
+            doremi.__version__):
+            return None
+        payload = data[start:]
+        if zlib.crc32(payload) != crc:
+            return None
+        try:
+            return pickle.loads(payload)
+        except Exception:
+            return None # written by code with different classes
+
+    def encode(self, model, digest):
+        """Return the entry for MODEL, parsed from the source with
+DIGEST"""
+        payload = pickle.dumps(model, pickle.HIGHEST_PROTOCOL)
+        version = doremi.__version__.encode("ascii")
+        return (HEADER.pack(MAGIC, FORMAT_VERSION, digest,
+                            zlib.crc32(payload), len(version)) +
+                version + payload)
+
+    def save(self, kind, text, model):
+        """Store MODEL, parsed from TEXT"""
+        digest = self.digest(kind, text)
+        fn = self.path(digest)
+        try:
+            if not os.path.isdir(os.path.dirname(fn)):
+                os.makedirs(os.path.dirname(fn))
+            with atomic_write(fn, "wb") as f:
+                f.write(self.encode(model, digest))
+        except (IOError, OSError):
+            return # the cache is an optimization; carry on without it
+        self.stats["stores"] += 1
+
+def cached_parse(cache, kind, text, parse):
+    """Return the model of KIND parsed from TEXT, from CACHE if it is
+there, or else by calling PARSE(TEXT) and caching the result"""
+    if cache is None:
+        return parse(text)
+    model = cache.load(kind, text)
+    if model is None:
+        model = parse(text)
+        cache.save(kind, text, model)
+    return model
@@ -0,0 +1,221 @@
+"""Check the part-writing of a tune: parallel fifths and octaves,
+voices crossing and upper voices spaced too widely, using NumPy
+
+The voices of a tune are merged into vertical slices: one for every
+moment at which any voice begins a note, with the note every voice is
+sounding then.  Repeats are played out and tied notes joined, as in the
+MIDI output, so a passage and its repeat are both seen.  The slices are
+kept as arrays (the time of each slice and, for every slice and voice,
+the MIDI note number sounding, -1 for none, and the item of the voice
+it comes from), and each check compares whole columns of them at once.
+
+Only the voices of a four-part choir (soprano, alto, tenor and bass)
+are checked; the shape-note treble and lead double and cross the other
+parts by design.
+
+"""
+
+import numpy as np
+
+from doremi.doremi_parser import TIE
+from doremi.lilypond import key_context, key_contexts
+from doremi.midi import (LILYPOND_C, duration_ticks, expand_repeats,
+                         pitch_semitones)
+
+# the voices of a choir, from the top down
+VOICE_ORDER = ("soprano", "alto", "tenor", "bass")
+
+# the widest interval, in semitones, between each pair of neighbouring
+# upper voices; the bass may lie as far below the tenor as it likes
+MAX_SPACING = {("soprano", "alto"): 12,
+               ("alto", "tenor"): 12}
+
+# intervals, in semitones above an octave, that may not move in parallel
+PERFECT = {7: "fifths", 0: "octaves"}
+
+SILENT = -1
+
+def voice_notes(voice, context):
+    """Return the start and end in ticks, MIDI note number (SILENT for a
+rest) and item index of each note of VOICE as sung, in the KeyContext
+CONTEXT, with repeats played out and tied notes joined"""
+    positions = dict((id(item), i) for i, item in enumerate(voice))
+    numbers = {}
+    starts = []
+    ends = []
+    pitches = []
+    items = []
+    now = 0
+    tied = False
+    for note in expand_repeats(voice):
+        length = duration_ticks(note.duration)
+        if note.pitch == "r":
+            number = SILENT
+        else:
+            key = (note.pitch, note.octave)
+            try:
+                number = numbers[key]
+            except KeyError:
+                name, adjust = context.pitches[note.pitch]
+                number = numbers[key] = (LILYPOND_C +
+                                         12 * (note.octave + 1 + adjust) +
+                                         pitch_semitones(name))
+        if tied and pitches and pitches[-1] == number:
+            ends[-1] = now + length
+        else:
+            starts.append(now)
+            ends.append(now + length)
+            pitches.append(number)
+            items.append(positions[id(note)])
+        tied = bool(note.flags & TIE) and number != SILENT
+        now += length
+    return (np.array(starts, dtype=np.int64), np.array(ends, dtype=np.int64),
+            np.array(pitches, dtype=np.int16), np.array(items, dtype=np.int32))
+
+def tune_context(tune):
+    """Return the KeyContext for TUNE's key, or for C major or A minor if
+its key cannot be rendered; intervals are the same in any key"""
+    key = (tune.key or "").lower()
+    if key not in key_contexts():
+        key = "a minor" if "minor" in key else "c major"
+    return key_context(key)
+
+class VerticalSlices(object):
+    """The voices of TUNE merged by onset: onsets holds the time in
+ticks of every slice, and pitches and items, with a row for each slice
+and a column for each voice, the MIDI note number each voice is
+sounding (SILENT for none) and the index in the voice of its note (-1
+for none)"""
+    def __init__(self, tune):
+        self.names = [voice.name for voice in tune]
+        context = tune_context(tune)
+        notes = [voice_notes(voice, context) for voice in tune]
+        self.onsets = np.unique(np.concatenate(
+            [starts for starts, ends, pitches, items in notes] +
+            [np.zeros(0, dtype=np.int64)]))
+
+        shape = (len(self.onsets), len(self.names))
+        self.pitches = np.full(shape, SILENT, dtype=np.int16)
+        self.items = np.full(shape, -1, dtype=np.int32)
+        for v, (starts, ends, pitches, items) in enumerate(notes):
+            if not len(starts):
+                continue
+            i = np.searchsorted(starts, self.onsets, "right") - 1
+            sounding = (i >= 0) & (self.onsets < ends[np.maximum(i, 0)])
+            self.pitches[sounding, v] = pitches[i[sounding]]
+            self.items[sounding, v] = items[i[sounding]]
+
+    def __len__(self):
+        return len(self.onsets)
+
+    def at(self, tick):
+        """Return the index of the slice sounding at TICK"""
+        return int(np.searchsorted(self.onsets, tick, "right")) - 1
+
+    def choir(self):
+        """Return the columns of the voices of VOICE_ORDER the tune has,
+from the top down"""
+        names = [name.lower() for name in self.names]
+        return [names.index(name) for name in VOICE_ORDER if name in names]
+
+def parallels(slices):
+    """Return (slice, upper voice, lower voice, kind) for every pair of
+voices of the choir moving in the same direction from one perfect fifth
+or octave (or unison) to another, at the slice where they arrive"""
+    p = slices.pitches.astype(np.int32)
+    if len(p) < 2:
+        return []
+    sounding = p != SILENT
+    both = sounding[:, :, None] & sounding[:, None, :]
+    both = both[:-1] & both[1:]
+
+    # the interval between every pair of voices in every slice, and how
+    # each voice moves into the next
+    interval = np.abs(p[:, :, None] - p[:, None, :]) % 12
+    motion = np.sign(p[1:] - p[:-1])
+    same = ((motion[:, :, None] == motion[:, None, :]) &
+            (motion[:, :, None] != 0))
+    choir = np.zeros(p.shape[1], dtype=bool)
+    choir[slices.choir()] = True
+    pairs = (np.triu(np.ones((p.shape[1],) * 2, dtype=bool), 1) &
+             choir[:, None] & choir[None, :])
+
+    found = []
+    for semitones, kind in sorted(PERFECT.items()):
+        perfect = interval == semitones
+        hits = both & same & perfect[:-1] & perfect[1:] & pairs
+        for t, i, j in zip(*np.nonzero(hits)):
+            unison = kind == "octaves" and p[t + 1, i] == p[t + 1, j]
+            found.append((int(t) + 1, int(i), int(j),
+                          "unisons" if unison else kind))
+    found.sort()
+    return found
+
+def _starts(condition):
+    # the slices where runs of CONDITION begin
+    begun = condition.copy()
+    begun[1:] &= ~condition[:-1]
+    return np.flatnonzero(begun)
+
+def crossings(slices):
+    """Return (slice, upper voice, lower voice) wherever a voice of the
+choir begins to sound below the one beneath it"""
+    p = slices.pitches
+    order = slices.choir()
+    found = []
+    for upper, lower in zip(order, order[1:]):
+        crossed = ((p[:, upper] != SILENT) & (p[:, lower] != SILENT) &
+                   (p[:, upper] < p[:, lower]))
+        found.extend((int(t), upper, lower) for t in _starts(crossed))
+    found.sort()
+    return found
+
+def spacing(slices):
+    """Return (slice, upper voice, lower voice, semitones) wherever two
+neighbouring upper voices of the choir begin to lie further apart than
+MAX_SPACING allows"""
+    p = slices.pitches.astype(np.int32)
+    order = slices.choir()
+    found = []
+    for upper, lower in zip(order, order[1:]):
+        widest = MAX_SPACING.get((slices.names[upper].lower(),
+                                  slices.names[lower].lower()))
+        if widest is None:
+            continue
+        apart = p[:, upper] - p[:, lower]
+        wide = ((p[:, upper] != SILENT) & (p[:, lower] != SILENT) &
+                (apart > widest))
+        found.extend((int(t), upper, lower, int(apart[t]))
+                     for t in _starts(wide))
+    found.sort()
+    return found
+
+def problems(tune, slices=None):
+    """Return (voice, item, message) for every part-writing problem in
+TUNE, where VOICE and ITEM are the indexes of the voice and of the note
+in it where the problem lies, each reported once however often a repeat
+plays it"""
+    if slices is None:
+        slices = VerticalSlices(tune)
+    names = slices.names
+    found = []
+    def report(t, voice, message):
+        found.append((voice, int(slices.items[t, voice]), message))
+
+    for t, i, j, kind in parallels(slices):
+        report(t, j, "Parallel %s between the %s and the %s." %
+               (kind, names[i], names[j]))
+    for t, upper, lower in crossings(slices):
+        report(t, lower, "The %s crosses above the %s." %
+               (names[lower], names[upper]))
+    for t, upper, lower, apart in spacing(slices):
+        report(t, upper, "The %s and the %s are %d semitones apart, more "
+               "than an octave." % (names[upper], names[lower], apart))
+
+    seen = set()
+    unique = []
+    for problem in found:
+        if problem not in seen:
+            seen.add(problem)
+            unique.append(problem)
+    return unique
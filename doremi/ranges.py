@@ -0,0 +1,251 @@
+"""Check that every voice of a tune stays within the range of the
+singers it is written for, in any key, using NumPy
+
+The notes of each voice are turned once into parallel arrays (columns)
+of syllable, octave and length.  A table giving the pitch of every
+syllable in every key then turns them into MIDI note numbers for all
+keys at once, a matrix with a row for each key, from which the lowest
+and highest note, the tessitura (the average pitch, weighted by how
+long each note is held) and the notes out of range of each voice are
+reduced in one pass.  The best key for a tune is the one of its mode
+that keeps its voices most within range and nearest the middle of it.
+
+Pitches are as written, as in the MIDI output: in the shape-note
+tradition the lead and treble are written in the treble clef, and are
+given the range of a soprano.
+
+"""
+
+import os
+
+import numpy as np
+
+from doremi.doremi_parser import make_parser
+from doremi.lilypond import key_contexts, pitch_level
+from doremi.midi import (LILYPOND_C, duration_ticks, expand_repeats,
+                         pitch_semitones)
+
+# the singable range of each voice, as MIDI note numbers
+VOICE_RANGES = {"soprano": (60, 79), # C4-G5
+                "treble": (60, 79),
+                "melody": (60, 79),
+                "lead": (60, 79),
+                "alto": (55, 74), # G3-D5
+                "tenor": (48, 69), # C3-A4
+                "bass": (40, 62)} # E2-D4
+
+# how far, in semitones, a tessitura may lie from the middle of its
+# voice's range before it counts against a key
+TESSITURA_SLACK = 3.0
+
+# how much a semitone out of range weighs in choosing a key, against a
+# semitone of tessitura beyond the slack
+STRAIN_WEIGHT = 10.0
+
+# how much a semitone of transposition weighs, so that of two equally
+# good keys the nearer is chosen
+SHIFT_WEIGHT = 0.01
+
+# the most tunes analyzed in one batch by scan_directory
+BATCH_TUNES = 256
+
+NOTE_NAMES = ["C", "C#", "D", "D#", "E", "F", "F#", "G", "G#", "A", "A#",
+              "B"]
+
+SYLLABLES = sorted(pitch_level)
+SYLLABLE_INDEX = dict((syllable, i) for i, syllable in enumerate(SYLLABLES))
+
+def note_name(number):
+    """Return the name of the MIDI note NUMBER, e.g. "C4" for 60"""
+    number = int(round(number))
+    return "%s%d" % (NOTE_NAMES[number % 12], number // 12 - 1)
+
+def key_table(keys):
+    """Return the MIDI note number of every syllable (in the order of
+SYLLABLES) in octave 0 of every one of KEYS, as a matrix with a row for
+each key"""
+    contexts = key_contexts()
+    table = np.zeros((len(keys), len(SYLLABLES)), dtype=np.int16)
+    for i, key in enumerate(keys):
+        pitches = contexts[key].pitches
+        for j, syllable in enumerate(SYLLABLES):
+            name, adjust = pitches[syllable]
+            table[i, j] = (LILYPOND_C + 12 * (1 + adjust) +
+                           pitch_semitones(name))
+    return table
+
+class TuneColumns(object):
+    """The notes of the voices of TUNE as sung, with rests left out, as
+parallel arrays of syllable, octave and length in ticks; the notes of
+each voice follow those of the one before, from its offset in starts"""
+    def __init__(self, tune):
+        self.key = (tune.key or "").lower()
+        self.names = []
+        syllables = []
+        octaves = []
+        durations = []
+        starts = []
+        for voice in tune:
+            notes = [note for note in expand_repeats(voice)
+                     if note.pitch != "r"]
+            if not notes:
+                continue # a voice without notes has no range
+            self.names.append(voice.name)
+            starts.append(len(syllables))
+            for note in notes:
+                syllables.append(SYLLABLE_INDEX[note.pitch])
+                octaves.append(note.octave)
+                durations.append(duration_ticks(note.duration))
+        self.syllables = np.array(syllables, dtype=np.intp)
+        self.octaves = np.array(octaves, dtype=np.int16)
+        self.durations = np.array(durations, dtype=np.int64)
+        self.starts = np.array(starts, dtype=np.intp)
+
+    def __len__(self):
+        return len(self.syllables)
+
+class RangeAnalysis(object):
+    """The range of each voice of a tune in each of KEYS: matrices with
+a row for each key and a column for each of VOICES"""
+    def __init__(self, key, keys, voices, low, high, tessitura, outside,
+                 strain):
+        self.key = key # the tune's own
+        self.keys = keys
+        self.voices = voices
+        self.low = low
+        self.high = high
+        self.tessitura = tessitura
+        self.outside = outside # notes out of range
+        self.strain = strain # average semitones out of range, by time
+
+    def voice_ranges(self, key):
+        """Return, for each voice, its name, its lowest and highest notes,
+its tessitura and the number of its notes out of range in KEY"""
+        i = self.keys.index(key.lower())
+        return [(name, int(self.low[i, j]), int(self.high[i, j]),
+                 float(self.tessitura[i, j]), int(self.outside[i, j]))
+                for j, name in enumerate(self.voices)]
+
+    def costs(self):
+        """Return how badly the tune fits its singers in each key: the
+time spent out of range and the distance of each tessitura from the
+middle of its voice's range, beyond TESSITURA_SLACK, over the voices
+whose range is known"""
+        ranges = [VOICE_RANGES.get(name.lower()) for name in self.voices]
+        known = np.array([r is not None for r in ranges])
+        middle = np.array([(r[0] + r[1]) / 2.0 if r else 0.0
+                           for r in ranges])
+        off_middle = np.maximum(np.abs(self.tessitura - middle) -
+                                TESSITURA_SLACK, 0)
+        costs = ((STRAIN_WEIGHT * self.strain + off_middle) *
+                 known).sum(axis=1)
+        costs /= max(known.sum(), 1)
+        if self.key in self.keys:
+            own = self.tessitura[self.keys.index(self.key)]
+            costs += SHIFT_WEIGHT * np.abs((self.tessitura - own).mean(axis=1))
+        return costs
+
+    def best_key(self):
+        """Return the key of the tune's mode in which it best fits its
+singers, or None if none of its voices has a known range"""
+        if not any(name.lower() in VOICE_RANGES for name in self.voices):
+            return None
+        minor = "minor" in self.key
+        costs = self.costs()
+        candidates = [i for i, key in enumerate(self.keys)
+                      if ("minor" in key) == minor]
+        if not candidates:
+            return None
+        return self.keys[min(candidates, key=lambda i: costs[i])]
+
+def analyze_columns(columns_list, keys=None, octave_offset=0):
+    """Return a RangeAnalysis for each TuneColumns in COLUMNS_LIST, in
+KEYS (by default, every key that can be rendered), transposed
+OCTAVE_OFFSET octaves, working out all the tunes together"""
+    keys = sorted(key_contexts()) if keys is None else [k.lower()
+                                                        for k in keys]
+    columns_list = list(columns_list)
+    table = key_table(keys)
+
+    # one long column of every note of every tune
+    syllables = np.concatenate([c.syllables for c in columns_list] +
+                               [np.zeros(0, dtype=np.intp)])
+    octaves = np.concatenate([c.octaves for c in columns_list] +
+                             [np.zeros(0, dtype=np.int16)])
+    durations = np.concatenate([c.durations for c in columns_list] +
+                               [np.zeros(0, dtype=np.int64)])
+    starts = []
+    lows = []
+    highs = []
+    offset = 0
+    for c in columns_list:
+        starts.extend(offset + c.starts)
+        for name in c.names:
+            low, high = VOICE_RANGES.get(name.lower(), (0, 127))
+            lows.append(low)
+            highs.append(high)
+        offset += len(c)
+    starts = np.array(starts, dtype=np.intp)
+    counts = np.diff(np.append(starts, len(syllables)))
+
+    analyses = []
+    if len(starts):
+        pitches = (table[:, syllables].astype(np.int64) +
+                   12 * (octaves.astype(np.int64) + octave_offset))
+        low = np.minimum.reduceat(pitches, starts, axis=1)
+        high = np.maximum.reduceat(pitches, starts, axis=1)
+        total = np.add.reduceat(durations, starts)
+        tessitura = np.add.reduceat(pitches * durations, starts,
+                                    axis=1) / total
+        beyond = (np.maximum(np.repeat(lows, counts) - pitches, 0) +
+                  np.maximum(pitches - np.repeat(highs, counts), 0))
+        outside = np.add.reduceat((beyond > 0).astype(np.int64), starts,
+                                  axis=1)
+        strain = np.add.reduceat(beyond * durations, starts,
+                                 axis=1) / total
+
+    first = 0
+    for c in columns_list:
+        voices = slice(first, first + len(c.names))
+        first += len(c.names)
+        if not c.names:
+            empty = np.zeros((len(keys), 0))
+            analyses.append(RangeAnalysis(c.key, keys, [], empty, empty,
+                                          empty, empty, empty))
+            continue
+        analyses.append(RangeAnalysis(c.key, keys, c.names,
+                                      low[:, voices], high[:, voices],
+                                      tessitura[:, voices],
+                                      outside[:, voices],
+                                      strain[:, voices]))
+    return analyses
+
+def analyze(tune, keys=None, octave_offset=0):
+    """Return the RangeAnalysis of TUNE in KEYS (by default, every key
+that can be rendered), transposed OCTAVE_OFFSET octaves"""
+    return analyze_columns([TuneColumns(tune)], keys, octave_offset)[0]
+
+def scan_directory(directory, octave_offset=0, parser=None):
+    """Analyze every .drm file in DIRECTORY, in batches, and yield for
+each its name, its Tune and its RangeAnalysis, or its name, None and the
+error that stopped it being read"""
+    parser = parser or make_parser("fast")
+    files = [os.path.join(directory, name)
+             for name in sorted(os.listdir(directory))
+             if name.endswith(".drm")]
+    for i in range(0, len(files), BATCH_TUNES):
+        batch = []
+        for fn in files[i:i + BATCH_TUNES]:
+            try:
+                tune = parser.parse_file(fn)
+                batch.append((fn, tune, TuneColumns(tune)))
+            except Exception as e:
+                batch.append((fn, None, e))
+        analyses = iter(analyze_columns(
+            [columns for fn, tune, columns in batch if tune is not None],
+            octave_offset=octave_offset))
+        for fn, tune, columns in batch:
+            if tune is None:
+                yield fn, None, columns
+            else:
+                yield fn, tune, next(analyses)
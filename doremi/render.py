@@ -0,0 +1,289 @@
+"""Render Doremi tune files to Lilypond or PDF output files
+
+The parsers are imported only when a tune must be parsed, so that a
+run whose outputs all come from the render cache never loads them.
+
+"""
+
+import os
+import sys
+from io import StringIO
+
+from doremi import timing
+from doremi.atomic import atomic_write
+from doremi.grammar import default_cache_dir
+from doremi.lilypond import shapes_name
+from doremi.runner import DEFAULT_TIMEOUT, LilypondError, LilypondRunner
+from doremi.templates import default_registry
+
+# parsers are reusable, so each process keeps one of each kind for
+# each parse cache directory
+_parsers = {}
+
+def get_parse_cache(directory):
+    """Return a ParseCache in DIRECTORY, or None if DIRECTORY is None"""
+    if directory is None:
+        return None
+    from doremi.parse_cache import ParseCache
+    return ParseCache(directory)
+
+def grammar_cache_dir(parse_cache):
+    # a run that may cache parsed tunes may keep compiled grammars too,
+    # rather than compiling them in every new process
+    if parse_cache is None:
+        return None
+    return default_cache_dir()
+
+def get_parser(engine="parsimonious", parse_cache=None):
+    """Return this process's tune parser for ENGINE, keeping parsed tunes
+in the directory PARSE_CACHE if given"""
+    try:
+        return _parsers[(engine, parse_cache)]
+    except KeyError:
+        from doremi.doremi_parser import make_parser
+        parser = make_parser(engine,
+                             cache_dir=grammar_cache_dir(parse_cache),
+                             parse_cache=get_parse_cache(parse_cache))
+        _parsers[(engine, parse_cache)] = parser
+        return parser
+
+# LilyPond runners, keyed by executable and timeout
+_runners = {}
+
+def get_runner(executable=None, timeout=DEFAULT_TIMEOUT):
+    """Return this process's LilypondRunner for EXECUTABLE and TIMEOUT"""
+    try:
+        return _runners[(executable, timeout)]
+    except KeyError:
+        runner = LilypondRunner(executable, timeout=timeout)
+        _runners[(executable, timeout)] = runner
+        return runner
+
+def get_lyric_parser(parse_cache=None):
+    """Return this process's lyric parser, keeping parsed lyrics in the
+directory PARSE_CACHE if given"""
+    try:
+        return _parsers[("lyric", parse_cache)]
+    except KeyError:
+        from doremi.lyric_parser import LyricParser
+        parser = LyricParser(cache_dir=grammar_cache_dir(parse_cache),
+                             parse_cache=get_parse_cache(parse_cache))
+        _parsers[("lyric", parse_cache)] = parser
+        return parser
+
+class RenderJob(object):
+    """The input files and options for rendering one tune to one output
+file"""
+    def __init__(self,
+                 infile,
+                 outfile,
+                 key=None,
+                 shapes=None,
+                 octaves=0,
+                 lyricfile=None,
+                 template=None,
+                 engine="parsimonious",
+                 template_path=None,
+                 lilypond=None,
+                 timeout=None,
+                 parse_cache=None,
+                 measures=None):
+        self.infile = infile
+        self.outfile = outfile
+        self.key = key
+        self.lyricfile = lyricfile
+        self.engine = engine
+        self.octaves = int(octaves or 0)
+        self.template = template or "default"
+
+        # the LilyPond executable and its time limit, for PDF output
+        self.lilypond = lilypond
+        self.timeout = float(timeout or DEFAULT_TIMEOUT)
+
+        # the directory of previously parsed tunes and lyrics, if any
+        self.parse_cache = parse_cache
+
+        # directories to search for templates before the usual ones
+        self.template_path = list(template_path or [])
+
+        self.shapes = shapes_name(shapes)
+
+        # the first and last measures to render, or None for them all
+        self.measures = measures
+
+    def __repr__(self):
+        return "RenderJob(%r, %r)" % (self.infile, self.outfile)
+
+def read_lyric(lyricfile, parse_cache=None):
+    """Parse LYRICFILE, or return an empty Lyric if none is given"""
+    if not lyricfile:
+        from doremi.lyric_parser import Lyric
+        return Lyric()
+    try:
+        return get_lyric_parser(parse_cache).parse_file(lyricfile)
+    except FileNotFoundError:
+        raise Exception("Unable to open lyric file '%s'." % lyricfile)
+
+def select_measures(job, tune, lyric=None):
+    """Return TUNE and LYRIC cut down to the measures JOB renders"""
+    if job.measures is None:
+        return tune, lyric
+    from doremi.measures import excerpt, lyric_excerpt, tune_measures
+    first, last = job.measures
+    indexes = tune_measures(tune)
+    if lyric is not None:
+        lyric = lyric_excerpt(lyric, tune, first, last, indexes)
+    return excerpt(tune, first, last, indexes), lyric
+
+def write_lilypond(job, fp):
+    """Write the Lilypond text for JOB to the file-like object FP"""
+    lyric = read_lyric(job.lyricfile, job.parse_cache)
+
+    # parse the Doremi file and convert it to the internal
+    # representation
+    tune = get_parser(job.engine, job.parse_cache).parse_file(job.infile)
+    tune, lyric = select_measures(job, tune, lyric)
+
+    key = job.key or tune.key
+
+    tune.write_lilypond(fp,
+                        key.lower(),
+                        octave_offset=job.octaves,
+                        shapes=job.shapes,
+                        lyric=lyric,
+                        template=job.template,
+                        registry=default_registry(job.template_path))
+
+def render_lilypond(job):
+    """Return the Lilypond text for JOB"""
+    out = StringIO()
+    write_lilypond(job, out)
+    return out.getvalue()
+
+def is_midi(outfile):
+    """Return whether OUTFILE names a MIDI file"""
+    return outfile.endswith((".mid", ".midi"))
+
+def write_midi_file(outfile, tune, key=None, octaves=0):
+    """Write TUNE to the MIDI file OUTFILE, in KEY (by default, the
+tune's own) and transposed OCTAVES octaves"""
+    from doremi.midi import write_midi
+    with atomic_write(outfile, "wb") as f:
+        write_midi(f, tune, key, octaves)
+
+def write_output(job):
+    """Write the output file for JOB, typesetting it first if it names a
+PDF or writing MIDI if it names a .mid file; an output file of "-" is
+standard output"""
+    outfile = job.outfile
+    if outfile == "-":
+        write_lilypond(job, sys.stdout)
+    elif outfile.endswith(".pdf"):
+        # remove any earlier PDF, so that a failed run cannot leave it
+        # looking like this one's output
+        if os.path.exists(outfile):
+            os.remove(outfile)
+        get_runner(job.lilypond, job.timeout).run(render_lilypond(job),
+                                                  outfile[:-4])
+        if not os.path.exists(outfile):
+            raise LilypondError("LilyPond wrote no '%s'." % outfile)
+    elif is_midi(outfile):
+        # MIDI needs neither lyrics nor LilyPond
+        tune = get_parser(job.engine, job.parse_cache).parse_file(job.infile)
+        tune = select_measures(job, tune)[0]
+        write_midi_file(outfile, tune, job.key, job.octaves)
+    elif outfile.endswith(".ly"):
+        # a failure part way through never leaves a truncated file
+        with atomic_write(outfile, "w", "utf-8") as f:
+            write_lilypond(job, f)
+
+def variant_outfile(outfile, variant, varying, tune_key=""):
+    """Return the output file name for VARIANT: OUTFILE with the
+variant's fields filled in if it has {key}, {shapes}, {octaves} or
+{template} placeholders, or else with the VARYING fields added to its
+base name"""
+    fields = variant.fields(tune_key)
+    if "{" in outfile:
+        return outfile.format(**fields)
+    if not varying:
+        return outfile
+    base, ext = os.path.splitext(outfile)
+    return "%s-%s%s" % (base, "-".join(fields[name] for name in varying),
+                        ext)
+
+def render_variants(job, variants):
+    """Parse the tune and lyrics of JOB once and write an output file for
+each of VARIANTS, named after JOB's output by variant_outfile, of the
+kind write_output would write; PDFs are typeset side by side.  Return
+(variant, output file, error) for each, where the error is None for
+those that succeeded."""
+    midi = is_midi(job.outfile)
+    lyric = None if midi else read_lyric(job.lyricfile, job.parse_cache)
+    tune = get_parser(job.engine, job.parse_cache).parse_file(job.infile)
+    tune, lyric = select_measures(job, tune, lyric)
+    registry = default_registry(job.template_path)
+
+    varying = [name for name in ("key", "shapes", "octaves", "template")
+               if len(set(v.fields()[name] for v in variants)) > 1]
+    outfiles = [variant_outfile(job.outfile, variant, varying, tune.key)
+                for variant in variants]
+    for outdir in set(os.path.dirname(outfile) for outfile in outfiles):
+        if outdir and not os.path.isdir(outdir):
+            os.makedirs(outdir)
+
+    results = []
+    texts = []
+    for variant, outfile in zip(variants, outfiles):
+        try:
+            if midi:
+                write_midi_file(outfile, tune, variant.key, variant.octaves)
+            else:
+                texts.append((len(results), tune.to_lilypond(
+                    (variant.key or tune.key).lower(),
+                    variant.octaves,
+                    variant.shapes,
+                    lyric,
+                    variant.template,
+                    registry)))
+        except Exception as e:
+            results.append((variant, outfile,
+                            "%s: %s" % (type(e).__name__, e)))
+            continue
+        results.append((variant, outfile, None))
+
+    if job.outfile.endswith(".pdf"):
+        for i, text in texts:
+            if os.path.exists(results[i][1]):
+                os.remove(results[i][1])
+        typeset = get_runner(job.lilypond, job.timeout).run_many(
+            [(text, results[i][1][:-4]) for i, text in texts])
+        for (i, text), result in zip(texts, typeset):
+            if not result.ok:
+                results[i] = results[i][:2] + (result.error,)
+    elif not midi:
+        for i, text in texts:
+            with atomic_write(results[i][1], "w", "utf-8") as f:
+                f.write(text)
+    return results
+
+def render(job, cache=None):
+    """Convert the tune described by JOB and write its output file,
+copying it from the RenderCache CACHE instead if it holds an identical
+rendering; return True if it did"""
+    if job.outfile == "-":
+        cache = None
+
+    # with an input missing there is no key, and rendering reports it
+    key = cache.key(job) if cache is not None else None
+    if key is not None:
+        if cache.fetch(key, job.outfile):
+            timing.count("cache hits")
+            return True
+        timing.count("cache misses")
+
+    with timing.stage("write output"):
+        write_output(job)
+
+    if key is not None and os.path.exists(job.outfile):
+        cache.store(key, job.outfile)
+    return False
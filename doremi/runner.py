@@ -0,0 +1,167 @@
+"""Run LilyPond to typeset rendered tunes, with bounded concurrency,
+timeouts and captured logs
+
+The LilyPond executable is "lilypond" unless $LILYPOND or the runner's
+EXECUTABLE says otherwise, so a stand-in such as tools/stub-lilypond
+can take its place in tests.
+
+"""
+
+import os
+import subprocess
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from doremi import timing
+
+DEFAULT_TIMEOUT = 300
+
+class LilypondError(Exception):
+    """Raised when LilyPond fails, cannot be started or runs too long"""
+    def __init__(self, message, result=None):
+        Exception.__init__(self, message)
+        self.result = result
+
+class LilypondResult(object):
+    """The outcome of typesetting one file: the output base name, the
+exit status, LilyPond's log and the time taken"""
+    def __init__(self, output, returncode=None, log="", elapsed=0.0,
+                 error=None):
+        self.output = output
+        self.returncode = returncode
+        self.log = log
+        self.elapsed = elapsed
+        self.error = error
+
+    @property
+    def ok(self):
+        return self.error is None
+
+    def pdf(self):
+        return self.output + ".pdf"
+
+def log_tail(log, lines=10):
+    """Return the last LINES lines of LOG"""
+    return "\n".join(log.rstrip().splitlines()[-lines:])
+
+class LilypondRunner(object):
+    """Runs at most JOBS LilyPond processes at a time, each limited to
+TIMEOUT seconds, feeding the source through standard input unless
+USE_STDIN is false"""
+    def __init__(self, executable=None, jobs=None, timeout=DEFAULT_TIMEOUT,
+                 use_stdin=True):
+        self.executable = (executable or os.environ.get("LILYPOND") or
+                           "lilypond")
+        self.jobs = jobs or os.cpu_count() or 1
+        self.timeout = timeout
+        self.use_stdin = use_stdin
+        self._slots = threading.BoundedSemaphore(self.jobs)
+        self._lock = threading.Lock()
+        self._executor = None
+        self.stats = {"runs": 0, "failures": 0, "timeouts": 0,
+                      "seconds": 0.0, "started": None, "finished": None}
+
+    def _record(self, result, timed_out=False):
+        with self._lock:
+            self.stats["runs"] += 1
+            self.stats["seconds"] += result.elapsed
+            if not result.ok:
+                self.stats["failures"] += 1
+            if timed_out:
+                self.stats["timeouts"] += 1
+            self.stats["finished"] = time.time()
+
+    def throughput(self):
+        """Return the files typeset per second of wall-clock time since
+the first began"""
+        started, finished = self.stats["started"], self.stats["finished"]
+        if not started or not finished or finished <= started:
+            return 0.0
+        return self.stats["runs"] / (finished - started)
+
+    def run(self, ly, output):
+        """Typeset the Lilypond text LY to OUTPUT.pdf, waiting for a free
+slot first; raise LilypondError if LilyPond fails"""
+        result = self.try_run(ly, output)
+        if not result.ok:
+            raise LilypondError(result.error, result)
+        return result
+
+    def try_run(self, ly, output):
+        """As run, but return a failed LilypondResult rather than
+raising"""
+        with self._slots:
+            with self._lock:
+                if self.stats["started"] is None:
+                    self.stats["started"] = time.time()
+            if self.use_stdin:
+                return self._run(ly.encode("utf-8"), output, "-")
+
+            # some LilyPond builds can't read standard input, so write
+            # a temporary file and always clean it up
+            fd, fn = tempfile.mkstemp(suffix=".ly", prefix="doremi-")
+            try:
+                with os.fdopen(fd, "wb") as f:
+                    f.write(ly.encode("utf-8"))
+                return self._run(None, output, fn)
+            finally:
+                os.remove(fn)
+
+    def _run(self, data, output, source):
+        command = [self.executable, "-o", output, source]
+        start = time.time()
+        timed_out = False
+        try:
+            proc = subprocess.Popen(command,
+                                    stdin=subprocess.PIPE if data else None,
+                                    stdout=subprocess.PIPE,
+                                    stderr=subprocess.STDOUT)
+        except OSError as e:
+            result = LilypondResult(output, elapsed=time.time() - start,
+                                    error="Unable to run %s: %s" %
+                                    (self.executable, e))
+            self._record(result)
+            return result
+
+        try:
+            with timing.stage("lilypond"):
+                log, _ = proc.communicate(data, timeout=self.timeout)
+        except subprocess.TimeoutExpired:
+            proc.kill()
+            log, _ = proc.communicate()
+            timed_out = True
+
+        log = log.decode("utf-8", "replace")
+        result = LilypondResult(output, proc.returncode, log,
+                                time.time() - start)
+        timing.count("lilypond runs")
+        if timed_out:
+            result.error = ("LilyPond took more than %ss on %s." %
+                            (self.timeout, output))
+        elif proc.returncode != 0:
+            result.error = ("LilyPond failed on %s (exit status %d):\n%s" %
+                            (output, proc.returncode, log_tail(log)))
+        self._record(result, timed_out)
+        return result
+
+    def submit(self, ly, output):
+        """Start typesetting LY to OUTPUT.pdf in the background, returning
+a future whose result is the LilypondResult"""
+        with self._lock:
+            if self._executor is None:
+                self._executor = ThreadPoolExecutor(self.jobs)
+        return self._executor.submit(self.try_run, ly, output)
+
+    def run_many(self, items):
+        """Typeset every (ly, output) pair in ITEMS, up to JOBS at once,
+and return their LilypondResults in order"""
+        futures = [self.submit(ly, output) for ly, output in items]
+        return [future.result() for future in futures]
+
+    def close(self):
+        """Wait for any background jobs and release their threads"""
+        if self._executor is not None:
+            self._executor.shutdown()
+            self._executor = None
@@ -0,0 +1,352 @@
+"""Render tunes from a long-running process, so that the grammars,
+templates and key tables are loaded once rather than for every tune
+
+The server reads requests as lines of JSON, from standard input or from
+connections to a Unix socket, and answers each with a line of JSON.  A
+request gives the text of a tune and, optionally, of its lyrics, with
+the usual rendering options:
+
+    {"id": 1, "tune": "...", "lyric": "...", "key": "g major",
+     "shapes": "aikin", "octaves": 0, "template": "default",
+     "engine": "fast", "format": "ly", "measures": "5-8"}
+
+The answer carries the request's id and the time each stage took, in
+seconds:
+
+    {"id": 1, "ok": true, "format": "ly", "output": "...",
+     "timings": {"queued": ..., "parse": ..., "render": ...,
+                 "total": ...}}
+
+PDF ("pdf") and MIDI ("mid") output is sent base64-encoded, with
+"encoding": "base64".  A request that cannot be rendered is answered
+with "ok": false and an "error".  Requests are rendered by a bounded
+pool of threads, so the answers on one connection may come back in a
+different order from the requests.
+
+"""
+
+import base64
+import json
+import os
+import shutil
+import signal
+import socket
+import socketserver
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, wait
+
+from doremi import ENGINES
+from doremi.doremi_parser import make_parser
+from doremi.grammar import doremi_grammar, lyric_grammar
+from doremi.lilypond import key_contexts, shapes_name
+from doremi.lyric_parser import Lyric, LyricParser
+from doremi.measures import (excerpt, lyric_excerpt, parse_measures,
+                             tune_measures)
+from doremi.midi import tune_to_midi
+from doremi.render import get_runner
+from doremi.runner import DEFAULT_TIMEOUT
+from doremi.templates import TemplateError, default_registry
+
+FORMATS = ("ly", "pdf", "mid")
+
+class RequestError(Exception):
+    """Raised for a request that is not well formed"""
+    pass
+
+class _Clock(object):
+    # adds the time spent in it to TIMINGS[NAME], as a context manager
+    def __init__(self, timings, name):
+        self.timings = timings
+        self.name = name
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        self.timings[self.name] = (self.timings.get(self.name, 0.0) +
+                                   time.perf_counter() - self.start)
+        return False
+
+class RenderServer(object):
+    """Renders requests on a pool of JOBS threads, with at most BACKLOG
+more requests waiting for a thread before reading stops; PDFs are
+typeset with the LilyPond executable LILYPOND, limited to TIMEOUT
+seconds, and templates are sought first in TEMPLATE_PATH"""
+    def __init__(self, jobs=None, backlog=None, template_path=None,
+                 lilypond=None, timeout=None):
+        self.jobs = jobs or os.cpu_count() or 1
+        self.backlog = self.jobs if backlog is None else backlog
+        self.template_path = list(template_path or [])
+        self.lilypond = lilypond
+        self.timeout = float(timeout or DEFAULT_TIMEOUT)
+
+        self._executor = ThreadPoolExecutor(self.jobs)
+        self._slots = threading.BoundedSemaphore(self.jobs + self.backlog)
+
+        # parsers keep state while they work, so each thread has its own
+        self._local = threading.local()
+
+        self._lock = threading.Lock()
+        self.stats = {"requests": 0, "failures": 0, "seconds": 0.0}
+
+    def warm(self):
+        """Load everything rendering needs that can be loaded before the
+first request"""
+        doremi_grammar()
+        lyric_grammar()
+        key_contexts()
+        registry = default_registry(self.template_path)
+        for path in registry.paths:
+            try:
+                names = os.listdir(path)
+            except OSError:
+                continue
+            for name in names:
+                if name.endswith("-voice.tmpl"):
+                    try:
+                        registry.tune_template(name[:-len("-voice.tmpl")])
+                        registry.voice_template(name[:-len("-voice.tmpl")])
+                    except TemplateError:
+                        pass # reported if a request uses it
+
+    def parser(self, kind):
+        """Return this thread's parser of KIND, an engine name or
+"lyric" """
+        try:
+            parsers = self._local.parsers
+        except AttributeError:
+            parsers = self._local.parsers = {}
+        try:
+            return parsers[kind]
+        except KeyError:
+            if kind == "lyric":
+                parser = LyricParser()
+            else:
+                parser = make_parser(kind)
+            parsers[kind] = parser
+            return parser
+
+    def render(self, request, timings):
+        """Return the output for REQUEST, a dictionary, as text for
+Lilypond and bytes otherwise, adding the time each stage takes to the
+dictionary TIMINGS"""
+        fmt = request.get("format") or "ly"
+        if fmt not in FORMATS:
+            raise RequestError("Unknown format '%s'." % fmt)
+        engine = request.get("engine") or "parsimonious"
+        if engine not in ENGINES:
+            raise RequestError("Unknown engine '%s'." % engine)
+        if not isinstance(request.get("tune"), str):
+            raise RequestError("The request has no tune.")
+
+        with _Clock(timings, "parse"):
+            tune = self.parser(engine).parse(request["tune"])
+            if request.get("lyric"):
+                lyric = self.parser("lyric").parse(request["lyric"])
+            else:
+                lyric = Lyric()
+            if request.get("measures"):
+                first, last = parse_measures(str(request["measures"]))
+                indexes = tune_measures(tune)
+                lyric = lyric_excerpt(lyric, tune, first, last, indexes)
+                tune = excerpt(tune, first, last, indexes)
+
+        octaves = int(request.get("octaves") or 0)
+        if fmt == "mid":
+            with _Clock(timings, "render"):
+                return tune_to_midi(tune, request.get("key"), octaves)
+
+        with _Clock(timings, "render"):
+            ly = tune.to_lilypond((request.get("key") or tune.key).lower(),
+                                  octaves,
+                                  shapes_name(request.get("shapes")),
+                                  lyric,
+                                  request.get("template") or "default",
+                                  default_registry(self.template_path))
+        if fmt == "ly":
+            return ly
+
+        with _Clock(timings, "lilypond"):
+            return self.typeset(ly)
+
+    def typeset(self, ly):
+        """Return the PDF LilyPond makes of LY"""
+        outdir = tempfile.mkdtemp(prefix="doremi-serve-")
+        try:
+            output = os.path.join(outdir, "tune")
+            get_runner(self.lilypond, self.timeout).run(ly, output)
+            with open(output + ".pdf", "rb") as f:
+                return f.read()
+        finally:
+            shutil.rmtree(outdir, ignore_errors=True)
+
+    def answer(self, request, received):
+        """Return the answer to REQUEST, received at the perf_counter
+time RECEIVED"""
+        timings = {"queued": time.perf_counter() - received}
+        response = {"id": request.get("id")}
+        try:
+            output = self.render(request, timings)
+        except Exception as e:
+            response["ok"] = False
+            response["error"] = "%s: %s" % (type(e).__name__, e)
+        else:
+            response["ok"] = True
+            response["format"] = request.get("format") or "ly"
+            if isinstance(output, bytes):
+                response["encoding"] = "base64"
+                output = base64.b64encode(output).decode("ascii")
+            response["output"] = output
+        timings["total"] = time.perf_counter() - received
+        response["timings"] = timings
+
+        with self._lock:
+            self.stats["requests"] += 1
+            self.stats["seconds"] += timings["total"]
+            if not response["ok"]:
+                self.stats["failures"] += 1
+        return response
+
+    def submit(self, request, reply):
+        """Render REQUEST on the pool and pass its answer to REPLY,
+waiting first while the pool and its backlog are full; return the
+future"""
+        received = time.perf_counter()
+        self._slots.acquire()
+        def run():
+            try:
+                reply(self.answer(request, received))
+            finally:
+                self._slots.release()
+        return self._executor.submit(run)
+
+    def serve_stream(self, rfile, wfile):
+        """Answer each line of JSON read from the binary file RFILE with
+one written to WFILE, until RFILE is exhausted and every answer is
+written"""
+        lock = threading.Lock()
+        def reply(response):
+            line = json.dumps(response, sort_keys=True) + "\n"
+            with lock:
+                wfile.write(line.encode("utf-8"))
+                wfile.flush()
+
+        pending = []
+        for line in rfile:
+            if not line.strip():
+                continue
+            try:
+                request = json.loads(line.decode("utf-8"))
+                if not isinstance(request, dict):
+                    raise ValueError("a request must be a JSON object")
+            except ValueError as e:
+                reply({"id": None, "ok": False,
+                       "error": "RequestError: %s" % e})
+                continue
+            pending = [f for f in pending if not f.done()]
+            pending.append(self.submit(request, reply))
+        wait(pending)
+
+    def serve_stdio(self):
+        """Answer requests from standard input on standard output"""
+        self.serve_stream(sys.stdin.buffer, sys.stdout.buffer)
+
+    def serve_socket(self, path):
+        """Answer requests on every connection to the Unix socket PATH,
+until interrupted"""
+        renderer = self
+        class Handler(socketserver.StreamRequestHandler):
+            def handle(self):
+                try:
+                    renderer.serve_stream(self.rfile, self.wfile)
+                except (BrokenPipeError, ConnectionResetError):
+                    pass # the client went away
+
+        if os.path.exists(path):
+            os.remove(path) # left behind by an earlier server
+        server = socketserver.ThreadingUnixStreamServer(path, Handler)
+        server.daemon_threads = True
+
+        # a daemon is usually stopped with SIGTERM, and should clean up
+        # after itself then too
+        signal.signal(signal.SIGTERM, lambda signum, frame: sys.exit(0))
+        try:
+            server.serve_forever()
+        except KeyboardInterrupt:
+            pass
+        finally:
+            server.server_close()
+            os.remove(path)
+
+    def close(self):
+        self._executor.shutdown()
+
+class Client(object):
+    """A connection to a RenderServer: to the Unix socket PATH if one is
+given, or else to a new server process reading standard input, started
+with the extra command-line ARGS"""
+    def __init__(self, path=None, args=()):
+        self.process = None
+        if path:
+            self.socket = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+            self.socket.connect(path)
+            self.wfile = self.socket.makefile("wb")
+            self.rfile = self.socket.makefile("rb")
+        else:
+            script = os.path.join(os.path.dirname(os.path.dirname(
+                os.path.abspath(__file__))), "doremi.py")
+            self.socket = None
+            self.process = subprocess.Popen(
+                [sys.executable, script, "--serve", "-"] + list(args),
+                stdin=subprocess.PIPE,
+                stdout=subprocess.PIPE)
+            self.wfile = self.process.stdin
+            self.rfile = self.process.stdout
+        self._next_id = 0
+
+    def send(self, request):
+        """Send REQUEST, giving it an id if it has none; return the id"""
+        if request.get("id") is None:
+            self._next_id += 1
+            request = dict(request, id=self._next_id)
+        self.wfile.write((json.dumps(request) + "\n").encode("utf-8"))
+        self.wfile.flush()
+        return request["id"]
+
+    def receive(self):
+        """Return the next answer, with any base64 output decoded"""
+        line = self.rfile.readline()
+        if not line:
+            raise EOFError("The server closed the connection.")
+        response = json.loads(line.decode("utf-8"))
+        if response.get("encoding") == "base64":
+            response["output"] = base64.b64decode(response["output"])
+        return response
+
+    def request_many(self, requests):
+        """Send every request in REQUESTS at once and return their
+answers in the same order"""
+        ids = [self.send(request) for request in requests]
+        answers = {}
+        while len(answers) < len(ids):
+            response = self.receive()
+            answers[response["id"]] = response
+        return [answers[i] for i in ids]
+
+    def request(self, request):
+        return self.request_many([request])[0]
+
+    def close(self):
+        if self.socket is not None:
+            self.wfile.close()
+            self.rfile.close()
+            self.socket.close()
+        else:
+            self.wfile.close()
+            self.process.wait()
+            self.rfile.close()
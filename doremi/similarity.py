@@ -0,0 +1,209 @@
+"""Find tunes with the same or nearly the same melody, whatever their
+names or keys, using NumPy
+
+A melody is reduced to the steps between its notes, in scale degrees,
+and the ratios between their lengths, so that it compares the same in
+any key, octave or note value.  Each run of NGRAM steps becomes an
+integer code, and the codes of a whole library are kept in one sorted
+array with the tune each belongs to.  A query looks up all its codes at
+once with searchsorted and counts, for every tune together, how many it
+shares; the similarity of two tunes is the share of their runs they
+have in common (the Jaccard index), of steps alone and of steps with
+rhythm.  Tunes that begin with the same INCIPIT steps are marked too.
+
+Melodies are taken from a doremi.index.TuneIndex, so a library that has
+been indexed is compared without parsing it again.
+
+"""
+
+import numpy as np
+
+from doremi.index import library_index, melody, melody_line
+
+# steps of a run, and of an incipit
+NGRAM = 5
+INCIPIT = 8
+
+# how much rhythm counts in the similarity, against pitch
+RHYTHM_WEIGHT = 0.25
+
+# steps and length ratios beyond these are taken as these
+MAX_STEP = 12
+MAX_RATIO = 6
+
+# the code of a step missing from a short incipit
+NO_STEP = -(MAX_STEP + 1)
+
+STEP_BASE = 2 * MAX_STEP + 1
+RATIO_BASE = 2 * MAX_RATIO + 1
+
+def melody_arrays(degrees, durations):
+    """Return the steps between the scale DEGREES of a melody and the
+ratios between the DURATIONS of its notes, the latter in half powers of
+two, as arrays of one element fewer"""
+    degrees = np.asarray(degrees, dtype=np.int32)
+    durations = np.asarray(durations, dtype=np.float64)
+    steps = np.clip(np.diff(degrees), -MAX_STEP, MAX_STEP)
+    if len(durations) < 2:
+        ratios = np.zeros(0, dtype=np.int32)
+    else:
+        ratios = np.rint(2 * np.log2(durations[1:] / durations[:-1]))
+        ratios = np.clip(ratios, -MAX_RATIO, MAX_RATIO).astype(np.int32)
+    return steps, ratios
+
+def ngram_codes(symbols, base, n=NGRAM):
+    """Return the distinct codes of the runs of N SYMBOLS, each between 0
+and BASE - 1, sorted"""
+    if len(symbols) < n:
+        return np.zeros(0, dtype=np.int64)
+    windows = np.lib.stride_tricks.sliding_window_view(
+        symbols.astype(np.int64), n)
+    powers = base ** np.arange(n, dtype=np.int64)
+    return np.unique(windows @ powers)
+
+def melody_codes(steps, ratios, n=NGRAM):
+    """Return the codes of the runs of pitch and of pitch with rhythm in a
+melody's STEPS and RATIOS"""
+    pitch = steps + MAX_STEP
+    joint = pitch * RATIO_BASE + ratios + MAX_RATIO
+    return (ngram_codes(pitch, STEP_BASE, n),
+            ngram_codes(joint, STEP_BASE * RATIO_BASE, n))
+
+def incipit(steps, length=INCIPIT):
+    """Return the first LENGTH STEPS, padded with NO_STEP"""
+    found = np.full(length, NO_STEP, dtype=np.int32)
+    found[:min(length, len(steps))] = steps[:length]
+    return found
+
+class _Postings(object):
+    # the sorted codes of every tune, with the tune each belongs to
+    def __init__(self, code_lists):
+        self.sizes = np.array([len(codes) for codes in code_lists],
+                              dtype=np.int64)
+        if code_lists:
+            codes = np.concatenate(code_lists)
+        else:
+            codes = np.zeros(0, dtype=np.int64)
+        owners = np.repeat(np.arange(len(code_lists)), self.sizes)
+        order = np.argsort(codes, kind="stable")
+        self.codes = codes[order]
+        self.owners = owners[order]
+
+    def similarity(self, query):
+        """Return the Jaccard index of the distinct codes QUERY with those
+of every tune"""
+        lo = np.searchsorted(self.codes, query, "left")
+        counts = np.searchsorted(self.codes, query, "right") - lo
+
+        # the positions of every posting of every query code, in one array
+        starts = np.repeat(lo - np.cumsum(counts) + counts, counts)
+        hits = starts + np.arange(counts.sum())
+        shared = np.bincount(self.owners[hits], minlength=len(self.sizes))
+        union = self.sizes + len(query) - shared
+        return shared / np.maximum(union, 1)
+
+class MelodyIndex(object):
+    """The melodies of a collection of tunes, for finding those like a
+given one; melodies are added, then the index is built"""
+    def __init__(self, n=NGRAM, rhythm_weight=RHYTHM_WEIGHT):
+        self.n = n
+        self.rhythm_weight = rhythm_weight
+        self.names = []
+        self._pitch = []
+        self._joint = []
+        self._incipits = []
+        self._built = None
+
+    def __len__(self):
+        return len(self.names)
+
+    def add(self, name, degrees, durations):
+        """Add the melody with the scale DEGREES and DURATIONS, as given
+by doremi.index.melody_line, under NAME"""
+        steps, ratios = melody_arrays(degrees, durations)
+        pitch, joint = melody_codes(steps, ratios, self.n)
+        self.names.append(name)
+        self._pitch.append(pitch)
+        self._joint.append(joint)
+        self._incipits.append(incipit(steps))
+        self._built = None
+
+    def add_tune(self, name, tune):
+        """Add the melody of the parsed TUNE under NAME"""
+        voice = melody(tune)
+        if voice is not None:
+            self.add(name, *melody_line(voice,
+                                        "minor" in (tune.key or "").lower()))
+
+    def build(self):
+        if self._built is None:
+            if self._incipits:
+                incipits = np.vstack(self._incipits)
+            else:
+                incipits = np.zeros((0, INCIPIT), dtype=np.int32)
+            self._built = (_Postings(self._pitch), _Postings(self._joint),
+                           incipits)
+        return self._built
+
+    def scores(self, degrees, durations):
+        """Return the similarity, from 0 to 1, of the melody with the
+scale DEGREES and DURATIONS to every melody in the index, and whether
+each begins the same way, as two arrays in the order of names"""
+        pitch, joint, incipits = self.build()
+        steps, ratios = melody_arrays(degrees, durations)
+        pitch_codes, joint_codes = melody_codes(steps, ratios, self.n)
+        scores = ((1 - self.rhythm_weight) * pitch.similarity(pitch_codes) +
+                  self.rhythm_weight * joint.similarity(joint_codes))
+        same_start = (incipits == incipit(steps)).all(axis=1)
+        return scores, same_start
+
+    def similar(self, degrees, durations, limit=10, threshold=0.0,
+                exclude=None):
+        """Return up to LIMIT (name, similarity, same incipit) triples for
+the melodies most like the one with the scale DEGREES and DURATIONS,
+most similar first, leaving out any below THRESHOLD or named EXCLUDE"""
+        scores, same_start = self.scores(degrees, durations)
+        order = np.argsort(-scores, kind="stable")
+        found = []
+        for i in order:
+            if scores[i] <= 0 or scores[i] < threshold or len(found) == limit:
+                break
+            if self.names[i] != exclude:
+                found.append((self.names[i], float(scores[i]),
+                              bool(same_start[i])))
+        return found
+
+    def similar_tune(self, tune, limit=10, threshold=0.0, exclude=None):
+        """Return the melodies most like that of the parsed TUNE, as
+similar() does"""
+        voice = melody(tune)
+        if voice is None:
+            return []
+        degrees, durations = melody_line(voice,
+                                         "minor" in (tune.key or "").lower())
+        return self.similar(degrees, durations, limit, threshold, exclude)
+
+    def duplicates(self, threshold=0.8):
+        """Return a (name, name, similarity) triple for every pair of
+melodies at least THRESHOLD alike, most similar first"""
+        pitch, joint, incipits = self.build()
+        pairs = []
+        for i in range(len(self.names)):
+            scores = ((1 - self.rhythm_weight) *
+                      pitch.similarity(self._pitch[i]) +
+                      self.rhythm_weight * joint.similarity(self._joint[i]))
+            scores[:i + 1] = 0 # each pair once, and not with itself
+            for j in np.flatnonzero(scores >= threshold):
+                pairs.append((self.names[i], self.names[j],
+                              float(scores[j])))
+        pairs.sort(key=lambda pair: -pair[2])
+        return pairs
+
+def library_melodies(directory, n=NGRAM):
+    """Return a MelodyIndex of the tunes in DIRECTORY, named by file,
+from its tune index"""
+    melodies = MelodyIndex(n)
+    for fn, entry in sorted(library_index(directory).entries.items()):
+        if entry.get("degrees"):
+            melodies.add(fn, entry["degrees"], entry["durations"])
+    return melodies
@@ -0,0 +1,32 @@
+"""Identify the code of this package, so that what is derived from a
+tune can be thrown away when the code that derived it changes"""
+
+import hashlib
+import os
+
+from doremi.grammar import DOREMI_GRAMMAR, LYRIC_GRAMMAR, grammar_path
+
+# the digest of the package's sources, once worked out
+_source_digest = None
+
+def source_digest():
+    """Return the SHA-256 digest of every module of the package and both
+grammars, which changes whenever the code that parses or renders a tune
+does, whether or not the version is raised"""
+    global _source_digest
+    if _source_digest is None:
+        package = os.path.dirname(os.path.abspath(__file__))
+        files = [os.path.join(package, name)
+                 for name in sorted(os.listdir(package))
+                 if name.endswith(".py")]
+        files.extend(grammar_path(name)
+                     for name in (DOREMI_GRAMMAR, LYRIC_GRAMMAR))
+        h = hashlib.sha256()
+        for fn in files:
+            with open(fn, "rb") as f:
+                data = f.read()
+            h.update(("%s:%d:" % (os.path.basename(fn),
+                                  len(data))).encode("utf-8"))
+            h.update(data)
+        _source_digest = h.hexdigest()
+    return _source_digest
@@ -0,0 +1,199 @@
+"""Parse Doremi tunes incrementally, as a stream of events
+
+iterparse() reads a tune from a file a piece at a time and yields each
+part of it as soon as it is complete, keeping only a small window of
+the source in memory, so that validators, indexers and other
+single-pass consumers need never hold a whole tune.  Each event is a
+pair (kind, value):
+
+    ("title", text), ("scripture", text), ("composer", text),
+    ("key", text), ("time", text), ("partial", number)
+        a tune-level field
+    ("start voice", voice)
+        a voice begins; its name and octave are set if they come
+        before its content, as they usually do
+    ("note", note), ("repeat", marker)
+        a Note or RepeatMarker in the current voice
+    ("end voice", voice)
+        the voice is complete, with its name and octave set
+
+The Voice objects never hold any notes; tune_from_events() will
+assemble a Tune from the events if one is wanted after all.
+
+"""
+
+import codecs
+
+from doremi.doremi_parser import Note, Tune, Voice
+from doremi.fast_parser import DoremiSyntaxError, FastDoremiParser
+
+# how much of the source to read at a time
+CHUNK_SIZE = 64 * 1024
+
+# how many characters are kept ahead of the parser where possible;
+# the longest keyword is far shorter, and durations far shorter still
+LOOKAHEAD = 256
+
+class StreamingDoremiParser(FastDoremiParser):
+    """A FastDoremiParser that reads its source from a file object a
+chunk at a time and yields events instead of building a Tune"""
+    def __init__(self, chunk_size=CHUNK_SIZE):
+        FastDoremiParser.__init__(self)
+        self.chunk_size = chunk_size
+        self.stream = None
+
+    def iterparse(self, stream):
+        """Yield the events of the tune read from the file object
+STREAM"""
+        self.stream = stream
+        self.text = ""
+        self.pos = 0
+        self.eof = False
+
+        # where the text in the buffer begins in the whole source
+        self.offset = 0
+        self.start_line = 1
+        self.start_column = 1
+
+        self.reset()
+        del self.events[:]
+        try:
+            self.more()
+            for event in self.read_tune():
+                yield event
+            for event in self.flush():
+                yield event
+        finally:
+            self.stream = None
+
+    # the source window
+    def more(self, needed=LOOKAHEAD):
+        """Read until at least NEEDED characters lie ahead, or the source
+is exhausted"""
+        while not self.eof and len(self.text) - self.pos < needed:
+            data = self.stream.read(self.chunk_size)
+            if data:
+                self.text += data
+            else:
+                self.eof = True
+
+    def release(self):
+        """Forget the source already parsed"""
+        done = self.text[:self.pos]
+        newlines = done.count("\n")
+        if newlines:
+            self.start_line += newlines
+            self.start_column = len(done) - done.rfind("\n")
+        else:
+            self.start_column += len(done)
+        self.offset += self.pos
+        self.text = self.text[self.pos:]
+        self.pos = 0
+
+    def flush(self):
+        # events are flushed only where no reader is holding a position
+        # in the buffer, so this is where it can be cut back
+        events = FastDoremiParser.flush(self)
+        if self.pos > self.chunk_size:
+            self.release()
+        return events
+
+    # scanning primitives that read more of the source as they need it
+    def error(self, expected):
+        raise DoremiSyntaxError(expected, self.text, self.pos, self.offset,
+                                self.start_line, self.start_column)
+
+    def ws(self):
+        while True:
+            FastDoremiParser.ws(self)
+            if self.eof or self.pos < len(self.text):
+                break
+            self.more(1)
+        self.more()
+
+    def literal(self, lit):
+        self.more(len(lit))
+        FastDoremiParser.literal(self, lit)
+
+    def regex(self, pattern, expected):
+        # a match that runs to the end of the window may go on beyond it
+        while not self.eof:
+            m = pattern.match(self.text, self.pos)
+            if m is None or m.end() < len(self.text):
+                break
+            self.more(len(self.text) - self.pos + self.chunk_size)
+        return FastDoremiParser.regex(self, pattern, expected)
+
+    # the builder hands everything on as events rather than keeping it
+    def reset(self):
+        FastDoremiParser.reset(self)
+        self.voice_started = False
+
+    def set_title(self, text):
+        FastDoremiParser.set_title(self, text)
+        self.events.append(("title", text))
+    def set_scripture(self, text):
+        FastDoremiParser.set_scripture(self, text)
+        self.events.append(("scripture", text))
+    def set_composer(self, text):
+        FastDoremiParser.set_composer(self, text)
+        self.events.append(("composer", text))
+    def set_key(self, text):
+        FastDoremiParser.set_key(self, text)
+        self.events.append(("key", text))
+    def set_partial(self, text):
+        FastDoremiParser.set_partial(self, text)
+        self.events.append(("partial", self.tune.partial))
+
+    def add_time(self, time):
+        FastDoremiParser.add_time(self, time)
+        if not self.in_content:
+            self.events.append(("time", time))
+
+    def start_voice(self):
+        if not self.voice_started:
+            self.events.append(("start voice", self.voice))
+            self.voice_started = True
+
+    def emit(self, item):
+        self.start_voice()
+        if isinstance(item, Note):
+            self.events.append(("note", item))
+        else:
+            self.events.append(("repeat", item))
+
+    def end_voice(self):
+        self.start_voice()
+        self.events.append(("end voice", self.voice))
+        self.voice = Voice()
+        self.last = None
+        self.voice_started = False
+
+def iterparse(source, chunk_size=CHUNK_SIZE):
+    """Yield the events of the Doremi tune in SOURCE, a file object or
+the name of a file"""
+    parser = StreamingDoremiParser(chunk_size)
+    if hasattr(source, "read"):
+        for event in parser.iterparse(source):
+            yield event
+    else:
+        with codecs.open(source, "r", "utf-8") as f:
+            for event in parser.iterparse(f):
+                yield event
+
+def tune_from_events(events):
+    """Assemble the Tune described by EVENTS"""
+    tune = Tune()
+    voice = None
+    for kind, value in events:
+        if kind == "start voice":
+            voice = Voice()
+        elif kind in ("note", "repeat"):
+            voice.append(value)
+        elif kind == "end voice":
+            voice.name = value.name
+            voice.octave = value.octave
+            tune.append(voice)
+        else:
+            setattr(tune, kind, value)
+    return tune
@@ -0,0 +1,182 @@
+"""Find, load, validate and cache the Lilypond output templates
+
+A template named NAME is a pair of files: NAME.tmpl for the whole
+tune and NAME-voice.tmpl for each voice in it.  Both are filled in
+with Python's %-formatting, using %(field)s placeholders.
+
+"""
+
+import codecs
+import os
+import re
+
+from doremi.grammar import ROOT
+
+TEMPLATE_DIR = os.path.join(ROOT, "templates")
+
+PLACEHOLDER = re.compile(r"%\((\w+)\)s")
+VOICE_REFERENCE = re.compile(r"\\exportedvoice_([A-Za-z0-9\-#]+)_music")
+
+# the fields Voice.to_lilypond supplies to a voice template
+VOICE_FIELDS = frozenset(["name", "key", "time", "shapes", "notes"])
+
+# the fields Tune.to_lilypond supplies to a tune template, besides a
+# VOICE_lyrics field for each voice
+TUNE_FIELDS = frozenset(["voices", "author", "lyrictitle", "meter", "title",
+                         "scripture", "composer", "partial"])
+
+class TemplateError(Exception):
+    """Raised when a template is missing, malformed, or does not fit
+the tune being rendered"""
+    pass
+
+class _AnyFields(dict):
+    # stands in for real data when test-filling a template
+    def __missing__(self, key):
+        return ""
+
+class Template(object):
+    """A loaded template file and the placeholders it uses"""
+    def __init__(self, path, text, mtime=None):
+        self.path = path
+        self.text = text
+        self.mtime = mtime
+        self.fields = frozenset(PLACEHOLDER.findall(text))
+
+        # the text split into alternate literal text and field names,
+        # for writing the template out piece by piece
+        self.segments = [piece if i % 2 else piece.replace("%%", "%")
+                         for i, piece in enumerate(PLACEHOLDER.split(text))]
+
+        # the voices whose music the template places on the page
+        self.voices = frozenset(VOICE_REFERENCE.findall(text))
+
+        # any stray % would only otherwise be found mid-render
+        try:
+            text % _AnyFields()
+        except (ValueError, TypeError) as e:
+            raise TemplateError("Template '%s' is malformed: %s." %
+                                (path, e))
+
+    def lyric_voices(self):
+        """Return the names of the voices the template has lyrics for"""
+        return frozenset(field[:-len("_lyrics")] for field in self.fields
+                         if field.endswith("_lyrics"))
+
+    def fill(self, data):
+        """Return the template filled in with DATA"""
+        return self.text % data
+
+    def write(self, fp, data):
+        """Write the template filled in with DATA to the file-like
+object FP; a value in DATA may be a function, which is called with FP
+to write its field's text"""
+        for i, piece in enumerate(self.segments):
+            if i % 2:
+                value = data[piece]
+                if callable(value):
+                    value(fp)
+                else:
+                    fp.write(value)
+            elif piece:
+                fp.write(piece)
+
+class TemplateRegistry(object):
+    """Finds templates on a search path (the directories in PATHS, then
+those in $DOREMI_TEMPLATE_PATH, then the templates shipped with
+doremi) and keeps each loaded until its file changes"""
+    def __init__(self, paths=None):
+        self.paths = list(paths or [])
+        env = os.environ.get("DOREMI_TEMPLATE_PATH")
+        if env:
+            self.paths.extend(p for p in env.split(os.pathsep) if p)
+        self.paths.append(TEMPLATE_DIR)
+        self._templates = {}
+
+    def add_path(self, path):
+        """Search PATH before every directory already on the path"""
+        self.paths.insert(0, path)
+
+    def find(self, filename):
+        """Return the full path of the first template file FILENAME on
+the search path"""
+        for path in self.paths:
+            fn = os.path.join(path, filename)
+            if os.path.isfile(fn):
+                return fn
+        raise TemplateError("No template file '%s' in %s." %
+                            (filename, os.pathsep.join(self.paths)))
+
+    def load(self, filename):
+        """Return the Template in FILENAME, reading it again only if it
+has changed since it was last read"""
+        fn = self.find(filename)
+        mtime = os.stat(fn).st_mtime
+        template = self._templates.get(fn)
+        if template is None or template.mtime != mtime:
+            with codecs.open(fn, "r", "utf-8") as f:
+                template = Template(fn, f.read(), mtime)
+            self._templates[fn] = template
+        return template
+
+    def tune_template(self, name):
+        return self.load("%s.tmpl" % name)
+
+    def voice_template(self, name):
+        template = self.load("%s-voice.tmpl" % name)
+        unknown = template.fields - VOICE_FIELDS
+        if unknown:
+            raise TemplateError("Voice template '%s' uses unknown fields: %s."
+                                % (template.path, ", ".join(sorted(unknown))))
+        return template
+
+    def files(self, name):
+        """Return the paths of the two files making up template NAME"""
+        return [self.find("%s.tmpl" % name),
+                self.find("%s-voice.tmpl" % name)]
+
+    def check(self, name, tune, lyric=None):
+        """Return a list of the problems with rendering TUNE and LYRIC
+with the template NAME; an empty list means there are none"""
+        problems = []
+        tmpl = self.tune_template(name)
+        self.voice_template(name)
+
+        names = set(voice.name for voice in tune)
+        missing = voices_missing(tmpl, names)
+        if missing:
+            problems.append("Template '%s' needs voices the tune lacks: %s." %
+                            (name, ", ".join(missing)))
+
+        unplaced = names - tmpl.voices
+        if unplaced:
+            problems.append("Template '%s' has no place for voices: %s." %
+                            (name, ", ".join(sorted(unplaced))))
+
+        if lyric is not None:
+            unsung = (set(v.name for v in lyric.voices) -
+                      tmpl.lyric_voices())
+            if unsung:
+                problems.append(
+                    "Template '%s' has no lyrics for voices: %s." %
+                    (name, ", ".join(sorted(unsung))))
+        return problems
+
+def voices_missing(template, names):
+    """Return the sorted voices TEMPLATE has lyrics for that are not in
+NAMES"""
+    return sorted(template.lyric_voices() - set(names))
+
+# registries already made, keyed by their extra search paths
+_registries = {}
+
+def default_registry(paths=None):
+    """Return the registry shared by everything in this process that
+searches the extra directories PATHS"""
+    paths = tuple(paths or ())
+    try:
+        return _registries[paths]
+    except KeyError:
+        registry = TemplateRegistry(paths)
+        _registries[paths] = registry
+        return registry
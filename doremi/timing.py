@@ -0,0 +1,129 @@
+"""Optional timers and counters for the stages of the conversion
+pipeline
+
+The pipeline reports its work through stage() and count(); until
+enable() is called they do nothing, so instrumented code costs no more
+than a function call when nobody is measuring.  For example,
+
+    timing.enable()
+    with timing.stage("parse"):
+        tune = parser.parse(text)
+    timing.count("tunes parsed")
+    print(timing.report())
+
+"""
+
+import threading
+import time
+
+class Timings(object):
+    """Accumulated seconds and call counts for each named stage, and
+totals for each named counter"""
+    def __init__(self):
+        self.seconds = {}
+        self.calls = {}
+        self.counts = {}
+
+        # LilyPond runs are timed from several threads at once
+        self._lock = threading.Lock()
+
+    def stage(self, name):
+        return _Stage(self, name)
+
+    def add_time(self, name, seconds, calls=1):
+        with self._lock:
+            self.seconds[name] = self.seconds.get(name, 0.0) + seconds
+            self.calls[name] = self.calls.get(name, 0) + calls
+
+    def count(self, name, n=1):
+        with self._lock:
+            self.counts[name] = self.counts.get(name, 0) + n
+
+    def report(self):
+        """Return the timings as a dictionary fit for JSON"""
+        return {"stages": dict((name, {"seconds": self.seconds[name],
+                                       "calls": self.calls[name]})
+                               for name in self.seconds),
+                "counts": dict(self.counts)}
+
+    def merge(self, report):
+        """Add in the timings REPORT, as returned by report()"""
+        for name, stage in report["stages"].items():
+            self.add_time(name, stage["seconds"], stage["calls"])
+        for name, n in report["counts"].items():
+            self.count(name, n)
+
+class _Stage(object):
+    # times one pass through a stage, as a context manager
+    __slots__ = ["timings", "name", "start"]
+
+    def __init__(self, timings, name):
+        self.timings = timings
+        self.name = name
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        self.timings.add_time(self.name, time.perf_counter() - self.start)
+        return False
+
+class _NullStage(object):
+    # stands in for _Stage while timing is disabled
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+_NULL_STAGE = _NullStage()
+
+# the Timings being collected in this process, if any
+_active = None
+
+def enable():
+    """Start collecting timings in this process, if not already"""
+    global _active
+    if _active is None:
+        _active = Timings()
+
+def disable():
+    global _active
+    _active = None
+
+def enabled():
+    return _active is not None
+
+def stage(name):
+    """Return a context manager that adds the time spent in it to the
+stage NAME"""
+    if _active is None:
+        return _NULL_STAGE
+    return _active.stage(name)
+
+def count(name, n=1):
+    """Add N to the counter NAME"""
+    if _active is not None:
+        _active.count(name, n)
+
+def report():
+    """Return the timings collected so far, or None if disabled"""
+    if _active is None:
+        return None
+    return _active.report()
+
+def collect():
+    """Return the timings collected so far and start afresh, for
+passing a worker process's timings back to its parent"""
+    global _active
+    if _active is None:
+        return None
+    result = _active.report()
+    _active = Timings()
+    return result
+
+def merge(report):
+    """Add the timings REPORT from elsewhere into this process's"""
+    if _active is not None and report:
+        _active.merge(report)
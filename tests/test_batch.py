@@ -0,0 +1,38 @@
+"""Tests of doremi.batch"""
+
+import os
+import shutil
+import tempfile
+import unittest
+
+from doremi.batch import BatchError, jobs_from_manifest
+
+class ManifestTest(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.manifest = os.path.join(self.directory, "tunes.json")
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def jobs(self, text):
+        with open(self.manifest, "w") as f:
+            f.write(text)
+        return jobs_from_manifest(self.manifest, self.directory)
+
+    def test_jobs(self):
+        jobs = self.jobs('[{"tune": "a.drm", "key": "G major"}]')
+        self.assertEqual(jobs[0].infile, os.path.join(self.directory,
+                                                      "a.drm"))
+        self.assertEqual(jobs[0].key, "G major")
+
+    def test_malformed(self):
+        with self.assertRaisesRegex(BatchError, "tunes.json' is not valid"):
+            self.jobs('[{"tune": ')
+
+    def test_no_tune(self):
+        with self.assertRaisesRegex(BatchError, "Entry 2 of manifest"):
+            self.jobs('[{"tune": "a.drm"}, {}]')
+
+if __name__ == "__main__":
+    unittest.main()
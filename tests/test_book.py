@@ -0,0 +1,68 @@
+"""Tests of doremi.book"""
+
+import os
+import unittest
+
+from doremi.book import BookPart, book_text, top_level_items
+from doremi.render import RenderJob, render_lilypond
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+def tune_path(name):
+    return os.path.join(ROOT, "tunes", name + ".drm")
+
+def book_part(name, template, prefix="tunea"):
+    job = RenderJob(tune_path(name), name + ".ly", template=template,
+                    engine="fast")
+    return BookPart(render_lilypond(job), prefix)
+
+class TopLevelItemsTest(unittest.TestCase):
+    def test_unbraced_items(self):
+        text = ('\\version "2.18.2"\n'
+                "#(set-default-paper-size \"letter\" 'landscape) % (a)\n"
+                "staffSize = #(* 2 10)\n"
+                "title = \"One { Two\"\n"
+                "\\score { \\new Staff { c } }\n")
+        self.assertEqual(top_level_items(text),
+                         ['\\version "2.18.2"',
+                          "#(set-default-paper-size \"letter\" 'landscape)",
+                          "% (a)\nstaffSize = #(* 2 10)",
+                          'title = "One { Two"',
+                          "\\score { \\new Staff { c } }"])
+
+class BookPartTest(unittest.TestCase):
+    def assertSplit(self, part):
+        self.assertTrue(part.variables)
+        for variable in part.variables:
+            self.assertFalse(variable.startswith("\\"), variable)
+        for block in part.blocks:
+            self.assertTrue(block.startswith("\\"), block)
+            self.assertNotIn("#(", block.split("{", 1)[0])
+        music = [variable for variable in part.variables
+                 if variable.startswith("tunea_exportedvoice_")]
+        self.assertTrue(music)
+
+    def test_default_template(self):
+        part = book_part("old-hundred", "default")
+        self.assertSplit(part)
+        self.assertEqual([block.split()[0] for block in part.blocks],
+                         ["\\paper", "\\header", "\\score"])
+
+    def test_sacred_harp_template(self):
+        part = book_part("old-freedom", "sacred-harp")
+        self.assertSplit(part)
+        self.assertIn("#(set-default-paper-size \"letter\" 'landscape)",
+                      part.variables)
+        self.assertEqual([block.split()[0] for block in part.blocks],
+                         ["\\header", "\\score"])
+
+    def test_book_sets_paper_size_once(self):
+        text = book_text([book_part("old-freedom", "sacred-harp"),
+                          book_part("old-freedom", "sacred-harp",
+                                    "tuneb")])
+        self.assertEqual(text.count("set-default-paper-size"), 1)
+        self.assertLess(text.index("tuneb_exportedvoice_"),
+                        text.index("\\book {"))
+
+if __name__ == "__main__":
+    unittest.main()
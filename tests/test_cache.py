@@ -0,0 +1,37 @@
+"""Tests of doremi.cache"""
+
+import os
+import shutil
+import tempfile
+import unittest
+
+from doremi.cache import RenderCache
+from doremi.render import RenderJob
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+def tune_path(name):
+    return os.path.join(ROOT, "tunes", name + ".drm")
+
+class RenderCacheKeyTest(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.cache = RenderCache(self.directory)
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def test_options_change_key(self):
+        job = RenderJob(tune_path("old-hundred"), "old-hundred.ly")
+        other = RenderJob(tune_path("old-hundred"), "old-hundred.ly",
+                          key="G major")
+        self.assertNotEqual(self.cache.key(job), self.cache.key(other))
+
+    def test_missing_lyric(self):
+        # no key, so the job is rendered and the missing file reported
+        job = RenderJob(tune_path("old-hundred"), "old-hundred.ly",
+                        lyricfile=os.path.join(self.directory, "none.drmw"))
+        self.assertIsNone(self.cache.key(job))
+
+if __name__ == "__main__":
+    unittest.main()
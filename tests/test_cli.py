@@ -0,0 +1,46 @@
+"""Tests of doremi.cli"""
+
+import os
+import shutil
+import sys
+import tempfile
+import unittest
+from io import StringIO
+
+from doremi.cli import main
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+def tune_path(name):
+    return os.path.join(ROOT, "tunes", name + ".drm")
+
+class LilypondFailureTest(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.stderr = sys.stderr
+        sys.stderr = StringIO()
+
+    def tearDown(self):
+        sys.stderr = self.stderr
+        shutil.rmtree(self.directory)
+
+    def run_main(self, *argv):
+        status = main(list(argv) + ["--no-cache",
+                                    "--lilypond", "/nonexistent/lilypond"])
+        return status, sys.stderr.getvalue()
+
+    def test_pdf(self):
+        outfile = os.path.join(self.directory, "old-hundred.pdf")
+        status, err = self.run_main(tune_path("old-hundred"), outfile)
+        self.assertEqual(status, 1)
+        self.assertTrue(err.startswith("FAILED %s: Unable to run" % outfile))
+
+    def test_book(self):
+        status, err = self.run_main(
+            "-b", os.path.join(ROOT, "tunes"),
+            "--book", os.path.join(self.directory, "book.txt"))
+        self.assertEqual(status, 1)
+        self.assertIn("A book must be a .ly or .pdf file", err)
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,26 @@
+"""Tests of doremi.doremi_parser"""
+
+import unittest
+
+from doremi.doremi_parser import FERMATA, TIE, Note
+
+class NoteModifiersTest(unittest.TestCase):
+    def test_assign(self):
+        note = Note("do", "4", 0, ["fermata", "'", "tie"])
+        self.assertEqual(note.flags, TIE | FERMATA)
+        self.assertEqual(note.modifiers, ("'", "tie", "fermata"))
+
+    def test_immutable(self):
+        # the modifiers are computed, so altering them in place would
+        # be lost; it fails instead
+        note = Note("do", "4", 0, ["fermata"])
+        with self.assertRaises(AttributeError):
+            note.modifiers.append("tie")
+
+    def test_reassign(self):
+        note = Note("do", "4", 0, ["fermata"])
+        note.modifiers += ("tie",)
+        self.assertEqual(note.flags, TIE | FERMATA)
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,67 @@
+"""Tests that the parser engines agree"""
+
+import glob
+import os
+import random
+import unittest
+
+from doremi import ENGINES
+from doremi.doremi_parser import Note, make_parser, read_text
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+SYLLABLES = ["do", "re", "mi", "fa", "sol", "la", "ti", "r"]
+MODIFIERS = ["slur", "tie", "fermata", "-", "+", "|:", ":|", "time: 3/4"]
+DURATIONS = ["1", "2", "2.", "4", "4.", "8", "16"]
+
+def synthetic_tune(notes, seed):
+    """Return the text of a generated two-voice tune of NOTES notes a
+voice"""
+    rnd = random.Random(seed)
+    voices = []
+    for name in ("soprano", "bass"):
+        content = []
+        for n in range(notes):
+            if n % 8 == 0:
+                content.append(rnd.choice(DURATIONS))
+            if rnd.random() < 0.2:
+                content.append(rnd.choice(MODIFIERS))
+            content.append(rnd.choice(SYLLABLES))
+        voices.append("{name: %s\noctave: %d\ncontent: [%s]}" %
+                      (name, rnd.randint(-1, 0), " ".join(content)))
+    return ('title: "Synthetic %d"\nkey: G major\ntime: 4/4\npartial: 4\n'
+            "voices: [%s]" % (seed, "\n".join(voices)))
+
+def tune_signature(tune):
+    """Return everything the parser records about TUNE"""
+    sig = [(tune.title, tune.scripture, tune.composer, tune.key,
+            tune.time, tune.partial)]
+    for voice in tune:
+        sig.append((voice.name, voice.octave,
+                    [(n.pitch, n.duration, n.octave, n.modifiers)
+                     if isinstance(n, Note) else n.text
+                     for n in voice]))
+    return sig
+
+class EnginesAgreeTest(unittest.TestCase):
+    def setUp(self):
+        self.parsers = dict((engine, make_parser(engine))
+                            for engine in ENGINES)
+
+    def assertAgree(self, name, text):
+        expected = tune_signature(self.parsers["parsimonious"].parse(text))
+        for engine, parser in self.parsers.items():
+            self.assertEqual(tune_signature(parser.parse(text)), expected,
+                             "%s parses %s differently" % (engine, name))
+
+    def test_sample_tunes(self):
+        for fn in sorted(glob.glob(os.path.join(ROOT, "tunes", "*.drm"))):
+            self.assertAgree(os.path.basename(fn), read_text(fn))
+
+    def test_synthetic_tunes(self):
+        for seed in range(5):
+            self.assertAgree("synthetic tune %d" % seed,
+                             synthetic_tune(200, seed))
+
+if __name__ == "__main__":
+    unittest.main()
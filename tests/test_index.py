@@ -0,0 +1,44 @@
+"""Tests of doremi.index"""
+
+import os
+import shutil
+import tempfile
+import unittest
+
+from doremi.doremi_parser import make_parser
+from doremi.index import TuneIndex, tune_meter
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+def tune_path(name):
+    return os.path.join(ROOT, "tunes", name + ".drm")
+
+class TuneMeterTest(unittest.TestCase):
+    def setUp(self):
+        self.parser = make_parser("fast")
+
+    def meter(self, name):
+        return tune_meter(self.parser.parse_file(tune_path(name)))
+
+    def test_fermatas(self):
+        self.assertEqual(self.meter("old-hundred"), "8.8.8.8")
+
+    def test_unmarked_short_meter(self):
+        # no fermata or rest marks Idumea's lines, which are each three
+        # or four measures of 3/2 long
+        self.assertEqual(self.meter("idumea"), "6.6.8.6")
+
+    def test_find_by_meter_name(self):
+        directory = tempfile.mkdtemp()
+        try:
+            index = TuneIndex(os.path.join(directory, "index.json"))
+            index.update([tune_path("idumea"), tune_path("old-hundred")],
+                         self.parser)
+            found = [os.path.basename(fn)
+                     for fn, entry in index.find_meter("S.M.")]
+            self.assertEqual(found, ["idumea.drm"])
+        finally:
+            shutil.rmtree(directory)
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,28 @@
+"""Tests of doremi.lilypond"""
+
+import unittest
+
+from doremi.lilypond import (UnknownKeyError, key_context,
+                             key_octave_offset, keys)
+
+class KeyTableTest(unittest.TestCase):
+    def test_tables_agree(self):
+        self.assertEqual(sorted(keys), sorted(key_octave_offset))
+        for key in keys:
+            key_context(key)
+
+    def test_relative_minor(self):
+        self.assertIs(keys["g minor"], keys["bes major"])
+        self.assertIs(keys["aes minor"], keys["ces major"])
+        self.assertEqual(key_octave_offset["g minor"], 3)
+
+    def test_spelling(self):
+        self.assertEqual(keys["des major"]["ra"], "eses")
+        self.assertEqual(keys["es major"]["la"], "c")
+        self.assertEqual(keys["b major"]["ti"], "ais")
+
+    def test_unknown_key(self):
+        self.assertRaises(UnknownKeyError, key_context, "h major")
+
+if __name__ == "__main__":
+    unittest.main()
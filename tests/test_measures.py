@@ -0,0 +1,75 @@
+"""Tests of doremi.measures"""
+
+import os
+import unittest
+from fractions import Fraction
+
+from doremi.doremi_parser import Note, make_parser
+from doremi.measures import MeasureIndex, excerpt
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+VOLTAS = '''title: "Voltas"
+key: C major
+time: 4/4
+voices: [{name: soprano
+          octave: 0
+          content: [4 do re mi fa |: sol la ti do ! re mi fa sol
+                    1! la ti do re 2! mi fa sol la |.]}]'''
+
+PICKUP_CHANGE = '''title: "Pickup"
+key: C major
+time: 4/4
+partial: 4
+voices: [{name: soprano
+          octave: 0
+          content: [4 time: 3/4 sol do do do re re re mi2.]}]'''
+
+def markers(voice):
+    return [item.text for item in voice if not isinstance(item, Note)]
+
+def balanced(voice, time, key):
+    ly = voice.to_lilypond(time, key)
+    return ly.count("{") == ly.count("}")
+
+class ExcerptRepeatTest(unittest.TestCase):
+    def setUp(self):
+        parser = make_parser("fast")
+        self.imandra = parser.parse_file(os.path.join(ROOT, "tunes",
+                                                      "imandra.drm"))
+        del self.imandra[1:] # the soprano alone
+        self.voltas = parser.parse(VOLTAS)
+
+    def test_repeat_cut_at_start(self):
+        passage = excerpt(self.imandra, 3, 4)
+        self.assertEqual(markers(passage[0]), ["|:", ":|"])
+        self.assertTrue(balanced(passage[0], passage.time, "a minor"))
+
+    def test_repeat_cut_at_end(self):
+        passage = excerpt(self.imandra, 0, 1)
+        self.assertEqual(markers(passage[0]), ["|:", ":|"])
+        self.assertTrue(balanced(passage[0], passage.time, "a minor"))
+
+    def test_whole_repeat_kept(self):
+        passage = excerpt(self.voltas, 2, 4)
+        self.assertEqual(markers(passage[0]), ["|:", "!", "1!", "2!"])
+
+    def test_endings_cut_off(self):
+        for first, last in [(1, 2), (2, 3), (3, 3), (3, 4), (4, 5)]:
+            passage = excerpt(self.voltas, first, last)
+            self.assertNotIn("|:", markers(passage[0]))
+            self.assertTrue(balanced(passage[0], passage.time, "c major"))
+
+class MeasureIndexTest(unittest.TestCase):
+    def test_time_change_in_pickup(self):
+        # the change leaves the pickup a quarter note long
+        tune = make_parser("fast").parse(PICKUP_CHANGE)
+        index = MeasureIndex(tune[0], tune.time, tune.partial)
+        self.assertEqual(len(index), 4)
+        self.assertEqual([index.fraction(n) for n in index.lengths],
+                         [Fraction(1, 4)] + [Fraction(3, 4)] * 3)
+        self.assertEqual(index.times, ["3/4"] * 4)
+        self.assertFalse(index.crossings)
+
+if __name__ == "__main__":
+    unittest.main()
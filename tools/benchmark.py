@@ -0,0 +1,975 @@
+#!/usr/bin/env python
+"""Benchmarks for the Doremi conversion pipeline
+
+Run a benchmark by name, e.g.
+
+    python tools/benchmark.py grammar
+
+With no name, every benchmark is run in turn.  The stages benchmark
+can save its timings as a baseline and fail when a later run falls
+behind it:
+
+    python tools/benchmark.py stages --save-baseline base.json
+    python tools/benchmark.py stages --baseline base.json --threshold 0.25
+"""
+
+from __future__ import print_function
+
+import argparse
+import copy
+import glob
+import json
+import os
+import random
+import shutil
+import sys
+import time
+import tracemalloc
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from parsimonious import Grammar
+
+from doremi import ENGINES
+from doremi.doremi_parser import (DoremiParser, Note, Voice,
+                                  make_parser, read_text, variant_matrix)
+from doremi.grammar import grammar_path, DOREMI_GRAMMAR, LYRIC_GRAMMAR
+from doremi.lilypond import (key_context, key_octave_offset, pitch_level,
+                             syllable_to_note)
+from doremi.lyric_parser import LyricParser
+from doremi.render import RenderJob, render
+from doremi.runner import LilypondRunner
+from doremi.templates import default_registry, voices_missing
+
+def tune_files():
+    return sorted(glob.glob(os.path.join(ROOT, "tunes", "*.drm")))
+
+def lyric_files():
+    return sorted(glob.glob(os.path.join(ROOT, "hymns", "*.drmw")))
+
+SYLLABLES = ["do", "re", "mi", "fa", "sol", "la", "ti"]
+MODIFIERS = ["slur", "tie", "fermata", "-", "+"]
+DURATIONS = ["1", "2", "2.", "4", "4.", "8", "16"]
+VOICE_NAMES = ["soprano", "alto", "tenor", "bass"]
+
+def synthetic_tune(notes=1000, voices=4, modifier_density=0.1, seed=0):
+    """Return the text of a generated Doremi tune with NOTES notes in
+each of VOICES voices, a MODIFIER_DENSITY fraction of which carry a
+modifier"""
+    rnd = random.Random(seed)
+    parts = ['title: "Synthetic"', "key: C major", "time: 4/4",
+             "voices: ["]
+    for v in range(voices):
+        content = []
+        octave = 0
+        for n in range(notes):
+            if n % 8 == 0:
+                content.append(rnd.choice(DURATIONS))
+            if rnd.random() < modifier_density:
+                mod = rnd.choice(MODIFIERS)
+                # keep the voice within a few octaves of where it began
+                if mod == "-" and octave < -1 or mod == "+" and octave > 1:
+                    mod = "slur"
+                octave += {"-": -1, "+": 1}.get(mod, 0)
+                content.append(mod)
+            content.append(rnd.choice(SYLLABLES))
+            if n % 64 == 63:
+                content.append("\n")
+        name = VOICE_NAMES[v] if v < len(VOICE_NAMES) else "voice%d" % v
+        parts.append("{name: %s\noctave: 0\ncontent: [%s]}" %
+                     (name, " ".join(content)))
+    parts.append("]")
+    return "\n".join(parts)
+
+def note_count(tune):
+    return sum(1 for voice in tune for note in voice
+               if isinstance(note, Note))
+
+def tune_signature(tune):
+    """Return everything the parser records about TUNE, for comparing
+the output of two parsers"""
+    sig = [(tune.title, tune.scripture, tune.composer, tune.key,
+            tune.time, tune.partial)]
+    for voice in tune:
+        sig.append((voice.name, voice.octave,
+                    [(n.pitch, n.duration, n.octave, list(n.modifiers))
+                     if isinstance(n, Note) else n.text
+                     for n in voice]))
+    return sig
+
+def best_of(fn, repeat):
+    """Return the shortest of REPEAT timings of FN(), in seconds"""
+    best = None
+    for i in range(repeat):
+        start = time.perf_counter()
+        fn()
+        elapsed = time.perf_counter() - start
+        if best is None or elapsed < best:
+            best = elapsed
+    return best
+
+def report(name, seconds, count, unit="file"):
+    print("  %-34s %9.3f ms total %9.2f us/%s" % (name,
+                                                  seconds * 1000,
+                                                  seconds * 1e6 / count,
+                                                  unit))
+
+def bench_grammar(args):
+    """Per-file parse cost with a grammar compiled for every file (the
+old behaviour) and with the shared, once-compiled grammar"""
+    tunes = [read_text(fn) for fn in tune_files()]
+    lyrics = [read_text(fn) for fn in lyric_files()]
+
+    def per_file(grammar_name, parser_class, texts):
+        def run():
+            for text in texts:
+                parser = parser_class()
+                parser.grammar = Grammar(open(grammar_path(grammar_name),
+                                              "r").read())
+                parser.parse(text)
+        return run
+
+    def shared(parser_class, texts):
+        parser = parser_class()
+        def run():
+            for text in texts:
+                parser.parse(text)
+        return run
+
+    print("grammar: %d tunes, %d lyrics" % (len(tunes), len(lyrics)))
+    for label, grammar_name, parser_class, texts in [
+            ("tunes", DOREMI_GRAMMAR, DoremiParser, tunes),
+            ("lyrics", LYRIC_GRAMMAR, LyricParser, lyrics)]:
+        before = best_of(per_file(grammar_name, parser_class, texts),
+                         args.repeat)
+        after = best_of(shared(parser_class, texts), args.repeat)
+        report("%s, grammar per file" % label, before, len(texts))
+        report("%s, shared grammar" % label, after, len(texts))
+
+def bench_engines(args):
+    """Throughput of the parser engines in notes per second (that they
+agree is tested in tests/test_engines.py)"""
+    engines = dict((name, make_parser(name))
+                   for name in ("parsimonious", "fast"))
+
+    texts = [read_text(fn) for fn in tune_files()]
+    print("engines: %d sample tunes" % len(texts))
+
+    corpora = [("sample tunes", texts),
+               ("synthetic part-song", [synthetic_tune(args.notes)])]
+    for label, corpus in corpora:
+        notes = sum(note_count(engines["fast"].parse(text))
+                    for text in corpus)
+        for name, parser in sorted(engines.items()):
+            elapsed = best_of(lambda: [parser.parse(text)
+                                       for text in corpus],
+                              args.repeat)
+            print("  %-34s %9.3f ms total %9.0f notes/s" %
+                  ("%s, %s" % (label, name), elapsed * 1000,
+                   notes / elapsed))
+
+def synthetic_voice(notes=100000, seed=0):
+    """Return a Voice of NOTES random notes"""
+    rnd = random.Random(seed)
+    voice = Voice("synthetic", 0)
+    for n in range(notes):
+        modifiers = [rnd.choice(MODIFIERS)] if rnd.random() < 0.1 else []
+        voice.append(Note(rnd.choice(SYLLABLES),
+                          rnd.choice(DURATIONS),
+                          rnd.randint(-1, 1),
+                          modifiers))
+    return voice
+
+def legacy_note_to_lilypond(note, key, octave_offset=0):
+    """Note.to_lilypond as it was before key contexts, for comparison"""
+    if note.pitch == "r":
+        return "%s%s" % (note.pitch, note.duration)
+    pitch = syllable_to_note(note.pitch, key)
+    octave = note.octave + octave_offset + 1
+    offset = key_octave_offset[key.lower()]
+    local_pitch_level = copy.copy(pitch_level)
+    if "minor" in key.lower():
+        for k in local_pitch_level.keys():
+            local_pitch_level[k] = local_pitch_level[k] + 2
+            if local_pitch_level[k] > 6:
+                local_pitch_level[k] -= 7
+    if local_pitch_level[note.pitch] - offset < 0:
+        octave -= 1
+    elif local_pitch_level[note.pitch] - offset > 6:
+        octave += 1
+    if octave < 0:
+        octave = "," * abs(octave)
+    else:
+        octave = "'" * octave
+    slur = ""
+    if "slur" in note.modifiers:
+        slur = "[" if note.duration in ["8", "8.", "16"] else "("
+    elif "end slur" in note.modifiers:
+        slur = "]" if note.duration in ["8", "8.", "16"] else ")"
+    tie = "~" if "tie" in note.modifiers else ""
+    fermata = r"\fermata" if "fermata" in note.modifiers else ""
+    return "%s%s%s%s%s%s" % (pitch, octave, note.duration, tie, slur,
+                             fermata)
+
+def bench_keys(args):
+    """Note rendering per note, against rendering through a shared
+per-key context, over a synthetic 100k-note voice"""
+    voice = synthetic_voice(args.voice_notes)
+    print("keys: %d notes" % len(voice))
+    for key in ["c major", "a minor"]:
+        context = key_context(key)
+        legacy = [legacy_note_to_lilypond(note, key) for note in voice]
+        current = [note.to_lilypond(key, context=context) for note in voice]
+        if legacy != current:
+            raise SystemExit("key contexts change the output in %s" % key)
+
+        before = best_of(lambda: [legacy_note_to_lilypond(note, key)
+                                  for note in voice], args.repeat)
+        after = best_of(lambda: [note.to_lilypond(key, context=context)
+                                 for note in voice], args.repeat)
+        report("%s, per-note tables" % key, before, len(voice), "note")
+        report("%s, key context" % key, after, len(voice), "note")
+
+class LegacyNote(object):
+    """A note as stored before compact notes: a dict-backed object with
+its own list of modifier strings"""
+    def __init__(self, pitch, duration, octave, modifiers):
+        self.pitch = pitch
+        self.duration = duration
+        self.octave = octave
+        self.modifiers = modifiers
+
+def peak_memory(fn):
+    """Return the result of FN() and the peak memory allocated while it
+ran, in bytes"""
+    tracemalloc.start()
+    try:
+        result = fn()
+        current, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    return result, peak
+
+def bench_memory(args):
+    """Memory held by a generated corpus of notes in the old and compact
+note forms"""
+    rnd = random.Random(0)
+    count = args.corpus_notes
+    raw = []
+    for n in range(count):
+        r = rnd.random()
+        modifiers = ([rnd.choice(MODIFIERS)] if r < 0.1 else
+                     ["4/4"] if r < 0.101 else [])
+        raw.append((rnd.choice(SYLLABLES), rnd.choice(DURATIONS),
+                    rnd.randint(-1, 1), modifiers))
+
+    # a parser slices a new string out of the source for every token,
+    # so give the old form its own copies as well
+    def legacy():
+        return [LegacyNote("".join(pitch), "".join(duration), octave,
+                           list(modifiers))
+                for pitch, duration, octave, modifiers in raw]
+    def compact():
+        return [Note(sys.intern("".join(pitch)),
+                     sys.intern("".join(duration)),
+                     octave,
+                     modifiers)
+                for pitch, duration, octave, modifiers in raw]
+
+    print("memory: %d notes" % count)
+    for label, fn in [("dict notes, modifier lists", legacy),
+                      ("slotted notes, modifier flags", compact)]:
+        notes, peak = peak_memory(fn)
+        print("  %-34s %9.1f MB peak %9.1f bytes/note" %
+              (label, peak / 1e6, float(peak) / count))
+        del notes
+
+def legacy_tune_to_lilypond(tune, key, template="default"):
+    """Tune.to_lilypond as it was before streaming: every voice built as
+a list of note strings, joined, and substituted into the template"""
+    registry = default_registry()
+    context = key_context(key)
+    voices = []
+    for voice in tune:
+        notes = " ".join([note.to_lilypond(key, context=context)
+                          for note in voice])
+        voices.append(registry.voice_template(template).fill(
+            {"name": voice.name, "key": key.replace(" ", " \\"),
+             "time": tune.time, "shapes": "", "notes": notes}))
+    data = {"voices": "\n".join(voices), "author": "", "lyrictitle": "",
+            "meter": "", "title": tune.title, "scripture": "",
+            "composer": "", "partial": ""}
+    for voice in tune:
+        data["%s_lyrics" % voice.name] = ""
+    return registry.tune_template(template).fill(data)
+
+def bench_streaming(args):
+    """Peak memory of rendering a long tune to a string and writing it
+out, against streaming it straight to the file"""
+    tune = make_parser("fast").parse(synthetic_tune(args.stream_notes))
+    print("streaming: %d voices of %d notes" % (len(tune), args.stream_notes))
+
+    if legacy_tune_to_lilypond(tune, "c major") != tune.to_lilypond("c major"):
+        raise SystemExit("streaming changes the output")
+
+    def whole():
+        with open(os.devnull, "w") as f:
+            f.write(legacy_tune_to_lilypond(tune, "c major"))
+    def streamed():
+        with open(os.devnull, "w") as f:
+            tune.write_lilypond(f, "c major")
+
+    for label, fn in [("whole document, then write", whole),
+                      ("write_lilypond", streamed)]:
+        elapsed = best_of(fn, args.repeat)
+        result, peak = peak_memory(fn)
+        print("  %-34s %9.3f ms total %9.1f MB peak" %
+              (label, elapsed * 1000, peak / 1e6))
+
+STUB_LILYPOND = os.path.join(ROOT, "tools", "stub-lilypond")
+
+# timing differences smaller than this are noise, whatever their ratio
+NOISE_SECONDS = 0.001
+
+def tune_template(tune, registry):
+    """Return the shipped template that fits TUNE's voices"""
+    names = [voice.name for voice in tune]
+    if voices_missing(registry.tune_template("default"), names):
+        return "sacred-harp"
+    return "default"
+
+def measure_stages(args):
+    """Return the best time and the peak memory of each stage of the
+pipeline, over the shipped tunes and lyrics and a generated tune"""
+    import subprocess
+    import tempfile
+
+    registry = default_registry()
+    parsers = dict((engine, make_parser(engine)) for engine in ENGINES)
+    lyric_parser = LyricParser()
+    tune_texts = [read_text(fn) for fn in tune_files()]
+    lyric_texts = [read_text(fn) for fn in lyric_files()]
+    tunes = [parsers["fast"].parse(text) for text in tune_texts]
+    templates = [tune_template(tune, registry) for tune in tunes]
+    synthetic_text = synthetic_tune(args.notes, args.voices,
+                                    args.modifier_density, args.seed)
+    synthetic = parsers["fast"].parse(synthetic_text)
+    outdir = tempfile.mkdtemp(prefix="doremi-bench-")
+
+    def parse_all(parser, texts):
+        return lambda: [parser.parse(text) for text in texts]
+    def convert_all():
+        return [tune.to_lilypond(tune.key, template=template)
+                for tune, template in zip(tunes, templates)]
+    def render_jobs():
+        for i, (fn, template) in enumerate(zip(tune_files(), templates)):
+            render(RenderJob(fn, os.path.join(outdir, "%d.ly" % i),
+                             template=template, engine="fast"))
+    def end_to_end():
+        subprocess.check_call([sys.executable,
+                               os.path.join(ROOT, "doremi.py"),
+                               os.path.join(ROOT, "tunes", "old-hundred.drm"),
+                               os.path.join(outdir, "e2e.ly"),
+                               "-l", os.path.join(ROOT, "hymns",
+                                                  "praise-god.drmw"),
+                               "-e", "fast", "--no-cache"])
+
+    stages = [("parse tunes (parsimonious)",
+               parse_all(parsers["parsimonious"], tune_texts)),
+              ("parse tunes (fast)", parse_all(parsers["fast"], tune_texts)),
+              ("parse lyrics", parse_all(lyric_parser, lyric_texts)),
+              ("convert tunes", convert_all),
+              ("render tunes", render_jobs),
+              ("parse synthetic (parsimonious)",
+               parse_all(parsers["parsimonious"], [synthetic_text])),
+              ("parse synthetic (fast)",
+               parse_all(parsers["fast"], [synthetic_text])),
+              ("convert synthetic",
+               lambda: synthetic.to_lilypond(synthetic.key)),
+              ("end to end (doremi.py)", end_to_end)]
+
+    results = {}
+    try:
+        for name, fn in stages:
+            seconds = best_of(fn, args.repeat)
+            # the subprocess's memory is not traced, so leave it out
+            peak = None if fn is end_to_end else peak_memory(fn)[1]
+            results[name] = {"seconds": seconds, "peak_bytes": peak}
+    finally:
+        shutil.rmtree(outdir)
+    return results
+
+def compare_stages(results, baseline, threshold):
+    """Print how RESULTS compare with BASELINE and return the stages that
+are slower or larger by more than the fraction THRESHOLD"""
+    regressions = []
+    for name in sorted(results):
+        old = baseline.get(name)
+        if old is None:
+            continue
+        new = results[name]
+        for field in ("seconds", "peak_bytes"):
+            if not old.get(field) or new.get(field) is None:
+                continue
+            ratio = new[field] / old[field]
+            noise = (field == "seconds" and
+                     new[field] - old[field] < NOISE_SECONDS)
+            if ratio > 1 + threshold and not noise:
+                regressions.append("%s %s: %.2fx the baseline" %
+                                   (name, field, ratio))
+    return regressions
+
+def bench_stages(args):
+    """Time and peak memory of each stage of the pipeline, optionally
+saved as or checked against a JSON baseline"""
+    results = measure_stages(args)
+    print("stages: %d tunes, %d lyrics, synthetic %d voices of %d notes" %
+          (len(tune_files()), len(lyric_files()), args.voices, args.notes))
+    for name, result in sorted(results.items()):
+        peak = result["peak_bytes"]
+        print("  %-34s %9.3f ms total %9s MB peak" %
+              (name, result["seconds"] * 1000,
+               "-" if peak is None else "%.1f" % (peak / 1e6)))
+
+    if args.save_baseline:
+        with open(args.save_baseline, "w") as f:
+            json.dump(results, f, indent=1, sort_keys=True)
+        print("  baseline saved to %s" % args.save_baseline)
+
+    if args.baseline:
+        with open(args.baseline, "r") as f:
+            baseline = json.load(f)
+        regressions = compare_stages(results, baseline, args.threshold)
+        for regression in regressions:
+            print("  REGRESSION %s" % regression)
+        if regressions:
+            raise SystemExit(1)
+        print("  no stage regressed by more than %d%%" %
+              (args.threshold * 100))
+
+def bench_typeset(args):
+    """Throughput of the LilyPond runner at different pool sizes, using
+the stub LilyPond with a fixed delay standing in for typesetting"""
+    import tempfile
+
+    parser = make_parser("fast")
+    tunes = [parser.parse_file(fn) for fn in tune_files()
+             if "evening-shade" not in fn and "old-freedom" not in fn]
+    texts = [tune.to_lilypond(tune.key) for tune in tunes]
+    os.environ["STUB_LILYPOND_DELAY"] = str(args.typeset_delay)
+    outdir = tempfile.mkdtemp(prefix="doremi-bench-")
+    print("typeset: %d tunes, %.2fs per run" % (len(texts),
+                                                args.typeset_delay))
+    try:
+        for jobs in sorted(set([1, 2, 4, os.cpu_count() or 1])):
+            for use_stdin in (True, False):
+                runner = LilypondRunner(STUB_LILYPOND, jobs=jobs,
+                                        use_stdin=use_stdin)
+                items = [(ly, os.path.join(outdir, "tune%d" % i))
+                         for i, ly in enumerate(texts)]
+                start = time.time()
+                results = runner.run_many(items)
+                elapsed = time.time() - start
+                runner.close()
+                if not all(r.ok for r in results):
+                    raise SystemExit(results[0].error)
+                print("  %2d jobs, %-6s %8.3f s %8.1f tunes/s" %
+                      (jobs, "stdin" if use_stdin else "file", elapsed,
+                       runner.throughput()))
+    finally:
+        del os.environ["STUB_LILYPOND_DELAY"]
+        shutil.rmtree(outdir)
+
+def bench_variants(args):
+    """Rendering a matrix of variants of one tune from a single parse,
+against rendering each as a job of its own, parsing the tune again"""
+    import tempfile
+    from doremi.render import render_variants
+
+    fn = os.path.join(ROOT, "tunes", "old-hundred.drm")
+    variants = variant_matrix(["c major", "g major", "a major"],
+                              ["round", "aikin", "sacredharp", "walker"],
+                              [0, 1])
+    print("variants: %d of old-hundred, %s parser" % (len(variants),
+                                                     args.engine))
+    outdir = tempfile.mkdtemp(prefix="doremi-bench-")
+    try:
+        def reparse():
+            for i, variant in enumerate(variants):
+                render(RenderJob(fn, os.path.join(outdir, "%d.ly" % i),
+                                 key=variant.key, shapes=variant.shapes,
+                                 octaves=variant.octaves,
+                                 template=variant.template,
+                                 engine=args.engine))
+        def matrix():
+            render_variants(RenderJob(fn, os.path.join(outdir, "oh.ly"),
+                                      engine=args.engine),
+                            variants)
+
+        for label, run in [("a job per variant", reparse),
+                           ("render_variants", matrix)]:
+            report(label, best_of(run, args.repeat), len(variants),
+                   "variant")
+    finally:
+        shutil.rmtree(outdir)
+
+def bench_iterparse(args):
+    """Time and peak memory of parsing a long tune file whole, against
+streaming its events with iterparse"""
+    import tempfile
+    from doremi.stream import iterparse
+
+    fd, fn = tempfile.mkstemp(suffix=".drm", prefix="doremi-bench-")
+    with os.fdopen(fd, "w") as f:
+        f.write(synthetic_tune(args.stream_notes))
+    print("iterparse: 4 voices of %d notes, %.1f MB source" %
+          (args.stream_notes, os.path.getsize(fn) / 1e6))
+
+    parser = make_parser("fast")
+    def whole():
+        return note_count(parser.parse_file(fn))
+    def streamed():
+        return sum(1 for kind, value in iterparse(fn) if kind == "note")
+
+    try:
+        if whole() != streamed():
+            raise SystemExit("iterparse yields different notes")
+        for label, run in [("parse_file", whole), ("iterparse", streamed)]:
+            elapsed = best_of(run, args.repeat)
+            result, peak = peak_memory(run)
+            print("  %-34s %9.3f ms total %9.1f MB peak" %
+                  (label, elapsed * 1000, peak / 1e6))
+    finally:
+        os.remove(fn)
+
+def bench_midi(args):
+    """Cost of writing MIDI directly from parsed tunes, for the shipped
+tunes and a generated one"""
+    from doremi.midi import tune_to_midi
+
+    parser = make_parser("fast")
+    tunes = [parser.parse_file(fn) for fn in tune_files()]
+    synthetic = parser.parse(synthetic_tune(args.notes))
+    print("midi: %d sample tunes, synthetic 4 voices of %d notes" %
+          (len(tunes), args.notes))
+    report("sample tunes",
+           best_of(lambda: [tune_to_midi(tune) for tune in tunes],
+                   args.repeat),
+           len(tunes), "tune")
+    report("synthetic part-song",
+           best_of(lambda: tune_to_midi(synthetic), args.repeat),
+           note_count(synthetic), "note")
+
+def bench_parsecache(args):
+    """Parsing the shipped tunes and lyrics and a generated tune afresh,
+against loading them from the parse cache, after checking that every
+model loaded matches the one parsed"""
+    import tempfile
+    from doremi.parse_cache import ParseCache
+
+    tunes = [read_text(fn) for fn in tune_files()]
+    lyrics = [read_text(fn) for fn in lyric_files()]
+    synthetic = [synthetic_tune(args.notes)]
+
+    directory = tempfile.mkdtemp(prefix="doremi-bench-")
+    try:
+        cache = ParseCache(directory)
+        print("parsecache: %d tunes, %d lyrics, synthetic 4 voices of %d "
+              "notes" % (len(tunes), len(lyrics), args.notes))
+        for label, texts, kind, cold, warm in [
+                ("tunes, parsimonious", tunes, "tune",
+                 make_parser("parsimonious"),
+                 make_parser("parsimonious", parse_cache=cache)),
+                ("tunes, fast", tunes, "tune", make_parser("fast"),
+                 make_parser("fast", parse_cache=cache)),
+                ("synthetic, fast", synthetic, "tune", make_parser("fast"),
+                 make_parser("fast", parse_cache=cache)),
+                ("lyrics", lyrics, "lyric", LyricParser(),
+                 LyricParser(parse_cache=cache))]:
+            for text in texts:
+                warm.parse(text) # fill the cache
+                if kind == "tune" and (tune_signature(warm.parse(text)) !=
+                                       tune_signature(cold.parse(text))):
+                    raise SystemExit("cached tune differs from parsed")
+            report("%s, parsed" % label,
+                   best_of(lambda: [cold.parse(text) for text in texts],
+                           args.repeat),
+                   len(texts))
+            report("%s, cached" % label,
+                   best_of(lambda: [warm.parse(text) for text in texts],
+                           args.repeat),
+                   len(texts))
+    finally:
+        shutil.rmtree(directory, ignore_errors=True)
+
+def bench_startup(args):
+    """Wall-clock time of running the command line in a new process:
+printing its help, checking a tune, and rendering it with and without
+its caches"""
+    import subprocess
+    import tempfile
+
+    directory = tempfile.mkdtemp(prefix="doremi-bench-")
+    tune = os.path.join(ROOT, "tunes", "old-hundred.drm")
+    out = os.path.join(directory, "out.ly")
+    env = dict(os.environ, XDG_CACHE_HOME=directory)
+    def command(*arguments):
+        argv = [sys.executable, os.path.join(ROOT, "doremi.py")]
+        argv.extend(arguments)
+        def run():
+            subprocess.check_call(argv, env=env, stdout=subprocess.DEVNULL,
+                                  stderr=subprocess.DEVNULL)
+        return run
+
+    cases = [("interpreter alone", lambda: subprocess.check_call(
+                  [sys.executable, "-c", "pass"])),
+             ("--help", command("--help")),
+             ("check only", command("--check", tune)),
+             ("render, no caches", command(tune, out, "--no-cache")),
+             ("render, fast engine, no caches",
+              command(tune, out, "--no-cache", "-e", "fast")),
+             ("render, warm caches", command(tune, out))]
+    try:
+        print("startup: best of %d runs" % args.repeat)
+        for label, run in cases:
+            run() # fill the caches
+            print("  %-34s %9.1f ms" % (label,
+                                        best_of(run, args.repeat) * 1000))
+    finally:
+        shutil.rmtree(directory, ignore_errors=True)
+
+def bench_index(args):
+    """Finding the tunes in a meter in a generated library of copies of
+the shipped tunes: parsing every tune, against building the index,
+bringing it up to date and querying it"""
+    import tempfile
+    from doremi.index import TuneIndex, library_index, tune_meter
+
+    directory = tempfile.mkdtemp(prefix="doremi-bench-")
+    sources = [read_text(fn) for fn in tune_files()]
+    files = []
+    for i in range(args.library_tunes):
+        fn = os.path.join(directory, "tune-%05d.drm" % i)
+        with open(fn, "w") as f:
+            f.write(sources[i % len(sources)])
+        files.append(fn)
+    parser = make_parser("fast")
+    def scan():
+        return [fn for fn in files
+                if tune_meter(parser.parse_file(fn)) == "8.8.8.8"]
+    def build():
+        index = TuneIndex(os.path.join(directory, "cold.json"))
+        index.update_directory(directory)
+        index.save()
+    def touch():
+        for fn in files[::100]:
+            os.utime(fn)
+        return library_index(directory)
+
+    try:
+        print("index: %d tunes" % len(files))
+        start = time.time()
+        found = scan()
+        report("parse every tune", time.time() - start, len(files))
+        index = library_index(directory)
+        if sorted(fn for fn, entry in index.find_meter("L.M.")) != found:
+            raise SystemExit("the index finds different tunes")
+        report("build the index", best_of(build, 1), len(files))
+        report("load, nothing changed",
+               best_of(lambda: library_index(directory), args.repeat),
+               len(files))
+        report("load, 1% touched", best_of(touch, args.repeat), len(files))
+        report("find_meter",
+               best_of(lambda: [index.find_meter(meter) for meter in
+                                ("L.M.", "C.M.", "8.7.8.7", "12.12.12.12")],
+                       args.repeat),
+               4, "query")
+    finally:
+        shutil.rmtree(directory, ignore_errors=True)
+
+def synthetic_melody(rng, notes=80):
+    """Return the scale degrees and durations of a random melody of
+NOTES notes, moving mostly by step"""
+    degrees = [rng.randint(0, 7)]
+    for i in range(notes - 1):
+        degrees.append(degrees[-1] + rng.choice([-2, -1, -1, 0, 1, 1, 2, 3,
+                                                  -3, 4]))
+    durations = [rng.choice([240, 480, 480, 480, 960, 720])
+                 for i in range(notes)]
+    return degrees, durations
+
+def bench_similarity(args):
+    """Finding near-duplicate melodies in a generated corpus, some of
+whose tunes are transposed or slightly altered copies of others: the
+vectorized MelodyIndex against comparing sets of runs one pair at a
+time"""
+    from doremi.similarity import (NGRAM, MelodyIndex, melody_arrays,
+                                   ngram_codes, STEP_BASE, MAX_STEP)
+
+    rng = random.Random(args.seed)
+    melodies = []
+    copies = {}
+    for i in range(args.corpus_tunes):
+        if melodies and rng.random() < 0.05:
+            # a copy of an earlier tune in another octave, one note changed
+            j = rng.randrange(len(melodies))
+            degrees, durations = melodies[j]
+            degrees = [d + 7 for d in degrees]
+            degrees[rng.randrange(len(degrees))] += 1
+            melodies.append((degrees, list(durations)))
+            copies[i] = j
+        else:
+            melodies.append(synthetic_melody(rng))
+
+    index = MelodyIndex()
+    start = time.time()
+    for i, (degrees, durations) in enumerate(melodies):
+        index.add(i, degrees, durations)
+    index.build()
+    print("similarity: %d melodies of 80 notes, %d near copies" %
+          (len(melodies), len(copies)))
+    report("build", time.time() - start, len(melodies), "tune")
+
+    queries = sorted(copies)[:100]
+    def query_all():
+        return [index.similar(*melodies[i], limit=2, exclude=i)
+                for i in queries]
+    found = query_all()
+    missed = sum(1 for i, result in zip(queries, found)
+                 if copies[i] not in [name for name, score, same in result])
+    report("query (%d missed)" % missed, best_of(query_all, args.repeat),
+           len(queries), "query")
+
+    sets = [set(ngram_codes(melody_arrays(*melody)[0] + MAX_STEP,
+                            STEP_BASE, NGRAM).tolist())
+            for melody in melodies]
+    def pairwise():
+        for i in queries[:10]:
+            max((len(sets[i] & other) / float(len(sets[i] | other) or 1), j)
+                for j, other in enumerate(sets) if j != i)
+    report("query, pair at a time", best_of(pairwise, 1), 10, "query")
+
+    start = time.time()
+    pairs = index.duplicates(0.5)
+    report("all duplicates (%d pairs)" % len(pairs), time.time() - start,
+           len(melodies), "tune")
+
+def bench_ranges(args):
+    """The range and tessitura of every voice of a library of copies of
+the shipped tunes in every key: the batched NumPy analysis, against
+rendering each tune to MIDI note numbers one key at a time"""
+    from doremi.lilypond import key_context, key_contexts
+    from doremi.midi import voice_events
+    from doremi.ranges import TuneColumns, analyze_columns
+
+    parser = make_parser("fast")
+    shipped = [parser.parse_file(fn) for fn in tune_files()]
+    tunes = [shipped[i % len(shipped)] for i in range(args.library_tunes)]
+    keys = sorted(key_contexts())
+    columns = [TuneColumns(tune) for tune in tunes]
+    print("ranges: %d tunes in %d keys" % (len(tunes), len(keys)))
+
+    def per_key():
+        found = []
+        for tune in tunes[:len(tunes) // 10]:
+            for key in keys:
+                context = key_context(key)
+                for voice in tune:
+                    numbers = [event.number
+                               for event in voice_events(voice, context)
+                               if event.number is not None]
+                    if numbers:
+                        found.append((min(numbers), max(numbers)))
+        return found
+
+    expected = iter(per_key())
+    for analysis in analyze_columns(columns[:len(tunes) // 10], keys):
+        for i, key in enumerate(keys):
+            for j in range(len(analysis.voices)):
+                if (analysis.low[i, j], analysis.high[i, j]) != next(expected):
+                    raise SystemExit("the analysis finds different ranges")
+
+    report("one key at a time (a tenth)", best_of(per_key, 1),
+           len(tunes) // 10, "tune")
+    report("columns", best_of(lambda: [TuneColumns(tune) for tune in tunes],
+                              args.repeat),
+           len(tunes), "tune")
+    report("batched analysis",
+           best_of(lambda: analyze_columns(columns, keys), args.repeat),
+           len(tunes), "tune")
+
+def bench_measures(args):
+    """Finding the notes of measures of a generated tune: scanning the
+voice and adding up durations for every lookup, against bisecting a
+MeasureIndex; and rendering an excerpt against the whole tune"""
+    from doremi.measures import (MeasureIndex, duration_fraction, excerpt,
+                                 time_fraction, tune_measures)
+
+    tune = make_parser("fast").parse(synthetic_tune(args.stream_notes))
+    voice = tune[0]
+    length = time_fraction(tune.time)
+    def scan(number):
+        # the first and last item of measure NUMBER, counted from 1
+        now = 0
+        begin = end = None
+        for i, item in enumerate(voice):
+            if isinstance(item, Note):
+                measure = int(now // length) + 1
+                if measure == number and begin is None:
+                    begin = i
+                elif measure > number:
+                    end = i
+                    break
+                now += duration_fraction(item.duration)
+        return begin, end
+
+    start = time.time()
+    index = MeasureIndex(voice, tune.time)
+    print("measures: a voice of %d notes in %d measures" %
+          (args.stream_notes, len(index)))
+    report("build the index", time.time() - start, args.stream_notes, "note")
+    rng = random.Random(args.seed)
+    numbers = [rng.randint(1, len(index)) for i in range(100)]
+    for number in numbers[:5]:
+        found = index.items(number)
+        if (found.start, found.stop) != scan(number):
+            raise SystemExit("the index finds different notes")
+    report("scan for a measure",
+           best_of(lambda: [scan(n) for n in numbers[:5]], 1), 5, "lookup")
+    report("index lookup",
+           best_of(lambda: [index.items(n) for n in numbers], args.repeat),
+           len(numbers), "lookup")
+    report("render the whole tune",
+           best_of(lambda: tune.to_lilypond(tune.key), args.repeat),
+           1, "tune")
+    indexes = tune_measures(tune)
+    report("index every voice",
+           best_of(lambda: tune_measures(tune), args.repeat), 1, "tune")
+    report("render measures 10-20 from the indexes",
+           best_of(lambda: excerpt(tune, 10, 20,
+                                   indexes).to_lilypond(tune.key),
+                   args.repeat),
+           1, "tune")
+
+def bench_partwriting(args):
+    """Part-writing checks over a library of copies of the shipped tunes:
+finding parallel fifths and octaves by walking every pair of voices note
+by note, against comparing the columns of VerticalSlices"""
+    from doremi.partwriting import (PERFECT, SILENT, VOICE_ORDER,
+                                    VerticalSlices, parallels, problems,
+                                    tune_context, voice_notes)
+
+    parser = make_parser("fast")
+    shipped = [parser.parse_file(fn) for fn in tune_files()]
+    tunes = [shipped[i % len(shipped)] for i in range(args.library_tunes)]
+    print("partwriting: %d tunes" % len(tunes))
+
+    def sounding(notes, tick):
+        # the pitch sounding at TICK in NOTES, walking them from the start
+        starts, ends, pitches, items = notes
+        for start, end, pitch in zip(starts, ends, pitches):
+            if start <= tick < end:
+                return int(pitch)
+        return SILENT
+
+    def pairwise(tune):
+        context = tune_context(tune)
+        notes = [voice_notes(voice, context) for voice in tune]
+        names = [voice.name.lower() for voice in tune]
+        choir = [names.index(name) for name in VOICE_ORDER if name in names]
+        count = 0
+        for a, i in enumerate(choir):
+            for j in choir[a + 1:]:
+                onsets = sorted(set(notes[i][0].tolist()) |
+                                set(notes[j][0].tolist()))
+                before = None
+                for tick in onsets:
+                    now = sounding(notes[i], tick), sounding(notes[j], tick)
+                    if (before and SILENT not in before and
+                        SILENT not in now and
+                        abs(before[0] - before[1]) % 12 in PERFECT and
+                        abs(now[0] - now[1]) % 12 ==
+                        abs(before[0] - before[1]) % 12 and
+                        (now[0] > before[0]) == (now[1] > before[1]) and
+                        now[0] != before[0] and now[1] != before[1]):
+                        count += 1
+                    before = now
+        return count
+
+    few = tunes[:len(tunes) // 10]
+    for tune in shipped:
+        if pairwise(tune) != len(parallels(VerticalSlices(tune))):
+            raise SystemExit("the slices find different parallels")
+    report("pair by pair (a tenth)",
+           best_of(lambda: [pairwise(tune) for tune in few], 1),
+           len(few), "tune")
+    report("vertical slices",
+           best_of(lambda: [VerticalSlices(tune) for tune in tunes],
+                   args.repeat),
+           len(tunes), "tune")
+    report("slices and every check",
+           best_of(lambda: [problems(tune) for tune in tunes], args.repeat),
+           len(tunes), "tune")
+
+    tune = make_parser("fast").parse(synthetic_tune(args.stream_notes))
+    report("every check of a generated tune of %d notes" % args.stream_notes,
+           best_of(lambda: problems(tune), 1), 1, "tune")
+
+BENCHMARKS = {"grammar": bench_grammar,
+              "measures": bench_measures,
+              "partwriting": bench_partwriting,
+              "ranges": bench_ranges,
+              "similarity": bench_similarity,
+              "index": bench_index,
+              "startup": bench_startup,
+              "parsecache": bench_parsecache,
+              "midi": bench_midi,
+              "iterparse": bench_iterparse,
+              "variants": bench_variants,
+              "stages": bench_stages,
+              "typeset": bench_typeset,
+              "streaming": bench_streaming,
+              "memory": bench_memory,
+              "engines": bench_engines,
+              "keys": bench_keys}
+
+if __name__ == "__main__":
+    p = argparse.ArgumentParser()
+    p.add_argument("names", nargs="*",
+                   help="the benchmarks to run (default: all of %s)" %
+                   ", ".join(sorted(BENCHMARKS)))
+    p.add_argument("--repeat", "-r", type=int, default=5,
+                   help="take the best of REPEAT runs (default 5)")
+    p.add_argument("--notes", "-n", type=int, default=2000,
+                   help="notes per voice in generated tunes (default 2000)")
+    p.add_argument("--voice-notes", type=int, default=100000,
+                   help="notes in generated voices (default 100000)")
+    p.add_argument("--corpus-notes", type=int, default=1000000,
+                   help="notes in the generated memory corpus (default 1000000)")
+    p.add_argument("--stream-notes", type=int, default=50000,
+                   help="notes per voice in the streaming test (default 50000)")
+    p.add_argument("--library-tunes", type=int, default=2000,
+                   help="tunes in the generated library (default 2000)")
+    p.add_argument("--corpus-tunes", type=int, default=10000,
+                   help="melodies in the similarity corpus (default 10000)")
+    p.add_argument("--engine", "-e", choices=ENGINES, default="parsimonious",
+                   help='the parser for the variants test (default "parsimonious")')
+    p.add_argument("--voices", type=int, default=4,
+                   help="voices in generated tunes (default 4)")
+    p.add_argument("--modifier-density", type=float, default=0.1,
+                   help="fraction of generated notes with a modifier (default 0.1)")
+    p.add_argument("--seed", type=int, default=0,
+                   help="random seed for generated tunes (default 0)")
+    p.add_argument("--save-baseline", metavar="FILE",
+                   help="save the stage timings to the JSON file FILE")
+    p.add_argument("--baseline", metavar="FILE",
+                   help="fail if a stage is slower than in the JSON file FILE")
+    p.add_argument("--threshold", type=float, default=0.25,
+                   help="the fraction by which a stage may regress (default 0.25)")
+    p.add_argument("--typeset-delay", type=float, default=0.2,
+                   help="seconds the stub LilyPond takes per tune (default 0.2)")
+    args = p.parse_args()
+
+    for name in args.names or sorted(BENCHMARKS):
+        BENCHMARKS[name](args)
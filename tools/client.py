@@ -0,0 +1,110 @@
+#!/usr/bin/env python
+"""A test client for the Doremi render server
+
+Send each tune to a server and report how long every request took, e.g.
+
+    python doremi.py --serve /tmp/doremi.sock &
+    python tools/client.py --socket /tmp/doremi.sock tunes/*.drm
+
+With no --socket, a server is started on standard input for the run.
+Lyrics are taken from a .drmw file of the same name in --lyricdir, if
+there is one, and outputs are written to --outdir if it is given.
+"""
+
+from __future__ import print_function
+
+import argparse
+import codecs
+import os
+import sys
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from doremi.server import FORMATS, Client
+
+def read(fn):
+    with codecs.open(fn, "r", "utf-8") as f:
+        return f.read()
+
+def make_request(fn, args):
+    request = {"tune": read(fn),
+               "format": args.format,
+               "engine": args.engine,
+               "key": args.key,
+               "shapes": args.shapes,
+               "octaves": args.octaves,
+               "template": args.template}
+    if args.lyricdir:
+        lyricfile = os.path.join(args.lyricdir,
+                                 os.path.splitext(os.path.basename(fn))[0] +
+                                 ".drmw")
+        if os.path.exists(lyricfile):
+            request["lyric"] = read(lyricfile)
+    return request
+
+def write_output(fn, response, args):
+    outfile = os.path.join(args.outdir,
+                           "%s.%s" % (os.path.splitext(os.path.basename(fn))[0],
+                                      args.format))
+    if isinstance(response["output"], bytes):
+        with open(outfile, "wb") as f:
+            f.write(response["output"])
+    else:
+        with codecs.open(outfile, "w", "utf-8") as f:
+            f.write(response["output"])
+
+if __name__ == "__main__":
+    p = argparse.ArgumentParser()
+    p.add_argument("tunes", nargs="+", help="the Doremi files to render")
+    p.add_argument("--socket", "-S",
+                   help="the server's Unix socket (default: start a server)")
+    p.add_argument("--jobs", "-j", type=int,
+                   help="server threads, when starting a server")
+    p.add_argument("--format", "-f", choices=FORMATS, default="ly")
+    p.add_argument("--engine", "-e", default="parsimonious")
+    p.add_argument("--key", "-k")
+    p.add_argument("--shapes", "-s")
+    p.add_argument("--octaves", "-o", type=int, default=0)
+    p.add_argument("--template", "-t")
+    p.add_argument("--lyricdir", "-l",
+                   help="the directory holding .drmw files named like the tunes")
+    p.add_argument("--outdir", "-d", help="write the outputs here")
+    p.add_argument("--repeat", "-r", type=int, default=1,
+                   help="send every tune REPEAT times")
+    args = p.parse_args()
+
+    server_args = ["--jobs", str(args.jobs)] if args.jobs else []
+    client = Client(args.socket, server_args)
+    files = args.tunes * args.repeat
+    try:
+        start = time.time()
+        responses = client.request_many([make_request(fn, args)
+                                         for fn in files])
+        elapsed = time.time() - start
+    finally:
+        client.close()
+
+    if args.outdir and not os.path.isdir(args.outdir):
+        os.makedirs(args.outdir)
+
+    failed = 0
+    for fn, response in zip(files, responses):
+        timings = response["timings"]
+        stages = " ".join("%s %.1fms" % (name, timings[name] * 1000)
+                          for name in ("queued", "parse", "render",
+                                       "lilypond", "total")
+                          if name in timings)
+        if response["ok"]:
+            print("%-40s %s" % (os.path.basename(fn), stages))
+            if args.outdir:
+                write_output(fn, response, args)
+        else:
+            failed += 1
+            print("%-40s FAILED %s" % (os.path.basename(fn),
+                                       response["error"]))
+    print("%d requests in %.2fs, %.1f/s (%d failed)" %
+          (len(files), elapsed, len(files) / elapsed, failed),
+          file=sys.stderr)
+    sys.exit(1 if failed else 0)